@@ -0,0 +1,153 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from ingest import read_cached_frame, write_cached_frame, CACHE_FORMAT
+from instrumentation import Measurement
+from pipeline import Stage
+from records import decode_records, encode_records
+from synthetic import generate_inventory
+
+# Inventory sizes the benchmark can run at, roughly 50 applications per workstation as in the agency exports
+SCALES = {
+    '100k': {'rows': 100000, 'apps': 2000, 'workstations': 2000},
+    '1M': {'rows': 1000000, 'apps': 10000, 'workstations': 20000},
+    '10M': {'rows': 10000000, 'apps': 40000, 'workstations': 200000},
+}
+
+RESULTS_DIR = 'benchmark_results'
+
+# A stage is reported as a regression when it is this much slower than the baseline, and by at least MIN_SECONDS
+TOLERANCE = 0.25
+MIN_SECONDS = 0.5
+
+
+# full-script.py can't be imported by name because of the dash, so it is loaded from its path
+def load_full_script():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'full-script.py')
+    spec = importlib.util.spec_from_file_location('full_script', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Stands in for full-script's read stage: loads the generated inventory from a columnar copy and
+# dictionary-encodes it, the way load_inventory does for exports that are already in the ingest cache
+def read_generated(path):
+    data = encode_records(read_cached_frame(path))
+    return data.drop(columns=['AD_Site_Name0', 'User', 'Agency'])
+
+
+# Runs every stage of full-script.py on a generated inventory of the given scale, in a scratch folder so the
+# report files don't land in the working directory, and returns one measurement entry per stage.
+# A stage that fails is recorded with its error and the stages after it still run if they can.
+def benchmark_scale(full_script, scale, seed=0, candidates=None, trace_memory=False):
+    settings = SCALES[scale]
+    print('Generating ' + scale + ' rows...')
+    with Measurement() as generation:
+        data = generate_inventory(seed=seed, **settings)
+    rows = len(data)
+
+    workdir = tempfile.mkdtemp(prefix='benchmark_' + scale + '_')
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        # The columnar copy holds plain values, like the ingest cache
+        path = os.path.join(workdir, 'inventory.' + CACHE_FORMAT)
+        write_cached_frame(decode_records(data), path)
+        del data
+
+        if candidates is not None:
+            full_script.BUNDLE_CANDIDATES = candidates
+        full_script.PIPELINE_DIR = os.path.join(workdir, 'checkpoints')
+        pipeline = full_script.build_pipeline([], trace_memory=trace_memory)
+        pipeline.stages['read'] = Stage('read', read_generated, params={'path': path}, checkpoint=False)
+
+        failed = []
+        for name in pipeline.stages:
+            if any(input_name in failed for input_name in pipeline.stages[name].inputs):
+                failed.append(name)
+                pipeline.report.add({'stage': name, 'status': 'skipped'})
+                continue
+            try:
+                pipeline.result(name)
+            except Exception as error:
+                failed.append(name)
+                print(name + ' failed: ' + repr(error))
+                pipeline.report.add({'stage': name, 'status': 'failed', 'error': repr(error)})
+
+        # Output files are written in the background; the time still spent waiting for them after the last stage
+        # is the part of the writing that did not overlap with computation
+        with Measurement() as writes:
+            full_script.writer.wait()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {'scale': scale, 'rows': rows, 'settings': settings, 'seed': seed,
+            'generate_seconds': generation.result['wall_seconds'], 'output_wait_seconds': writes.result['wall_seconds'],
+            'stages': pipeline.report.stages}
+
+
+# Stages that got slower than in the baseline results, as (scale, stage, baseline seconds, new seconds)
+def find_regressions(results, baseline, tolerance=TOLERANCE, min_seconds=MIN_SECONDS):
+    regressions = []
+    baseline_times = {(run['scale'], entry['stage']): entry.get('wall_seconds')
+                      for run in baseline['runs'] for entry in run['stages']}
+    for run in results['runs']:
+        for entry in run['stages']:
+            before = baseline_times.get((run['scale'], entry['stage']))
+            after = entry.get('wall_seconds')
+            if before is None or after is None:
+                continue
+            if after > before * (1 + tolerance) and after - before >= min_seconds:
+                regressions.append((run['scale'], entry['stage'], before, after))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times every stage of full-script.py on generated inventories.')
+    parser.add_argument('--scales', nargs='+', default=['100k', '1M'], choices=list(SCALES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--candidates', choices=['window', 'lsh'], help="bundling candidates (default: full-script's BUNDLE_CANDIDATES)")
+    parser.add_argument('--trace-memory', action='store_true', help='also record tracemalloc peaks per stage (slower)')
+    parser.add_argument('--output', help='where to save the results (default: ' + RESULTS_DIR + '/<date and time>.json)')
+    parser.add_argument('--baseline', help='earlier results to compare with; exits with status 1 if a stage regressed')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown before a stage counts as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    full_script = load_full_script()
+    results = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+               'platform': platform.platform(), 'cpus': os.cpu_count(), 'cache_format': CACHE_FORMAT,
+               'candidates': args.candidates or full_script.BUNDLE_CANDIDATES, 'runs': []}
+    for scale in args.scales:
+        results['runs'].append(benchmark_scale(full_script, scale, seed=args.seed, candidates=args.candidates,
+                                               trace_memory=args.trace_memory))
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y-%m-%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Benchmark results written to ' + output)
+
+    for run in results['runs']:
+        print(run['scale'] + ' (' + str(run['rows']) + ' rows)')
+        for entry in run['stages']:
+            seconds = entry.get('wall_seconds')
+            print('  ' + entry['stage'].ljust(12) + (entry['status'] if seconds is None else '{:9.2f}s'.format(seconds)))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, tolerance=args.tolerance)
+        for scale, stage, before, after in regressions:
+            print('Regression: ' + stage + ' at ' + scale + ' took {:.2f}s, was {:.2f}s'.format(after, before))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against ' + args.baseline)
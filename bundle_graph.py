@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from name_similarity import NameSimilarity
+
+BUNDLE_TABLE_COLUMNS = ['bundle', 'bundle size', 'Publisher', 'Application', 'Version', '# of unique installations',
+                        'workstations', 'score', 'anchor score']
+
+
+# Sparse application x workstation matrix (1 where the application is installed), straight from the
+# WorkstationIndex, whose sorted ID lists are already laid out like a CSR matrix
+def installation_matrix(workstation_index):
+    return sparse.csr_matrix((np.ones(len(workstation_index.workstation_ids), dtype=np.int32),
+                              workstation_index.workstation_ids, workstation_index.offsets),
+                             shape=(len(workstation_index.keys), max(len(workstation_index.workstation_names), 1)))
+
+
+# Jaccard similarities (0-100) between all the rows of a small application x workstation matrix
+def similarity_matrix(matrix):
+    shared = (matrix @ matrix.T).toarray().astype(float)
+    sizes = np.diag(shared)
+    union = sizes[:, None] + sizes[None, :] - shared
+    return np.divide(shared, union, out=np.zeros_like(shared), where=union > 0) * 100
+
+
+# Pairs of rows of `matrix` whose workstation sets have a Jaccard similarity of at least min_similarity, as arrays
+# (i, j, similarity) with i < j. The shared-workstation counts are one sparse product of the matrix with its
+# transpose, computed block_size rows at a time so that only the pairs that pass are kept in memory.
+def similar_pairs(matrix, min_similarity=0.7, block_size=512):
+    sizes = np.diff(matrix.indptr).astype(np.int64)
+    transposed = matrix.T.tocsr()
+    rows, columns, similarities = [], [], []
+    for start in range(0, matrix.shape[0], block_size):
+        shared = (matrix[start:start + block_size] @ transposed).tocoo()
+        i = shared.row.astype(np.int64) + start
+        j = shared.col.astype(np.int64)
+        upper = j > i
+        i, j, counts = i[upper], j[upper], shared.data[upper].astype(np.int64)
+        similarity = counts / (sizes[i] + sizes[j] - counts).astype(float)
+        keep = similarity >= min_similarity
+        rows.append(i[keep])
+        columns.append(j[keep])
+        similarities.append(similarity[keep])
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(rows), np.concatenate(columns), np.concatenate(similarities)
+
+
+# Finds bundles among all the applications of a dashboard (with or without versions) installed on at least
+# min_installations workstations, instead of walking the dashboard greedily from the most installed application.
+# Every pair of applications installed on at least min_similarity (Jaccard) of the same workstations is an edge of
+# a co-installation graph, and each connected component of that graph is a bundle. Rows of the same application
+# (other publishers or versions) are never linked to each other.
+# The checks of checkIfBundle can be switched on as filters on the edges: check_names keeps only pairs whose
+# cleaned names share a word and score at least name_threshold (None uses the NameSimilarity's, 50 with
+# fuzz.partial_ratio), check_versions only pairs with the same version. name_similarity is an optional
+# NameSimilarity to reuse (e.g. built on a shared NameTable).
+# Returns one row per bundle member: its bundle number (largest bundles first), the member's application, its
+# # of workstations, `score`, the mean Jaccard similarity (0-100) with the other members, and `anchor score`, the
+# similarity with the bundle's most installed member (listed first).
+def find_bundles(dashboard, workstation_index, min_similarity=0.7, min_installations=5, check_names=False,
+                 check_versions=False, name_similarity=None, block_size=512, name_threshold=None):
+    dashboard = dashboard.sort_values(by=['# of unique installations'], ascending=False).reset_index(drop=True)
+
+    # The graph has one node per distinct application; dashboard rows are attached to their application
+    rows_by_app = defaultdict(list)
+    for index, name in enumerate(dashboard['Application']):
+        code = workstation_index.lookup.get(name)
+        if code is not None and workstation_index.sizes[code] >= min_installations:
+            rows_by_app[code].append(index)
+    codes = np.array(sorted(rows_by_app), dtype=np.int64)
+    installations = installation_matrix(workstation_index)
+    app_i, app_j, app_similarity = similar_pairs(installations[codes], min_similarity=min_similarity, block_size=block_size)
+    print('Co-installed application pairs: ' + str(len(app_i)))
+
+    if check_names and name_similarity is None:
+        name_similarity = NameSimilarity(dashboard['Application'])
+    applications = dashboard['Application'].astype(object).values
+    versions = dashboard['Version'].astype(object).values
+
+    # Edges between dashboard rows, with the optional name and version filters
+    edge_rows, edge_columns = [], []
+    for a, b in zip(app_i, app_j):
+        for index in rows_by_app[codes[a]]:
+            for other_index in rows_by_app[codes[b]]:
+                if check_versions and versions[index] != versions[other_index]:
+                    continue
+                if check_names and not (name_similarity.shares_word(applications[index], applications[other_index])
+                                        and name_similarity.similar(applications[index], applications[other_index], name_threshold)):
+                    continue
+                edge_rows.append(index)
+                edge_columns.append(other_index)
+
+    graph = sparse.coo_matrix((np.ones(len(edge_rows)), (edge_rows, edge_columns)), shape=(len(dashboard), len(dashboard)))
+    _, labels = connected_components(graph, directed=False)
+    linked = np.zeros(len(dashboard), dtype=bool)
+    linked[edge_rows] = True
+    linked[edge_columns] = True
+    return bundle_table(dashboard, workstation_index, installations, labels, linked)
+
+
+# Lays out the bundles (components with at least two rows) as a table, largest bundles first and each bundle's
+# members by # of unique installations
+def bundle_table(dashboard, workstation_index, installations, labels, linked):
+    members = dashboard[linked].assign(component=labels[linked])
+    if len(members) == 0:
+        return pd.DataFrame(columns=BUNDLE_TABLE_COLUMNS)
+    sizes = members.groupby('component').size()
+    members = members.assign(**{'bundle size': members['component'].map(sizes).values})
+    members = members.sort_values(by=['bundle size', 'component', '# of unique installations'],
+                                  ascending=[False, True, False], kind='stable')
+    members['bundle'] = members.groupby('component', sort=False).ngroup() + 1
+
+    scores, anchor_scores = [], []
+    for _, bundle in members.groupby('bundle', sort=True):
+        codes = [workstation_index.lookup[name] for name in bundle['Application']]
+        similarity = similarity_matrix(installations[codes])
+        size = len(codes)
+        scores.extend(((similarity.sum(axis=1) - np.diag(similarity)) / (size - 1)).round(1))
+        anchor_scores.extend(similarity[0].round(1))
+    members['score'] = scores
+    members['anchor score'] = anchor_scores
+    members['workstations'] = [workstation_index.count(name) for name in members['Application']]
+    return members[BUNDLE_TABLE_COLUMNS].reset_index(drop=True)
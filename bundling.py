@@ -0,0 +1,237 @@
+from collections import defaultdict
+
+import cProfile
+import os
+import pstats
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from minhash import lsh_candidate_pairs, minhash_signatures
+from name_similarity import NameSimilarity, clean_name, common_words, is_number  # noqa: F401 (re-exported)
+from parallel_bundling import cached_bundle_checks, parallel_bundle_checks
+from score_cache import WORKSTATION_THRESHOLD
+
+### create a spreadsheet that lists applications and their potential bundles based on fuzzywuzzy scores
+
+# Converts application at row index to form "[name] || [publisher] || [version]"
+def stringify(dashboard, index):
+    name = dashboard.loc[[index]]['Application'].iat[0]
+    pub = dashboard.loc[[index]]['Publisher'].iat[0]
+    version = dashboard.loc[[index]]['Version'].iat[0]
+    return name + " || " + pub + " || " + version
+
+# Confirms that cleaned potential bundled application names have common words
+def checkIfSubword(name, other):
+    name_clean = clean_name(name)
+    other_clean = clean_name(other)
+    # If any of the apps are 1 word long, don't have to have a common string
+    if len(name) == 1 or len(other) == 1:
+        return True
+    return bool(set(name_clean) & set(other_clean))
+
+# Checks that two applications are installed on at least 70% of the same workstations,
+# using the precomputed application -> workstation index instead of scanning the install data
+def checkIfSimilarWorkstations(workstation_index, name, other, threshold=WORKSTATION_THRESHOLD):
+    res = workstation_index.jaccard(name, other) * 100
+    # This similarity threshold (70%) can be adjusted higher or lower (createBundle's workstation_threshold)
+    return res >= threshold
+
+# Checks that two applications have the same version number
+def checkVersion(dashboard, index, other_index):
+    v1 = dashboard.loc[[index]]['Version'].iat[0]
+    v2 = dashboard.loc[[other_index]]['Version'].iat[0]
+    return v1 == v2
+
+# Checks if two applications should be bundled.
+# With a NameSimilarity engine the cleaned names and fuzzy scores come from its cache instead of being recomputed per pair.
+# name_threshold (None uses the engine's threshold, 50 without one) and workstation_threshold (70%) can be changed.
+def checkIfBundle(dashboard, workstation_index, index, other_index, name_similarity=None, name_threshold=None, workstation_threshold=WORKSTATION_THRESHOLD):
+    name = dashboard.loc[[index]]['Application'].iat[0]
+    other = dashboard.loc[[other_index]]['Application'].iat[0]
+    if name_similarity is not None:
+        return checkVersion(dashboard, index, other_index) and name_similarity.shares_word(name, other) and name_similarity.similar(name, other, name_threshold) and checkIfSimilarWorkstations(workstation_index, name, other, workstation_threshold)
+    name_clean = clean_name(name)
+    other_clean = clean_name(other)
+    # Fuzzywuzzy checks that the names of the two applications are roughly similar (>50% similarity)
+    return checkVersion(dashboard, index, other_index) and checkIfSubword(name, other) and fuzz.partial_ratio(name_clean, other_clean) >= (50 if name_threshold is None else name_threshold) and checkIfSimilarWorkstations(workstation_index, name, other, workstation_threshold)
+
+# Scores the name of the row at index against the names of all its candidates that checkIfBundle would score (same
+# version, sharing a word) as one block, so the checks then find the scores in the NameSimilarity cache: one sparse
+# matrix product per row with name_method='ngram'. Pairs already in the score_cache are left out.
+def scoreCandidates(dashboard, name_similarity, index, others, score_cache=None):
+    applications, versions = dashboard['Application'].values, dashboard['Version'].values
+    name = applications[index]
+    block = [applications[other] for other in others
+             if versions[other] == versions[index] and name_similarity.shares_word(name, applications[other])
+             and (score_cache is None or score_cache.lookup(index, other) is None)]
+    if block:
+        name_similarity.score_matrix([name], block)
+
+# Yields the rows whose # of unique installations is within 10% of the row at index:
+# first the rows above it (closest first), then the rows below it
+def windowNeighbours(dashboard, index, count, maxRows):
+    # parse through above rows until count >10% difference
+    tempIndex = index - 1
+    while tempIndex >= 0 and dashboard.loc[[tempIndex]]['# of unique installations'].iat[0] - count <= count/10:
+        yield tempIndex
+        tempIndex -= 1
+    # parse through below rows until count <10% difference
+    tempIndex = index + 1
+    while tempIndex < maxRows and count - dashboard.loc[[tempIndex]]['# of unique installations'].iat[0] <= count/10:
+        yield tempIndex
+        tempIndex += 1
+
+# Finds, for every row of the (sorted) dashboard, the rows whose applications are likely to share at least
+# 70% of their workstations, using MinHash signatures and LSH buckets instead of the installation counts.
+# Rows of the same application are always candidates for each other. Neighbours are ordered like windowNeighbours.
+# Only pairs with an application that has a row with at least min_count installations are kept, since the
+# createBundle loop never starts a bundle from the other rows.
+def lshNeighbours(dashboard, workstation_index, num_perm=128, bands=32, min_count=100):
+    signatures = minhash_signatures(workstation_index, num_perm=num_perm)
+    required = np.zeros(len(workstation_index.keys), dtype=bool)
+    for name in dashboard.loc[dashboard['# of unique installations'] >= min_count, 'Application']:
+        code = workstation_index.lookup.get(name)
+        if code is not None:
+            required[code] = True
+    app_pairs = lsh_candidate_pairs(signatures, bands=bands, mask=workstation_index.sizes > 0, required=required)
+
+    rows_by_app = defaultdict(list)
+    for index, name in enumerate(dashboard['Application']):
+        code = workstation_index.lookup.get(name)
+        if code is not None:
+            rows_by_app[code].append(index)
+
+    neighbours = defaultdict(set)
+    for rows in rows_by_app.values():
+        for index in rows:
+            neighbours[index].update(rows)
+    for code, other_code in app_pairs:
+        for index in rows_by_app.get(code, []):
+            for other_index in rows_by_app.get(other_code, []):
+                neighbours[index].add(other_index)
+                neighbours[other_index].add(index)
+
+    ordered = {}
+    for index, others in neighbours.items():
+        above = sorted((i for i in others if i < index), reverse=True)
+        below = sorted(i for i in others if i > index)
+        ordered[index] = above + below
+    print('LSH candidate pairs: ' + str(sum(len(others) for others in ordered.values()) // 2))
+    return ordered
+
+# Creates a csv of potential bundles, taking in a dashboard and the WorkstationIndex of the install data as input.
+# candidates='window' compares each application with those whose # of unique installations is within 10%;
+# candidates='lsh' compares it with those MinHash/LSH finds likely to share at least 70% of their workstations,
+# which needs far fewer comparisons and also finds bundles whose counts differ by more than 10%.
+# name_method is passed to NameSimilarity: 'partial_ratio' keeps the original fuzzy scores, 'ngram' is faster.
+# name_table is an optional normalization.NameTable to share cleaned names with the normalization stage.
+# profile is an optional path to save cProfile statistics of the comparison loop to (the top entries are printed too);
+# the checks are then made in this process whatever `workers` is, so they show up in the profile.
+# workers > 1 (None uses every core) checks the candidate pairs in a pool of processes first (see parallel_bundling.py)
+# and the loop only replays the grouping; the bundles are the same. It only supports name_method='partial_ratio'.
+# score_cache is an optional score_cache.PairScoreCache: pairs scored in an earlier run, whose workstation sets
+# haven't changed, are checked from their cached scores instead of being scored again, and the cache is saved at the end.
+# name_threshold is the name score two applications need (None uses name_method's, 50 for partial_ratio) and
+# workstation_threshold the percentage of shared workstations (70); cached scores are reused whatever they are.
+# Returns the bundles that were written.
+def createBundle(dashboard, workstation_index, output='v_bundles.csv', candidates='window', name_method='partial_ratio', name_table=None, profile=None, workers=1, score_cache=None,
+                 name_threshold=None, workstation_threshold=WORKSTATION_THRESHOLD):
+    if candidates not in ('window', 'lsh'):
+        raise ValueError("candidates must be 'window' or 'lsh', not " + repr(candidates))
+
+    # Sorts dashboard by number of unique installations
+    dashboard = dashboard.sort_values(by=['# of unique installations'], ascending=False).reset_index(drop=True)
+
+    maxRows = len(dashboard.index)
+    bundleList = []
+
+    # Creates a dashboard column "grouped" that indicates whether an application has been bundled
+    dashboard['grouped'] = False
+
+    # Cleans and tokenizes every distinct application name once for all the name checks
+    name_similarity = NameSimilarity(dashboard['Application'], method=name_method, name_table=name_table)
+
+    lsh_neighbours = lshNeighbours(dashboard, workstation_index) if candidates == 'lsh' else None
+
+    if profile:
+        # Checks made in worker processes would be missing from the profile
+        workers = 1
+    elif workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and name_method != 'partial_ratio':
+        raise ValueError("workers > 1 only supports name_method='partial_ratio'")
+
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    if score_cache is not None:
+        if score_cache.method != name_method:
+            raise ValueError('score_cache holds ' + repr(score_cache.method) + ' scores, not ' + repr(name_method))
+        score_cache.bind(dashboard, workstation_index, name_similarity, name_threshold, workstation_threshold)
+    if workers > 1 and score_cache is not None:
+        passed = cached_bundle_checks(dashboard, workstation_index, name_similarity, score_cache, workers, lsh_neighbours)
+    elif workers > 1:
+        passed = parallel_bundle_checks(dashboard, workstation_index, name_similarity, workers, lsh_neighbours,
+                                        name_threshold=name_threshold, workstation_threshold=workstation_threshold)
+    else:
+        passed = None
+
+    # needs to be sorted by count
+    for index, row in dashboard.iterrows():
+        bundle = []
+        count = row['# of unique installations']
+        # stop algo if # of installations is less than 100
+        if count < 100:
+            break
+        # if the application has been grouped, skip it
+        if dashboard.loc[[index]]['grouped'].iat[0] == True:
+            continue
+        if passed is not None:
+            # Only the candidates that already passed checkIfBundle in the worker processes
+            others = passed.get(index, [])
+        elif candidates == 'lsh':
+            others = lsh_neighbours.get(index, [])
+        else:
+            others = list(windowNeighbours(dashboard, index, count, maxRows))
+        if passed is None:
+            scoreCandidates(dashboard, name_similarity, index, others, score_cache)
+        for tempIndex in others:
+            if passed is not None:
+                bundled = True
+            elif score_cache is not None:
+                bundled = checkVersion(dashboard, index, tempIndex) and score_cache.check(index, tempIndex)
+            else:
+                bundled = checkIfBundle(dashboard, workstation_index, index, tempIndex, name_similarity, name_threshold, workstation_threshold)
+            if bundled:
+                # Setting grouped for the application being analyzed
+                dashboard.at[index, 'grouped'] = True
+                dashboard.at[tempIndex, 'grouped'] = True
+                bundle.append(stringify(dashboard, tempIndex))
+        # indicate that the program is running
+        if index % 10 == 0:
+            print(index, end=' ')
+        # insert the app name and the count
+        bundle.insert(0, stringify(dashboard, index))
+        bundle.insert(1, count)
+        bundleList.append(bundle)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile)
+        print()
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+        print('Bundling profile written to ' + profile)
+
+    if score_cache is not None:
+        score_cache.save()
+
+    # Creates v_bundles.csv with bundles
+    df = pd.DataFrame(bundleList)
+    df.to_csv(output, index=False, header=False)
+
+    # prints Done when algo has finished
+    print("Application bundling complete.")
+    return df
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from dedup import InstallKeys, version_codes
+
+DASHBOARD_KEYS = ['Publisher', 'Application']
+VERSION_KEYS = ['Publisher', 'Application', 'Version']
+# Version of the rows that have none in the dashboards with versions: the old scripts turned the column into strings
+# with astype(str), which made a missing version 'nan' (pandas before 2), so those installations got a group of
+# their own instead of disappearing from v_full
+MISSING_VERSION = 'nan'
+
+
+# Builds both the dashboard without versions and the dashboard with versions in one pass over the install data.
+# Each row is flagged once as a duplicate with and without the version (same application, workstation and
+# scan date as an earlier row), then a single groupby per (Publisher, Application, Version) counts all entries and
+# both kinds of duplicates; the dashboard without versions is rolled up from those groups instead of the rows.
+# Returns (dashboard, duplicates, v_full, v_duplicates), the same tables the scripts used to build with
+# separate duplicated/where/groupby/merge steps.
+# Works on plain or dictionary-encoded (records.py) columns; only the groups that occur are counted.
+def build_dashboards(data, workstation_column):
+    duplicate, v_duplicate = duplicate_flags(data, workstation_column)
+    return dashboards_from_counts(count_groups(data, duplicate, v_duplicate))
+
+
+# Flags the rows that repeat an earlier row's application, workstation and scan date (duplicate),
+# and the same with the version as well (v_duplicate), from one 64-bit key per row (see dedup.py)
+def duplicate_flags(data, workstation_column):
+    return InstallKeys(data, workstation_column).duplicated()
+
+
+# The string form of each row's version as a categorical with sorted categories (so it groups like the strings),
+# '' where the version is missing, and the missing flags
+def version_labels(series):
+    codes, strings = version_codes(series)
+    missing = codes < 0
+    categories = sorted(set(strings) | {''})
+    position = {value: i for i, value in enumerate(categories)}
+    remap = np.array([position[value] for value in strings] + [position['']], dtype=np.int64)
+    return pd.Categorical.from_codes(remap[np.where(missing, len(strings), codes)], categories=categories), missing
+
+
+# Counts all entries, duplicates and versioned duplicates per (Publisher, Application, Version) group.
+# Counts of several batches of rows can be added up with add_counts.
+def count_groups(data, duplicate, v_duplicate):
+    # Versions are compared on their string form, like the old astype(str) copy but once per distinct version.
+    # Rows without a version are flagged so dashboards_from_counts can group them under MISSING_VERSION.
+    version, missing_version = version_labels(data['Version'])
+    rows = pd.DataFrame({'Publisher': data['Publisher'].values, 'Application': data['Application'].values,
+                         'Version': version, 'missing_version': missing_version,
+                         'duplicate': duplicate, 'v_duplicate': v_duplicate})
+    return rows.groupby(VERSION_KEYS + ['missing_version'], observed=True).agg(
+        entries=('duplicate', 'size'), duplicates=('duplicate', 'sum'), v_duplicates=('v_duplicate', 'sum'))
+
+
+# Adds up group counts from count_groups
+def add_counts(group_counts):
+    return pd.concat(group_counts).groupby(level=VERSION_KEYS + ['missing_version'], observed=True).sum()
+
+
+# Builds (dashboard, duplicates, v_full, v_duplicates) from the group counts of count_groups.
+# The rows without a version are counted in the dashboards with versions under MISSING_VERSION, together with any
+# version spelled 'nan', as the old astype(str) groupby counted them.
+def dashboards_from_counts(v_counts):
+    counts = v_counts.groupby(level=DASHBOARD_KEYS, observed=True).sum()
+    v_counts = v_counts.reset_index()
+    v_counts['Version'] = v_counts['Version'].astype(object).where(~v_counts['missing_version'], MISSING_VERSION)
+    v_counts = v_counts.groupby(VERSION_KEYS, observed=True)[['entries', 'duplicates', 'v_duplicates']].sum()
+
+    dashboard, duplicates = dashboard_from_counts(counts, counts['duplicates'])
+    v_full, v_duplicates = dashboard_from_counts(v_counts, v_counts['v_duplicates'])
+    return dashboard, duplicates, v_full, v_duplicates
+
+
+# Turns per-group entry and duplicate counts into a dashboard sorted by # of all entries, and a duplicates
+# table of the groups that have any, sorted by # of duplicate installations.
+# Groups whose entries are all duplicates (of another publisher's rows) are left out, as the old inner merge did.
+def dashboard_from_counts(counts, duplicate_counts):
+    all_entries = counts['entries'].sort_values(ascending=False)
+    dashboard = all_entries.reset_index(name='# of all entries')
+    dashboard['# of duplicate installations'] = duplicate_counts.reindex(all_entries.index).values.astype(int)
+    dashboard['# of unique installations'] = (all_entries - duplicate_counts.reindex(all_entries.index)).values
+    dashboard = dashboard[dashboard['# of unique installations'] > 0].reset_index(drop=True)
+
+    duplicates = duplicate_counts[duplicate_counts > 0].sort_values(ascending=False)
+    duplicates = duplicates.reset_index(name='# of duplicate installations')
+    return dashboard, duplicates
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from records import column_codes
+
+# Odd 64-bit constants of the splitmix64 mixer, used when the codes are too wide to be packed into one key
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+# Codes of the Version column as the duplicate check compares it: on the string form of each distinct value,
+# like the old astype(str) copy, so 16.0 and "16.0" count as the same version (-1 stays missing)
+def version_codes(series):
+    codes, values = column_codes(series)
+    string_codes, strings = pd.factorize(np.array([str(value) for value in values], dtype=object))
+    codes = np.asarray(codes, dtype=np.int64)
+    return np.where(codes >= 0, string_codes[codes], -1), np.asarray(strings, dtype=object)
+
+
+def mix(keys):
+    keys = (keys ^ (keys >> np.uint64(30))) * MIX_1
+    keys = (keys ^ (keys >> np.uint64(27))) * MIX_2
+    return keys ^ (keys >> np.uint64(31))
+
+
+# Combines columns of codes (-1 for missing) into one 64-bit key per row. When their numbers of distinct values
+# fit in 64 bits together the codes are packed side by side, so equal keys mean exactly equal rows and the
+# first column sorts first; otherwise they are hashed, with a negligible chance of two rows sharing a key.
+# Returns the keys and whether they were packed.
+def composite_keys(columns):
+    # Missing values take code 0, so a column with `size` distinct values needs size.bit_length() bits
+    widths = [int(size).bit_length() for codes, size in columns]
+    packed = sum(widths) <= 64
+    keys = np.zeros(len(columns[0][0]) if columns else 0, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for (codes, size), width in zip(columns, widths):
+            values = (np.asarray(codes, dtype=np.int64) + 1).astype(np.uint64)
+            if packed:
+                keys = (keys << np.uint64(width)) | values
+            else:
+                keys = mix(keys * GOLDEN_GAMMA + values)
+    return keys, packed
+
+
+# Marks every row whose key appeared in an earlier row (the first occurrence is not a duplicate),
+# from one stable sort of the keys
+def repeated_keys(keys):
+    order = np.argsort(keys, kind='stable')
+    repeats = np.zeros(len(keys), dtype=bool)
+    repeats[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+    return repeats
+
+
+# One 64-bit key per install record, built from the dictionary codes of the columns that define a duplicate:
+# the same application on the same workstation with the same scan date, and the same with the version too.
+# The version is packed below the other three, so one sort of the versioned keys also brings the rows of each
+# unversioned key together and both kinds of duplicates come out of a single sort.
+class InstallKeys:
+    def __init__(self, data, workstation_column):
+        columns = []
+        for column in ['Application', workstation_column, 'Last HW Scan']:
+            codes, values = column_codes(data[column])
+            columns.append((codes, len(values)))
+        versions, version_values = version_codes(data['Version'])
+        self.version_width = int(len(version_values)).bit_length()
+        self.versioned_keys, self.packed = composite_keys(columns + [(versions, len(version_values))])
+        if self.packed:
+            self.keys = self.versioned_keys >> np.uint64(self.version_width)
+        else:
+            self.keys = composite_keys(columns)[0]
+
+    # Flags of the rows that repeat an earlier row, without (duplicate) and with the version (v_duplicate)
+    def duplicated(self):
+        if not self.packed:
+            return repeated_keys(self.keys), repeated_keys(self.versioned_keys)
+
+        order = np.argsort(self.versioned_keys, kind='stable')
+        ordered = self.versioned_keys[order]
+        v_duplicate = np.zeros(len(order), dtype=bool)
+        v_duplicate[order[1:]] = ordered[1:] == ordered[:-1]
+
+        # Runs of the same key without the version are contiguous in that order; the earliest row of each run is
+        # the one that is not a duplicate
+        duplicate = np.ones(len(order), dtype=bool)
+        if len(order):
+            unversioned = ordered >> np.uint64(self.version_width)
+            starts = np.flatnonzero(np.r_[True, unversioned[1:] != unversioned[:-1]])
+            duplicate[np.minimum.reduceat(order, starts)] = False
+        return duplicate, v_duplicate
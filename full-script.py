@@ -1,413 +1,432 @@
 import pandas as pd
 import glob
+import os
+import argparse
 from fuzzywuzzy import fuzz
 from fuzzywuzzy import process
 import numpy as np
 import csv
-
-# This creates an empty dataframe
-data = pd.DataFrame(columns=['Publisher', 'Application', 'Version', 'Install Date', 'Last HW Scan'])
+from ingest import load_inventory, file_signature
+from records import compact_records, fill_missing
+from dashboards import build_dashboards
+from bundling import createBundle
+from bundle_graph import find_bundles
+from name_similarity import NameSimilarity
+from name_clusters import cluster_names, cluster_column
+from workstation_index import WorkstationIndex
+from normalization import NameTable
+from publishers import canonical_publishers, find_problematic_apps
+from utilities import UtilityClassifier, load_utility_rules, DEFAULT_RULES
+from pipeline import Pipeline, Stage, DEFAULT_PIPELINE_DIR
+from reports import ReportWriter
+from versions import version_drift
+from query_service import write_query_index, DEFAULT_INDEX_DIR
+from preview import preview_inventory
+from score_cache import PairScoreCache, DEFAULT_SCORE_CACHE_DIR, MAX_PAIRS, WORKSTATION_THRESHOLD
+from snapshots import Snapshot, list_snapshots, report_changes, write_snapshot, DEFAULT_SNAPSHOT_DIR
+
+# Number of processes used to parse new or changed Excel files in parallel (None uses every core)
+INGEST_WORKERS = None
+
+# How createBundle picks the applications to compare: 'window' (# of unique installations within 10%)
+# or 'lsh' (MinHash/LSH on the workstation sets, faster and not limited by installation counts)
+BUNDLE_CANDIDATES = 'window'
+
+# Number of processes that check the bundling candidates in parallel (None uses every core, 1 bundles in this process).
+# The bundles are the same either way; only used by the 'greedy' engine.
+BUNDLE_WORKERS = None
+
+# 'greedy' walks the dashboard from the most installed application with createBundle and writes v_bundles.csv;
+# 'graph' finds bundles among all applications installed on 5+ workstations as connected groups of co-installed
+# applications (see bundle_graph.py) and writes v_bundle_table.csv, one row per bundle member with its scores
+BUNDLE_ENGINE = 'greedy'
+
+# Folder where the 'greedy' engine keeps the scores of the application pairs it compared, so the next run only scores
+# pairs that are new or whose workstations changed (see score_cache.py; None scores every pair each time), and the
+# most pairs it keeps
+BUNDLE_SCORE_CACHE_DIR = DEFAULT_SCORE_CACHE_DIR
+BUNDLE_SCORE_CACHE_SIZE = MAX_PAIRS
+
+# Thresholds two applications must reach to be bundled: the score of their names (None uses the name method's,
+# 50 with fuzz.partial_ratio) and the percentage of their workstations they share. Changing them reruns the bundling
+# stage, which reuses the cached scores.
+BUNDLE_NAME_THRESHOLD = None
+BUNDLE_WORKSTATION_THRESHOLD = WORKSTATION_THRESHOLD
+
+# Extra checks of the 'graph' engine: 'names' (names share a word and are roughly similar) and 'versions' (same version),
+# the same checks createBundle makes
+GRAPH_BUNDLE_CHECKS = ('names', 'versions')
+
+# Folder where the result of every stage is checkpointed, so a rerun only repeats the stages whose inputs,
+# settings or code changed (see pipeline.py)
+PIPELINE_DIR = DEFAULT_PIPELINE_DIR
+
+# Keywords and publishers that mark an application as a utility
+UTILITY_RULES = DEFAULT_RULES
+
+# JSON report of the time, memory and row counts of every stage in the last run
+RUN_REPORT = 'run_report.json'
+
+# Month and day stamped on the summary workbook's name, e.g. '07_06' (None uses today's date)
+REPORT_DATE = None
+
+# Format of the outputs that hold every row of the inventory (flagged_utilities): 'parquet', 'csv.gz' or 'csv'
+DETAIL_FORMAT = 'parquet'
+
+# Folder of the index the query service answers lookups from (see query_service.py); rewritten after every run
+QUERY_INDEX_DIR = DEFAULT_INDEX_DIR
+
+# Folder of the snapshots of each run's installs and bundles; every run is compared with the previous snapshot
+# (see snapshots.py)
+SNAPSHOT_DIR = DEFAULT_SNAPSHOT_DIR
+
+# Folder where --preview keeps the HyperLogLog sketch of each export, so the next preview only reads new or
+# changed files (None sketches every file each time)
+PREVIEW_SKETCH_DIR = '.preview_sketches'
 
 # The filepath needs to be where the files are located on your device
-file_paths = glob.glob('/Users/jeremylee/Desktop/CS-Projects/T4SG/usda-app-rationalization-summer/data/*.xlsx')
+DATA_FILES = '/Users/jeremylee/Desktop/CS-Projects/T4SG/usda-app-rationalization-summer/data/*.xlsx'
+
+# Output files are written on background threads while the next stages run (see reports.py)
+writer = ReportWriter(date=REPORT_DATE, detail_format=DETAIL_FORMAT)
+
+
+### Reading in the data
+def read_data(file_paths, workers):
+    # The first run parses every Excel file (several at once, see INGEST_WORKERS) and caches a columnar copy in .ingest_cache/;
+    # later runs only re-parse files that are new or have changed, so they are much faster
+    # The repeated text columns (publisher, application, version, workstation, OS, scan dates) are stored as integer codes
+    # with one lookup table per column (see records.py), which keeps even the largest inventories small in memory.
+    print("Reading in data...")
+    data = load_inventory(file_paths, columns=['Publisher', 'Application', 'Version', 'Install Date', 'Last HW Scan'], workers=workers, encode=True)
+    print('Data read completed.')
 
-# Reading in the data
-# This might take some time, but you'll be able to see the filenames as they're being read in
-print("Reading in data...")
-for filepath in file_paths:
-    data = data.append(pd.read_excel(filepath))
-print('Data read completed.')
+    drop_columns = ["AD_Site_Name0", "User", "Agency"]
+    data.drop(columns=drop_columns, inplace=True)
+    return data
 
-drop_columns = ["AD_Site_Name0", "User", "Agency"]
-data.drop(columns=drop_columns, inplace=True)
 
-print("Removing servers...")
 ### Remove all the rows of data from Microsoft servers, as we’re only interested in workstations
-data['C054'].fillna('',inplace=True)  # replaces NaN values in column C054 with ‘’ nothing, needed for next segment of code to work
-index = data[data['C054'].str.lower().str.contains('server')].index # creates an index of rows containing server in the OS column (C054)
-data.drop(index, inplace=True)  # this deletes all rows where the word 'server' is in column C054, from prior line's index
-print("Server removal completed.")
+def remove_servers(data):
+    print("Removing servers...")
+    data = data.assign(C054=fill_missing(data['C054'], ''))  # replaces NaN values in column C054 with ‘’ nothing, needed for next segment of code to work
+    index = data[data['C054'].str.lower().str.contains('server')].index # creates an index of rows containing server in the OS column (C054)
+    data = data.drop(index)  # this deletes all rows where the word 'server' is in column C054, from prior line's index
+    print("Server removal completed.")
+    return data
+
 
-print("Removing GOTS applications...")
 ### Removing GOTS applications
-data = data[data["Publisher"].str.lower().str.contains("usda") == False]
-print("GOTS application removal complete.")
+def remove_gots(data):
+    print("Removing GOTS applications...")
+    data = data[data["Publisher"].str.lower().str.contains("usda") == False]
+    # Dropping the lookup-table entries of the removed servers and GOTS applications
+    data = compact_records(data)
+    print("GOTS application removal complete.")
+    return data
+
 
 ### Flagging utilities
-print("Flagging utilities...")
-
-# Tagging utilities based on keywords in app names
-utility_keywords = ["driver", "update", "compiler", "decompiler", 
-                    "installer", "utility", "plugin", "tool"]
-
-data["Application"].fillna('',inplace=True)
-data["Utility"] = 0
-for keyword in utility_keywords:
-    data.loc[data["Application"].str.lower().str.contains(keyword, na=False), "Utility"] = 1
-
-# Tagging utilities based on particular publishers
-utility_publishers = ["Intel", "Intel Corporation", "Intel(R) Corporation",
-                      "Advanced Micro Devices, Inc.", "Advanced Micro Devices Inc.", "AMD",
-                      "Dell", "Dell Inc.", "Dell, Inc.", "Dell Inc"]
-
-# Tagging utilities with a 1 in the "Utility" column
-data["Publisher"].fillna('',inplace=True)
-data.loc[data.Publisher.isin(utility_publishers), "Utility"] = 1
-
-utility_list = data[data["Utility"] == 1].drop(columns="Utility")
-utility_list = utility_list[["Publisher", "Application"]].drop_duplicates()
-utility_df = pd.DataFrame(utility_list)
-
-# Getting all utilities and their installation counts
-counts = []
-value_counts = data.groupby("Application").count()["System Name"]
-for app in utility_df["Application"]:
-    counts.append(value_counts[app])
-utility_df["Count"] = counts
-utility_df.sort_values(by="Count", ascending=False, inplace=True)
-
-# Exporting utility results to csvs
-utility_df.to_csv("utilities.csv")
-data.to_csv("flagged_utilities.csv")
-print("Utility flagging complete.")
+def flag_utilities(data, rules_file):
+    print("Flagging utilities...")
+
+    # Tagging utilities based on keywords in app names and on particular publishers, with a 1 in the "Utility" column
+    # The keywords and publishers are read from utility_rules.json (see utilities.py); all the rules are checked in one
+    # pass over the distinct publisher/application pairs and the flags copied back to every row
+    data = data.assign(Application=fill_missing(data["Application"], ''), Publisher=fill_missing(data["Publisher"], ''))
+    data["Utility"] = UtilityClassifier(load_utility_rules(rules_file)).flag(data)
+
+    utility_list = data[data["Utility"] == 1].drop(columns="Utility")
+    utility_list = utility_list[["Publisher", "Application"]].drop_duplicates()
+    utility_df = pd.DataFrame(utility_list)
+
+    # Getting all utilities and their installation counts
+    value_counts = data.groupby("Application", observed=True).count()["System Name"]
+    utility_df["Count"] = value_counts.reindex(utility_df["Application"]).values
+    utility_df.sort_values(by="Count", ascending=False, inplace=True)
+
+    # Exporting utility results; flagged_utilities holds every row, so it is written as Parquet or compressed CSV
+    writer.write_csv(utility_df, "utilities.csv")
+    writer.write_detail(data, "flagged_utilities")
+    print("Utility flagging complete.")
+    return data
+
 
 ### Normalizing App Names
-print("Normalizing app names...")
-
-# Getting unique app names
-main_df = data[data["Utility"] == 0].drop(columns="Utility")
-business_apps = list(main_df.Application.unique())
-
-# Creating a dataframe with unique applications and their counts (# of installations)
-counts = []
-value_counts = main_df.groupby("Application").count()["System Name"]
-for app in business_apps:
-    counts.append(value_counts[app])
-
-normalized_df = pd.DataFrame()
-normalized_df["old_name"] = business_apps
-normalized_df["new_name"] = business_apps
-normalized_df["count"] = counts
-
-normalized_df.sort_values(by="count", ascending=False, inplace=True)
-
-# Normalizing names
-
-# Filters out fully numerical words (targeting years and version numbers)
-def is_non_number(s):
-    if len(s) == 0:
-        return False
-    if s[0].lower() == "v":
-        for char in s[1:]:
-            if char.isalpha():
-                return True
-        return False
-    else:
-        for char in s:
-            if char.isalpha():
-                return True
-        return False
-
-# Removes commas at the ends of words
-def remove_comma(word):
-    if len(word) == 0:
-        return word
-    if word[-1] == ",":
-        return word[:-1]
-    return word
-
-# Removes 32-bit and 64-bit tags on app names
-tags = ["ARM64", "arm64", "amd64", "arm", "ARM",
-        "X64", "X86", "x64", "x86", "64-bit", "32-bit", "32bit", "64bit"]
-
-def remove_tag_word(word):
-    new_word = word
-    for tag in tags:
-        if "(" + tag + ")" in new_word:
-            new_word = new_word.replace("(" + tag + ")", "")
-        elif "_" + tag in new_word:
-            new_word = new_word.replace("_" + tag, "")
-        elif tag in new_word:
-            new_word = word.replace(tag, "")
-        
-    return new_word
-
-# Removes starting and ending parentheses for words
-def remove_parentheses_word(word):
-    if len(word) == 0:
-        return word
-    if (word[0] == "(" and ")" not in word) or (word[-1] == ")" and "(" not in word):
-        return ""
-    return word
-
-# Removes the word "version"
-def remove_version_word(word):
-    if "version" in word.lower():
-        return False
-    return True
-
-# Removes words that are empty
-def remove_blank_words(word):
-    return word != ""
-
-def normalize_name(app_name):
-    words = str(app_name).split()
-    
-    words = list(filter(is_non_number, words)) # Removing version and years
-    words = list(map(remove_comma, words)) # Removing ending commas
-    words = list(map(remove_tag_word, words)) # Removing 32 vs 64 bit
-    words = list(map(remove_parentheses_word, words)) # Removing parentheses
-    words = list(filter(remove_version_word, words)) # Removing the word "version"
-    words = list(filter(remove_blank_words, words)) # Removing blank words
-    
-    return " ".join(words)
-
-normalized_df["new_name"] = normalized_df.old_name.apply(normalize_name)
-
-# Outputting normalized names to csv
-normalized_df.to_csv("normalized_apps.csv")
-
-# Comparing unique counts
-print("No. of Unique (un-normalized) App Names: " + str(normalized_df["old_name"].unique().shape[0]))
-print("No. of Unique Normalized App Names: " + str(normalized_df["new_name"].unique().shape[0]))
-
-print("App normalizing complete.")
-
-# Changing the setting so we could see all the lines of the dashboard
-pd.set_option('display.max_rows', None)
-
-# Dashboard by application name and number of installations in the whole dataset
-full_data = data.groupby(['Publisher', 'Application'])
-full_data = full_data.size().sort_values( ascending=False).reset_index(name='# of all entries')
-dashboard = pd.DataFrame(full_data)
-
-### Creating a dashboard without versions
-
-print("Creating dashboard without versions...")
-
-# Dashboard by application name and number of duplicated installations in the whole dataset
-duplicates = data.where(data.duplicated(subset=['Application', 'System Name', 'Last HW Scan']) == True).dropna(how='all')
-dupl_dash = duplicates.groupby(['Publisher', 'Application'])
-dupl_dash = dupl_dash.size().sort_values( ascending=False).reset_index(name='# of duplicate installations')
-dupl_df = pd.DataFrame(dupl_dash, columns = ['Publisher', 'Application', '# of duplicate installations'])
-
-# Dashboard by application name and number of not duplicated installations in the whole dataset
-data_no_dupl = data.where(data.duplicated(subset=['Application', 'System Name', 'Last HW Scan']) != True).dropna(how='all')
-data_no_dupl = data_no_dupl.groupby(['Publisher', 'Application'])
-data_no_dupl = data_no_dupl.size().sort_values( ascending=False).reset_index(name='# of unique installations')
-no_dupl = pd.DataFrame(data_no_dupl, columns = ['Publisher', 'Application', '# of unique installations'])
-
-# Putting the sub-dashboards all together
-dashboard = dashboard.merge(dupl_df, how='left', on=['Publisher', 'Application'])
-dashboard = dashboard.merge(no_dupl, on=['Publisher', 'Application'])
-dashboard = dashboard.fillna(value=0)
-dashboard['# of duplicate installations'] = dashboard['# of duplicate installations'].astype(int)
-
-print('The number of distinct applications is:')
-print(dashboard.shape[0])
-print('The number of duplicated installations is:')
-print(dupl_df['# of duplicate installations'].sum())
-
-# Writing the dashboards into Excel files
-dupl_df.to_excel('duplicates_07_06.xlsx')
-dashboard.to_excel('full_dashboard_07_06.xlsx')
-
-print("Dashboard without versions complete.")
-
-### Creating dashboards that DO take into account the version number
-
-print("Creating dashboard with versions...")
-
-# Creating a version based duplicates dashboard
-version_data = data.copy()
-version_data['Version'] = version_data['Version'].astype(str)
-
-# Full dashboard for applications with versions and the number of all installations
-v_full_data = version_data.groupby(['Publisher', 'Application', 'Version'])
-v_full_data = v_full_data.size().sort_values( ascending=False).reset_index(name='# of all entries')
-v_dashboard = pd.DataFrame(v_full_data)
-
-# Finding duplicates by versions
-v_duplicates = version_data.where(version_data.duplicated(subset=['Application', 'Version', 'System Name', 'Last HW Scan']) == True).dropna(how='all')
-v_dupl_dash = v_duplicates.groupby(['Publisher', 'Application', 'Version'])
-v_dupl_dash = v_dupl_dash.size().sort_values( ascending=False).reset_index(name='# of duplicate installations')
-
-# Finding unique installations by versions
-v_no_dupl = version_data.where(version_data.duplicated(subset=['Application', 'Version', 'System Name', 'Last HW Scan']) != True).dropna(how='all')
-no_dupl_by_v = v_no_dupl.groupby(['Publisher', 'Application', 'Version'])
-no_dupl_by_v = no_dupl_by_v.size().sort_values( ascending=False).reset_index(name='# of unique installations')
-
-# To verify that when summing the duplicates up by application it the numbers are similar to the previous dashboards
-v_dupl_byapp = v_duplicates.groupby(['Publisher', 'Application'])
-v_dupl_byapp = v_dupl_byapp.size().sort_values( ascending=False).reset_index(name='# of duplicate installations')
-
-# Putting everything into the full dashboard
-v_no_dupl_df = pd.DataFrame(no_dupl_by_v, columns = ['Publisher', 'Application', 'Version', '# of unique installations'])
-v_dupl_df = pd.DataFrame(v_dupl_dash, columns = ['Publisher', 'Application', 'Version', '# of duplicate installations'])
-v_full = v_dashboard.merge(v_dupl_df, how='left', on=['Publisher', 'Application', 'Version'])
-v_full = v_full.merge(v_no_dupl_df, on=['Publisher', 'Application', 'Version'])
-v_full = v_full.fillna(value=0)
-v_full['# of duplicate installations'] = v_full['# of duplicate installations'].astype(int)
+def normalize_names(data):
+    print("Normalizing app names...")
 
-# Writing the new dashboards into Excel files
-v_full.to_excel('full_dashboard_w_versions_07_06.xlsx')
-v_dupl_dash.to_excel('duplicates_w_versions_07_06.xlsx')
+    # Getting unique app names
+    main_df = data[data["Utility"] == 0].drop(columns="Utility")
+    business_apps = list(main_df.Application.unique())
 
-# Sorting the dashboard by # of unique installations for the bundling algorithm
-dashboard = dashboard.sort_values(by=['# of unique installations'], ascending=False).reset_index(drop=True)
+    # Creating a dataframe with unique applications and their counts (# of installations with a workstation name)
+    value_counts = main_df.loc[main_df["System Name"].notna(), "Application"].value_counts()
 
-print("Dashboard with versions complete.")
+    normalized_df = pd.DataFrame()
+    normalized_df["old_name"] = business_apps
+    normalized_df["new_name"] = business_apps
+    normalized_df["count"] = pd.Series(business_apps, dtype=object).map(value_counts).fillna(0).astype(np.int64).values
 
-### Bundle-identification code
+    normalized_df.sort_values(by="count", ascending=False, inplace=True)
 
-print("Bundling applications...")
-
-import re
-from collections import defaultdict
-
-# filter out commonly used words in application titles
-common_words = ['Tool', 'Module', 'Update', 'Software', '', 'App', 'Client',
-                'Tools', 'for', 'and', 'in', 'Client', 'Installer', 'Drive', 
-                'Driver', 'Web', 'Helper', 'Support', 'Center', 'Manager',
-                'File', 'Reader', 'C', 'Launcher', 'Plugin', 'Service', 'Setup', 'Driver',
-               'x86', '(x86)', 'x64', '(x64)', 'X86']
-
-# filter out numbers and version numbers
-def is_number(string):
-    matching = re.match(r'^\d+(\.\d+)*$', string)
-    if matching:
-        return True
-    return False
-
-# cleaning the name of characters such as dash, underscore etc.
-def clean_name(name):
-    words = re.split(' |,|_|-', name)
-    words = list(filter(lambda w: w not in common_words, words))
-    words = list(filter(lambda w: not is_number(w), words))
-    return words
-
-### create a spreadsheet that lists applications and their potential bundles based on fuzzywuzzy scores
-
-# Converts application at row index to form "[name] || [publisher] || [version]"
-def stringify(dashboard, index):
-    name = dashboard.loc[[index]]['Application'].iat[0]
-    pub = dashboard.loc[[index]]['Publisher'].iat[0]
-    version = dashboard.loc[[index]]['Version'].iat[0]
-    return name + " || " + pub + " || " + version
-
-# Confirms that cleaned potential bundled application names have common words
-def checkIfSubword(name, other):
-    name_clean = clean_name(name)
-    other_clean = clean_name(other)
-    # If any of the apps are 1 word long, don't have to have a common string
-    if len(name) == 1 or len(other) == 1:
-        return True
-    return bool(set(name_clean) & set(other_clean))
-
-# Checks that two applications are installed on at least 70% of the same workstations
-def checkIfSimilarWorkstations(name, other):
-    filtered_1 = data[data.Application == name]
-    filtered_2 = data[data.Application == other]
-    flist1 = filtered_1["System Name"].to_list()
-    flist2 = filtered_2["System Name"].to_list()
-    res = len(set(flist1) & set(flist2)) / float(len(set(flist1) | set(flist2))) * 100
-    # This similarity threshold (70%) can be adjusted higher or lower
-    return res >= 70
-
-# Checks that two applications have the same version number
-def checkVersion(dashboard, index, other_index):
-    v1 = dashboard.loc[[index]]['Version'].iat[0]
-    v2 = dashboard.loc[[other_index]]['Version'].iat[0]
-    return v1 == v2
-
-# Checks if two applications should be bundled
-def checkIfBundle(dashboard, index, other_index):
-    name = dashboard.loc[[index]]['Application'].iat[0]
-    other = dashboard.loc[[other_index]]['Application'].iat[0]
-    name_clean = clean_name(name)
-    other_clean = clean_name(other)
-    # Fuzzywuzzy checks that the names of the two applications are roughly similar (>50% similarity)
-    return checkVersion(dashboard, index, other_index) and checkIfSubword(name, other) and fuzz.partial_ratio(name_clean, other_clean) >= 50 and checkIfSimilarWorkstations(name, other)
-
-# Creates a csv of potential bundles, taking in a dashboard as input
-def createBundle(dashboard):
-    # Sorts dashboard by number of unique installations
-    dashboard = dashboard.sort_values(by=['# of unique installations'], ascending=False).reset_index(drop=True)
-    
-    maxRows = len(dashboard.index)
-    bundleList = []
-    
-    # Creates a dashboard column "grouped" that indicates whether an application has been bundled
-    dashboard['grouped'] = False
-    
-    # needs to be sorted by count
-    for index, row in dashboard.iterrows():
-        bundle = []
-        count = row['# of unique installations']
-        # stop algo if # of installations is less than 100
-        if count < 100:
-            break
-        # if the application has been grouped, skip it
-        if dashboard.loc[[index]]['grouped'].iat[0] == True:
-            continue
-        name = row['Application']
-        # parse through above rows until count >10% difference
-        tempIndex = index - 1
-        while tempIndex >= 0 and dashboard.loc[[tempIndex]]['# of unique installations'].iat[0] - count <= count/10:
-            if checkIfBundle(dashboard, index, tempIndex):
-                # Setting grouped for the application being analyzed
-                dashboard.at[index, 'grouped'] = True
-                dashboard.at[tempIndex, 'grouped'] = True
-                bundle.append(stringify(dashboard, tempIndex))
-            tempIndex -= 1
-        # parse through below rows until count <10% difference
-        tempIndex = index + 1
-        while tempIndex < maxRows and count - dashboard.loc[[tempIndex]]['# of unique installations'].iat[0] <= count/10:
-            if checkIfBundle(dashboard, index, tempIndex):
-                dashboard.at[index, 'grouped'] = True
-                dashboard.at[tempIndex, 'grouped'] = True
-                bundle.append(stringify(dashboard, tempIndex))
-            tempIndex += 1
-        # indicate that the program is running
-        if index % 10 == 0:
-            print(index, end=' ')
-        # insert the app name and the count
-        bundle.insert(0, stringify(dashboard, index))
-        bundle.insert(1, count)
-        bundleList.append(bundle)
-        
-    # Creates v_bundles.csv with bundles
-    df = pd.DataFrame(bundleList)
-    df.to_csv('v_bundles.csv', index=False, header=False)
-    
-    # prints Done when algo has finished
-    print("Application bundling complete.")
-
-# Creates a csv of bundles from the v_full dashboard (defined above)
-createBundle(v_full)
+    # Normalizing names
+    # The rules (dropping numbers and versions, 32/64-bit tags, stray parentheses and commas) live in normalization.py.
+    # The NameTable runs them once per distinct word and name and is shared with the bundling stage below.
+    name_table = NameTable(normalized_df.old_name)
+    normalized_df["new_name"] = name_table.normalize(normalized_df.old_name)
 
+    # Outputting normalized names to csv
+    writer.write_csv(normalized_df, "normalized_apps.csv")
 
-### Identify problematic applications that have typos in publisher name
+    # Comparing unique counts
+    print("No. of Unique (un-normalized) App Names: " + str(normalized_df["old_name"].unique().shape[0]))
+    print("No. of Unique Normalized App Names: " + str(normalized_df["new_name"].unique().shape[0]))
 
-print("Identifying problematic applications...")
+    print("App normalizing complete.")
+    return normalized_df, name_table
 
-# Detecting applications that have more than 100 installations
-applications = dashboard[dashboard['# of unique installations'] > 100]['Application'].unique()
-prob_apps = []
-for app in applications:
-#     detecting applications that show up in the dashboard at least twice
-    if len(dashboard[(dashboard['Application'] == app) & (dashboard['# of unique installations'] > 100)]['# of unique installations']) != 1:
-        if app not in prob_apps:
-            prob_apps.append(app)
 
-problem_df = pd.DataFrame(columns=['Application', 'Publishers'])
+### Creating the dashboards without and with versions
+def create_dashboards(data):
+    print("Creating dashboards without and with versions...")
 
-# Pairing up the different publisher names for each problematic application
-for index, row in dashboard[dashboard['# of unique installations'] > 100].iterrows():
-        if row['Application'] in prob_apps and row['Application'] not in list(problem_df['Application']):
-#             print(row['Application'], dashboard[(dashboard['Application'] == row['Application']) & (dashboard['# of unique installations'] > 100)]['Publisher'])
-            problem_df = problem_df.append({'Application': row['Application'], 'Publishers': str(list(dashboard[(dashboard['Application'] == row['Application']) & (dashboard['# of unique installations'] > 100)]['Publisher']))[1:-1].replace("'", '')}, ignore_index=True)
+    # Both dashboards come out of one pass over the data: every row is flagged once as a duplicate (same application,
+    # workstation and scan date, with and without the version) and counted in a single groupby
+    # dashboard: # of all entries, duplicate and unique installations per publisher and application
+    # dupl_df: # of duplicate installations per publisher and application
+    # v_full and v_dupl_dash: the same, per publisher, application and version
+    dashboard, dupl_df, v_full, v_dupl_dash = build_dashboards(data, 'System Name')
 
-problem_df.to_excel('problematic_apps_07_06.xlsx')
+    print('The number of distinct applications is:')
+    print(dashboard.shape[0])
+    print('The number of duplicated installations is:')
+    print(dupl_df['# of duplicate installations'].sum())
 
-print("Identifying problematic applications complete.")
\ No newline at end of file
+    # The dashboards are written to the summary workbook by the summary stage, sorted by # of all entries as before
+
+    print("Dashboards complete.")
+    return dashboard, dupl_df, v_full, v_dupl_dash
+
+
+### Grouping normalized names that only differ in edition words, punctuation or typos
+def cluster_applications(data, normalized):
+    print("Clustering application names...")
+    normalized_df = normalized[0]
+
+    # Each normalized name is mapped to the most installed name of its cluster (see name_clusters.py); names are
+    # only compared with the names they share rare character n-grams with, so this stays fast on many names
+    named = normalized_df[normalized_df["new_name"] != ""]
+    clusters = cluster_names(named["new_name"], named["count"])
+    cluster_df = named.assign(cluster=named["new_name"].map(clusters))
+    writer.write_csv(cluster_df, "name_clusters.csv", index=False)
+
+    # Dashboard of the clusters: an installation of two variants of one application on the same workstation
+    # and scan date counts once
+    old_to_cluster = dict(zip(cluster_df["old_name"], cluster_df["cluster"]))
+    clustered = data.assign(Application=cluster_column(data["Application"], old_to_cluster))
+    cluster_dashboard = build_dashboards(clustered, 'System Name')[0]
+    cluster_dashboard = cluster_dashboard.rename(columns={'Application': 'Application Cluster'})
+    cluster_dashboard = cluster_dashboard.sort_values(by=['# of unique installations'], ascending=False).reset_index(drop=True)
+
+    print("No. of Unique Normalized App Names: " + str(named["new_name"].nunique()) + ", after clustering: " + str(len(set(clusters.values()))))
+    print("Name clustering complete.")
+    return old_to_cluster, cluster_dashboard
+
+
+### Bundle-identification code
+def bundle_applications(data, dashboard_tables, normalized, candidates, engine='greedy', checks=(), workers=1, profile=None,
+                        score_cache_dir=None, score_cache_size=MAX_PAIRS, name_threshold=None,
+                        workstation_threshold=WORKSTATION_THRESHOLD):
+    print("Bundling applications...")
+    dashboard, dupl_df, v_full, v_dupl_dash = dashboard_tables
+    normalized_df, name_table = normalized
+
+    # Index of the workstations each application is installed on, built once and shared by every co-installation check
+    workstation_index = WorkstationIndex(data, 'System Name')
+
+    if engine == 'graph':
+        # Creates a csv with one row per member of each bundle found in the v_full dashboard (defined above)
+        name_similarity = NameSimilarity(v_full['Application'], name_table=name_table) if 'names' in checks else None
+        bundles = find_bundles(v_full, workstation_index, min_similarity=workstation_threshold / 100.0,
+                               check_names='names' in checks, check_versions='versions' in checks,
+                               name_similarity=name_similarity, name_threshold=name_threshold)
+        bundles.to_csv('v_bundle_table.csv', index=False)
+        print("Application bundling complete.")
+        return bundles
+
+    # Creates a csv of bundles from the v_full dashboard (defined above)
+    # profile saves cProfile statistics of the bundling loop to that file
+    # Pairs already scored by an earlier run are checked from the score cache, unless their workstations changed
+    pair_scores = PairScoreCache(score_cache_dir, max_pairs=score_cache_size) if score_cache_dir else None
+    return createBundle(v_full, workstation_index, candidates=candidates, name_table=name_table, profile=profile, workers=workers,
+                        score_cache=pair_scores, name_threshold=name_threshold, workstation_threshold=workstation_threshold)
+
+
+### Grouping the spelling variants of each publisher (e.g. "Intel", "Intel Corporation", "Intel(R) Corporation")
+def canonicalize_publishers(dashboard_tables):
+    print("Canonicalizing publishers...")
+    dashboard = dashboard_tables[0]
+
+    # Each publisher name is mapped to the most installed spelling of its group (see publishers.py)
+    canonical = canonical_publishers(dashboard['Publisher'], dashboard['# of unique installations'])
+    aliases = pd.DataFrame({'Publisher': list(canonical), 'Canonical Publisher': list(canonical.values())})
+    writer.write_csv(aliases, 'publisher_aliases.csv', index=False)
+
+    print('No. of publisher names: ' + str(len(canonical)) + ', after grouping variants: ' + str(len(set(canonical.values()))))
+    print("Publisher canonicalization complete.")
+    return canonical
+
+
+### Identify problematic applications that have typos in publisher name
+def identify_problematic_apps(dashboard_tables, canonical):
+    print("Identifying problematic applications...")
+    # Sorting a copy of the dashboard by # of unique installations, so the publishers of each application are listed
+    # from the most installed
+    dashboard = dashboard_tables[0].sort_values(by=['# of unique installations'], ascending=False).reset_index(drop=True)
+
+    # Applications with more than 100 installations that show up in the dashboard under at least two publisher names,
+    # with the publisher groups those names belong to: the ones under two or more publisher groups come first, then
+    # the ones whose names are all spellings of one publisher (Same Publisher)
+    problem_df = find_problematic_apps(dashboard, canonical, min_installations=100)
+    print('No. of applications under several publishers: ' + str(int((~problem_df['Same Publisher']).sum())) +
+          ', under spellings of one publisher: ' + str(int(problem_df['Same Publisher'].sum())))
+
+    print("Identifying problematic applications complete.")
+    return problem_df
+
+
+### How far behind the latest version the installations of each application are
+def report_version_drift(dashboard_tables):
+    print("Reporting version drift...")
+    v_full = dashboard_tables[2]
+
+    # Latest and oldest version, # of distinct versions and # of installations on the latest version or 1, 2, 3+
+    # versions behind it, per application; versions are compared by their numbers (see versions.py)
+    drift_df = version_drift(v_full)
+    writer.write_csv(drift_df, 'version_drift.csv', index=False)
+
+    print('No. of applications with more than one version installed: ' + str((drift_df['# of versions'] > 1).sum()))
+    print("Version drift report complete.")
+    return drift_df
+
+
+### Writing the dashboards, problematic applications, version drift and name clusters into one Excel workbook, a sheet each
+def write_summary(dashboard_tables, problem_df, drift_df, clusters):
+    dashboard, dupl_df, v_full, v_dupl_dash = dashboard_tables
+    writer.write_workbook([('Full Dashboard', dashboard), ('Duplicates', dupl_df), ('Full Dashboard w Versions', v_full),
+                            ('Duplicates w Versions', v_dupl_dash), ('Problematic Apps', problem_df),
+                            ('Version Drift', drift_df), ('Dashboard by Name Cluster', clusters[1])],
+                           writer.dated('summary', '.xlsx'))
+
+
+### Writing the application/workstation lookups, the dashboard and the bundles for the query service
+def index_results(data, dashboard_tables, bundles, directory):
+    print("Writing the query index...")
+    write_query_index(directory, WorkstationIndex(data, 'System Name'), dashboard_tables[2], bundles)
+    print("Query index complete.")
+
+
+### Saving the installs and bundles of this run and reporting what changed since the previous run
+def snapshot_changes(data, bundles, directory):
+    print("Saving the inventory snapshot...")
+    previous = list_snapshots(directory)
+    path = write_snapshot(directory, data, 'System Name', bundles)
+
+    # Applications installed on or removed from each workstation, version upgrades and bundles that appeared or
+    # dissolved, in changes_<date>.xlsx with every changed install in install_changes
+    if previous:
+        report_changes(Snapshot(os.path.join(directory, previous[-1])), Snapshot(path), writer)
+    else:
+        print('No earlier snapshot to compare with')
+    print("Snapshot complete.")
+
+
+### Estimating the dashboards without running the pipeline
+def preview_dashboards(file_paths, workers, sketch_dir):
+    print("Previewing dashboards...")
+
+    # Distinct installations per (Publisher, Application[, Version]) are estimated with HyperLogLog sketches of each
+    # export (see preview.py), reading only the columns they need; servers and GOTS applications are left out as in
+    # the full run. The low/high columns bound each estimate (about 95%).
+    sketch = preview_inventory(file_paths, 'System Name', workers=workers, sketch_dir=sketch_dir, remove_gots=True)
+    dashboard, v_full = sketch.dashboards()
+    writer.write_csv(dashboard, 'preview_dashboard.csv', index=False)
+    writer.write_csv(v_full, 'preview_v_full.csv', index=False)
+
+    print(dashboard.head(20).to_string())
+    print("Dashboard preview complete.")
+
+
+# The stages of the script and the stages each one reads from. A stage is rerun only when its inputs, settings or
+# code changed (its function, the script functions it calls and every module of the repository they import, see
+# pipeline.py), or the files it writes are missing.
+# Bundling comes last so the summary workbook is written in the background while it runs.
+def build_pipeline(file_paths, profile_bundling=None, trace_memory=False):
+    bundling_params = {'candidates': BUNDLE_CANDIDATES, 'engine': BUNDLE_ENGINE, 'checks': list(GRAPH_BUNDLE_CHECKS),
+                       'workers': BUNDLE_WORKERS, 'score_cache_dir': BUNDLE_SCORE_CACHE_DIR,
+                       'score_cache_size': BUNDLE_SCORE_CACHE_SIZE, 'name_threshold': BUNDLE_NAME_THRESHOLD,
+                       'workstation_threshold': BUNDLE_WORKSTATION_THRESHOLD}
+    # Profiling doesn't change the bundles, so it is passed as an option: a profiled run neither changes the stage's key
+    # (which would rerun the index and snapshot stages) nor replaces its checkpoint
+    bundling_options = {'profile': profile_bundling} if profile_bundling else None
+    return Pipeline([
+        # Reading goes through the ingest cache, which already skips unchanged files, so it isn't checkpointed again
+        Stage('read', read_data, params={'file_paths': file_paths, 'workers': INGEST_WORKERS}, checkpoint=False,
+              fingerprint=lambda: [file_signature(filepath) for filepath in file_paths]),
+        Stage('servers', remove_servers, inputs=['read']),
+        Stage('gots', remove_gots, inputs=['servers']),
+        Stage('utilities', flag_utilities, inputs=['gots'], params={'rules_file': UTILITY_RULES},
+              outputs=['utilities.csv', writer.detail_path('flagged_utilities')],
+              fingerprint=lambda: file_signature(UTILITY_RULES)),
+        Stage('normalize', normalize_names, inputs=['utilities'], outputs=['normalized_apps.csv']),
+        Stage('clusters', cluster_applications, inputs=['utilities', 'normalize'], outputs=['name_clusters.csv']),
+        Stage('dashboards', create_dashboards, inputs=['utilities']),
+        Stage('publishers', canonicalize_publishers, inputs=['dashboards'], outputs=['publisher_aliases.csv']),
+        Stage('problematic', identify_problematic_apps, inputs=['dashboards', 'publishers']),
+        Stage('versions', report_version_drift, inputs=['dashboards'], outputs=['version_drift.csv']),
+        Stage('summary', write_summary, inputs=['dashboards', 'problematic', 'versions', 'clusters'],
+              outputs=[writer.dated('summary', '.xlsx')]),
+        Stage('bundling', bundle_applications, inputs=['utilities', 'dashboards', 'normalize'],
+              params=bundling_params, options=bundling_options,
+              outputs=['v_bundle_table.csv' if BUNDLE_ENGINE == 'graph' else 'v_bundles.csv']),
+        Stage('index', index_results, inputs=['utilities', 'dashboards', 'bundling'], params={'directory': QUERY_INDEX_DIR},
+              outputs=[os.path.join(QUERY_INDEX_DIR, 'CURRENT')]),
+        Stage('snapshot', snapshot_changes, inputs=['utilities', 'bundling'], params={'directory': SNAPSHOT_DIR}),
+    ], cache_dir=PIPELINE_DIR, trace_memory=trace_memory)
+
+
+# The main guard keeps the ingest worker processes from re-running the whole script when they start
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the application rationalization stages, reusing the checkpoints of stages whose inputs did not change.')
+    parser.add_argument('stages', nargs='*', help='stages to run (default: all): read, servers, gots, utilities, normalize, clusters, dashboards, publishers, problematic, versions, summary, bundling, index, snapshot')
+    parser.add_argument('--force', action='store_true', help='rerun the given stages even if their checkpoints are current')
+    parser.add_argument('--status', action='store_true', help='only show which stages are current and which would be rerun')
+    parser.add_argument('--report', default=RUN_REPORT, help='where to write the JSON run report (default: %(default)s)')
+    parser.add_argument('--trace-memory', action='store_true', help='also record tracemalloc peaks per stage (slower)')
+    parser.add_argument('--profile-bundling', metavar='PATH', help='rerun bundling under cProfile and save the statistics to PATH')
+    parser.add_argument('--preview', action='store_true', help='only estimate the dashboards from sketches of the exports (fast, approximate)')
+    args = parser.parse_args()
+
+    file_paths = glob.glob(DATA_FILES)
+
+    # Changing the setting so we could see all the lines of the dashboard
+    pd.set_option('display.max_rows', None)
+
+    pipeline = build_pipeline(file_paths, profile_bundling=args.profile_bundling, trace_memory=args.trace_memory)
+    if args.preview:
+        preview_dashboards(file_paths, INGEST_WORKERS, PREVIEW_SKETCH_DIR)
+        writer.wait()
+    elif args.status:
+        pipeline.status()
+    else:
+        force = (args.stages or list(pipeline.stages)) if args.force else []
+        if args.profile_bundling:
+            force = list(force) + ['bundling']
+        # The report is written even if a stage fails, so the stages that did run can be compared
+        try:
+            pipeline.run(args.stages, force=force)
+        finally:
+            # Waits for the output files still being written in the background
+            writer.wait()
+            pipeline.write_report(args.report)
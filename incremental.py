@@ -0,0 +1,77 @@
+import os
+import pickle
+
+from ingest import DEFAULT_CACHE_DIR, file_signature, iter_inventory_chunks
+from normalization import NameTable
+from streaming import StreamingAggregator
+
+DEFAULT_STATE_DIR = '.inventory_state'
+STATE_NAME = 'state.pkl'
+# Bumped whenever the layout of the saved state changes, so older state is rebuilt instead of misread
+STATE_VERSION = 1
+
+
+# Reads the saved state, or returns None if there is none (or it was written by an older version)
+def load_state(state_dir):
+    state_path = os.path.join(state_dir, STATE_NAME)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != STATE_VERSION:
+        return None
+    return state
+
+
+# Writes the state to a temporary file first so an interrupted run never leaves it half-written
+def save_state(state_dir, state):
+    os.makedirs(state_dir, exist_ok=True)
+    state_path = os.path.join(state_dir, STATE_NAME)
+    with open(state_path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(state_path + '.tmp', state_path)
+
+
+# Brings the saved aggregate state up to date with the given exports and returns (aggregator, name_table).
+# The state holds a manifest of the files already merged (path, size, mtime), the StreamingAggregator with the
+# running dashboard counts, the seen duplicate keys and the application/workstation pairs, and the NameTable of
+# every application name seen. Only files missing from the manifest are streamed and merged; if a merged file
+# changed or disappeared, or the options differ from the saved ones, the state is rebuilt from all the files,
+# since counts can't be taken back out.
+def update_inventory_state(file_paths, workstation_column, state_dir=DEFAULT_STATE_DIR, chunk_size=500000,
+                           cache_dir=DEFAULT_CACHE_DIR, **options):
+    signatures = [file_signature(filepath) for filepath in file_paths]
+    state = load_state(state_dir)
+    if state is not None:
+        aggregator = state['aggregator']
+        current = {signature['path']: signature for signature in signatures}
+        stale = [path for path, signature in state['manifest'].items() if current.get(path) != signature]
+        if aggregator.workstation_column != workstation_column or any(aggregator.options[k] != v for k, v in options.items()):
+            print('Inventory state was built with other options, rebuilding')
+            state = None
+        elif stale:
+            print('Previously merged files changed or were removed, rebuilding the inventory state: ' + ', '.join(stale))
+            state = None
+    if state is None:
+        state = {'version': STATE_VERSION, 'manifest': {}, 'name_table': NameTable(),
+                 'aggregator': StreamingAggregator(workstation_column, **options)}
+
+    aggregator = state['aggregator']
+    new_files = [(filepath, signature) for filepath, signature in zip(file_paths, signatures)
+                 if signature['path'] not in state['manifest']]
+    for filepath, signature in new_files:
+        for chunk in iter_inventory_chunks([filepath], aggregator.columns(), chunk_size=chunk_size, cache_dir=cache_dir):
+            aggregator.add(chunk)
+        state['manifest'][signature['path']] = signature
+
+    if new_files:
+        aggregator.consolidate()
+        # Only names the table hasn't seen yet are normalized and tokenized
+        if aggregator.counts:
+            state['name_table'].update(aggregator.counts[0].index.get_level_values('Application').unique())
+        save_state(state_dir, state)
+        print(str(len(new_files)) + ' new file(s) merged into the inventory state')
+    else:
+        print('Inventory state is up to date')
+    print('Rows merged so far: ' + str(aggregator.rows_read) + ', rows kept: ' + str(aggregator.rows_kept))
+    return aggregator, state['name_table']
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from records import combine_records, encode_records
+
+# Parquet needs pyarrow; without it the cache falls back to pickle files, which are still far faster than Excel
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = 'parquet'
+except ImportError:
+    CACHE_FORMAT = 'pickle'
+
+DEFAULT_CACHE_DIR = '.ingest_cache'
+MANIFEST_NAME = 'manifest.json'
+
+
+# Returns the cache key of a workbook: its absolute path, size and last modification time
+def file_signature(filepath):
+    stat = os.stat(filepath)
+    return {'path': os.path.abspath(filepath), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# Reads the manifest that maps each workbook path to its signature and cached file
+def read_manifest(cache_dir):
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+# Writes the manifest to a temporary file first so an interrupted run never leaves it half-written
+def write_manifest(cache_dir, manifest):
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+# Checks that the cached copy of a workbook exists and was made from the same size and mtime
+def is_fresh(entry, signature, cache_dir):
+    if entry is None:
+        return False
+    if entry['size'] != signature['size'] or entry['mtime'] != signature['mtime']:
+        return False
+    return os.path.exists(os.path.join(cache_dir, entry['cache_file']))
+
+
+# Excel columns can mix numbers, strings and dates (e.g. Version), which columnar formats reject,
+# so non-null values of mixed object columns are stored as strings
+def make_columnar_safe(df):
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        values = df[column].dropna()
+        if not values.map(lambda v: isinstance(v, str)).all():
+            df[column] = df[column].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def write_cached_frame(df, path):
+    if CACHE_FORMAT == 'parquet':
+        df.to_parquet(path)
+    else:
+        df.to_pickle(path)
+
+
+def read_cached_frame(path):
+    if CACHE_FORMAT == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+# Parses one workbook and stores its columnar copy in the cache, returning the parsed frame and manifest entry
+def cache_workbook(filepath, signature, cache_dir):
+    df = make_columnar_safe(pd.read_excel(filepath))
+    cache_file = hashlib.sha1(signature['path'].encode('utf-8')).hexdigest()[:16] + '.' + CACHE_FORMAT
+    write_cached_frame(df, os.path.join(cache_dir, cache_file))
+    entry = dict(signature, cache_file=cache_file)
+    return df, entry
+
+
+# Runs in a worker process: parses and caches one workbook, timing the parse
+def parse_workbook_timed(filepath, signature, cache_dir):
+    start = time.perf_counter()
+    df, entry = cache_workbook(filepath, signature, cache_dir)
+    return df, entry, time.perf_counter() - start
+
+
+# Loads every workbook in file_paths, re-parsing only the ones that are new or changed since they were cached
+# (or all of them when refresh is True).
+# Stale workbooks are parsed concurrently in a pool of `workers` processes (None uses every core, 1 parses in this process),
+# and all the files are concatenated once at the end, in the order of file_paths.
+# `columns` are placed first in the result (and created if missing), like the empty dataframe the scripts used to start from.
+# If `report` is a list, one {'path', 'source', 'rows', 'seconds'} entry per file is appended to it.
+# With encode=True the repeated string columns are dictionary-encoded file by file (see records.py), so the
+# combined inventory never holds them as Python strings.
+def load_inventory(file_paths, cache_dir=DEFAULT_CACHE_DIR, refresh=False, columns=None, workers=1, report=None, encode=False):
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = read_manifest(cache_dir)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    frames = {}
+    timings = {}
+    stale = []
+    for filepath in file_paths:
+        signature = file_signature(filepath)
+        entry = manifest.get(signature['path'])
+        if not refresh and is_fresh(entry, signature, cache_dir):
+            start = time.perf_counter()
+            frames[filepath] = read_cached_frame(os.path.join(cache_dir, entry['cache_file']))
+            timings[filepath] = ('cached', time.perf_counter() - start)
+            print('%s (cached, %.2fs)' % (filepath, timings[filepath][1]))
+        else:
+            stale.append((filepath, signature))
+
+    # Records a freshly parsed workbook; the manifest is rewritten after each one so finished work survives a crash
+    def finish(filepath, df, entry, seconds):
+        frames[filepath] = df
+        timings[filepath] = ('parsed', seconds)
+        manifest[entry['path']] = entry
+        write_manifest(cache_dir, manifest)
+        print('%s (parsed, %.2fs)' % (filepath, seconds))
+
+    if workers > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(stale))) as pool:
+            futures = {pool.submit(parse_workbook_timed, filepath, signature, cache_dir): filepath
+                       for filepath, signature in stale}
+            for future in as_completed(futures):
+                finish(futures[future], *future.result())
+    else:
+        for filepath, signature in stale:
+            finish(filepath, *parse_workbook_timed(filepath, signature, cache_dir))
+
+    if report is not None:
+        for filepath in file_paths:
+            source, seconds = timings[filepath]
+            report.append({'path': filepath, 'source': source, 'rows': len(frames[filepath]), 'seconds': seconds})
+
+    if encode:
+        data = combine_records(encode_records(frames[filepath]) for filepath in file_paths)
+    else:
+        data = pd.concat([frames[filepath] for filepath in file_paths]) if file_paths else pd.DataFrame()
+    if columns is not None:
+        leading = list(columns)
+        data = data.reindex(columns=leading + [c for c in data.columns if c not in leading])
+    return data
+
+
+# Reads the inventory in DataFrames of at most chunk_size rows, keeping only `columns` (those a file lacks are
+# filled with NaN), so memory stays bounded however large the exports are. Files with a fresh Parquet copy in the
+# cache are read from it batch by batch; other workbooks are streamed row by row with openpyxl's read-only mode.
+def iter_inventory_chunks(file_paths, columns, chunk_size=500000, cache_dir=DEFAULT_CACHE_DIR):
+    manifest = read_manifest(cache_dir) if os.path.isdir(cache_dir) else {}
+    for filepath in file_paths:
+        signature = file_signature(filepath)
+        entry = manifest.get(signature['path'])
+        if CACHE_FORMAT == 'parquet' and is_fresh(entry, signature, cache_dir):
+            chunks = iter_parquet_chunks(os.path.join(cache_dir, entry['cache_file']), columns, chunk_size)
+        elif filepath.lower().endswith('.csv'):
+            chunks = pd.read_csv(filepath, chunksize=chunk_size, usecols=lambda column: column in columns)
+        else:
+            chunks = iter_workbook_chunks(filepath, columns, chunk_size)
+        for chunk in chunks:
+            yield chunk.reindex(columns=columns)
+        print(filepath + ' (streamed)')
+
+
+def iter_parquet_chunks(path, columns, chunk_size):
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(path)
+    present = [column for column in columns if column in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=present):
+        yield batch.to_pandas()
+
+
+# Streams the first sheet of a workbook (the sheet pd.read_excel reads by default)
+def iter_workbook_chunks(filepath, columns, chunk_size):
+    from openpyxl import load_workbook
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        positions = [i for i, name in enumerate(header) if name in columns]
+        names = [header[i] for i in positions]
+        batch = []
+        for row in rows:
+            batch.append([row[i] if i < len(row) else None for i in positions])
+            if len(batch) == chunk_size:
+                yield pd.DataFrame(batch, columns=names)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=names)
+    finally:
+        workbook.close()
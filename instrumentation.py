@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+# resource (the process's high-water mark) is only available on Unix; elsewhere it is left out of the report
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# psutil is only needed for the current RSS where /proc/self/statm doesn't exist (macOS, Windows)
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# How often the RSS is sampled while a stage runs, in seconds; a spike shorter than this can be missed
+RSS_SAMPLE_INTERVAL = 0.01
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+# Current resident set size of this process in MB, from /proc/self/statm or psutil, or None if neither is available
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / (1024.0 * 1024.0)
+    except OSError:
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024.0 * 1024.0)
+    return None
+
+
+# Highest resident set size of this process since it started, in MB (ru_maxrss is in bytes on macOS, kilobytes on Linux).
+# It never goes down, so it only tells a stage's own peak when that stage set a new high for the whole run.
+def process_max_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+# Samples the current RSS on a background thread every RSS_SAMPLE_INTERVAL seconds until stopped and keeps the highest
+class RSSSampler:
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def start(self):
+        if self.peak is not None:
+            self.thread.start()
+        return self
+
+    # Stops sampling and returns the highest RSS seen, including right now
+    def stop(self):
+        if self.peak is None:
+            return None
+        self.stopped.set()
+        self.thread.join()
+        return max(self.peak, current_rss_mb())
+
+
+# Number of rows of a stage's input or output: the length of a DataFrame, or of the first DataFrame in a tuple
+def count_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                return len(item)
+    return None
+
+
+# Measures a block of code: wall and CPU time, the RSS at the start and its peak while the block runs (sampled on a
+# background thread, see RSSSampler), the process's RSS high-water mark at the end, and (with trace_memory=True) the
+# peak of Python memory allocated inside the block according to tracemalloc.
+# tracemalloc slows allocation-heavy code down noticeably, so it is off unless asked for.
+class Measurement:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.result = {}
+
+    def __enter__(self):
+        self.started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            tracemalloc.reset_peak()
+        self.sampler = RSSSampler().start()
+        self.rss_start = self.sampler.peak
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.result['wall_seconds'] = round(time.perf_counter() - self.wall_start, 4)
+        self.result['cpu_seconds'] = round(time.process_time() - self.cpu_start, 4)
+        peak = self.sampler.stop()
+        if peak is not None:
+            self.result['rss_start_mb'] = round(self.rss_start, 1)
+            self.result['peak_rss_mb'] = round(peak, 1)
+            self.result['peak_rss_growth_mb'] = round(peak - self.rss_start, 1)
+        high_water_mark = process_max_rss_mb()
+        if high_water_mark is not None:
+            self.result['process_max_rss_mb'] = round(high_water_mark, 1)
+        if self.trace_memory:
+            self.result['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0), 1)
+            if self.started_tracing:
+                tracemalloc.stop()
+        return False
+
+
+# Collects one entry per stage and writes them as a JSON run report
+class RunReport:
+    def __init__(self):
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.stages = []
+
+    def add(self, entry):
+        self.stages.append(entry)
+
+    def write(self, path):
+        report = {'started': self.started, 'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'python': sys.version.split()[0], 'pandas': pd.__version__, 'stages': self.stages}
+        with open(path + '.tmp', 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(path + '.tmp', path)
+        print('Run report written to ' + path)
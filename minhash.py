@@ -0,0 +1,71 @@
+import numpy as np
+
+# Hashes are computed modulo a Mersenne prime small enough that a * x + b never overflows int64
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+# Builds a MinHash signature of every application's workstation set in a WorkstationIndex.
+# Returns an (applications x num_perm) array; two rows agree in each column with probability equal to
+# the Jaccard similarity of the two workstation sets.
+def minhash_signatures(workstation_index, num_perm=128, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.int64)
+    b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.int64)
+
+    ids = workstation_index.workstation_ids.astype(np.int64)
+    non_empty = workstation_index.sizes > 0
+    starts = workstation_index.offsets[:-1][non_empty]
+
+    signatures = np.full((len(workstation_index.sizes), num_perm), MERSENNE_PRIME, dtype=np.int64)
+    if len(ids) == 0:
+        return signatures
+    # One permutation at a time keeps memory at a single pass over the index
+    for k in range(num_perm):
+        hashed = (a[k] * ids + b[k]) % MERSENNE_PRIME
+        signatures[non_empty, k] = np.minimum.reduceat(hashed, starts)
+    return signatures
+
+
+# Probability that two sets with the given Jaccard similarity share at least one LSH bucket
+def candidate_probability(jaccard, bands, rows):
+    return 1 - (1 - jaccard ** rows) ** bands
+
+
+# Splits the signatures into `bands` bands and returns every pair of rows (as an int array of shape (n, 2),
+# smaller row first) that lands in the same bucket in at least one band. With the defaults (32 bands of 4 rows),
+# pairs at the 70% bundling threshold become candidates with probability above 99.9%; pairs at 30% still do
+# about 23% of the time, at 20% about 5% and at 10% about 0.3% (see candidate_probability).
+# Rows flagged False in `mask` (e.g. applications with no workstations) are left out. With `required`, only pairs
+# where at least one of the two rows is flagged True in `required` are returned (e.g. the applications createBundle
+# starts bundles from), so the many small applications with identical workstation sets don't produce every pair
+# among them.
+def lsh_candidate_pairs(signatures, bands=32, mask=None, required=None):
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    keep = np.arange(n) if mask is None else np.flatnonzero(mask)
+
+    pairs = []
+    for band in range(bands):
+        band_values = np.ascontiguousarray(signatures[keep, band * rows:(band + 1) * rows])
+        # Rows with identical band values share a bucket
+        buckets = np.unique(band_values.view(np.dtype((np.void, band_values.dtype.itemsize * rows))).ravel(),
+                            return_inverse=True)[1].ravel()
+        order = np.argsort(buckets, kind='stable')
+        boundaries = np.flatnonzero(np.diff(buckets[order])) + 1
+        for members in np.split(keep[order], boundaries):
+            if len(members) < 2:
+                continue
+            if required is None:
+                first, second = np.triu_indices(len(members), k=1)
+                pairs.append(np.stack([members[first], members[second]], axis=1))
+                continue
+            # Every required member of the bucket with every other member
+            needed = members[required[members]]
+            if len(needed):
+                first, second = np.repeat(needed, len(members)), np.tile(members, len(needed))
+                pairs.append(np.stack([first, second], axis=1)[first != second])
+
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(pairs, axis=0)
@@ -0,0 +1,126 @@
+import re
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+from scipy import sparse
+
+from publishers import UnionFind
+from records import column_codes
+
+# Words that only name an edition of an application, dropped before names are compared
+EDITION_WORDS = {'professional', 'pro', 'standard', 'std', 'enterprise', 'edition', 'home', 'premium', 'lite',
+                 'plus', 'basic', 'ultimate', 'community', 'express', 'personal', 'business', 'free', 'trial',
+                 'deluxe', 'starter', 'full', 'complete', 'suite', 'the'}
+# Punctuation other than + and #, which tell apart products like "C++", "C#" and "Notepad++"
+PUNCTUATION = re.compile(r'[^\w\s+#]+|_')
+NUMBERS = re.compile(r'\d+')
+SYMBOL_WORDS = re.compile(r'\S*[+#]\S*')
+# Length of the character n-grams names are indexed by; there are far more distinct 4-grams than trigrams, so
+# each one is shared by fewer names and the candidate pairs stay few on tens of thousands of names
+GRAM_SIZE = 4
+
+
+# Comparison key of a normalized name: lowercase, punctuation (except + and #) as spaces and without edition words,
+# so that "Acrobat Reader DC", "Acrobat-Reader DC" and "Acrobat Reader DC Pro" all become "acrobat reader dc" while
+# "Notepad++" stays "notepad++". Names made only of edition words are kept as they are.
+def name_key(name):
+    words = PUNCTUATION.sub(' ', str(name).lower()).split()
+    kept = [word for word in words if word not in EDITION_WORDS]
+    return ' '.join(kept or words)
+
+
+# Overlapping GRAM_SIZE-character pieces of a key, padded so short keys still produce some
+def ngrams(key, size=GRAM_SIZE):
+    text = ' ' * (size - 1) + key + ' '
+    return [text[i:i + size] for i in range(len(text) - size + 1)]
+
+
+# Pairs of keys that share at least `overlap` of the n-grams of the longer one, found without comparing every
+# key with every other. N-grams are ordered from the rarest to the most common, and each key is only indexed by
+# its prefix of rarest n-grams, just long enough that two keys sharing that many n-grams always share a prefix
+# n-gram (prefix filtering). Prefix n-grams are rare, so the candidate pairs grow close to linearly with the
+# number of keys; their shared n-grams are then counted exactly with sparse row products.
+# Returns the pairs as two arrays of key positions (i < j).
+def candidate_pairs(keys, overlap=0.5):
+    grams = [set(ngrams(key)) for key in keys]
+    vocabulary = {}
+    rows, columns = [], []
+    for i, key_grams in enumerate(grams):
+        for gram in key_grams:
+            rows.append(i)
+            columns.append(vocabulary.setdefault(gram, len(vocabulary)))
+    rows, columns = np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=(len(keys), len(vocabulary)))
+
+    # Rank of each n-gram from rarest to most common (ties broken by n-gram number), and each key's prefix
+    frequency = np.bincount(columns, minlength=len(vocabulary))
+    rank = np.empty(len(vocabulary), dtype=np.int64)
+    rank[np.lexsort((np.arange(len(vocabulary)), frequency))] = np.arange(len(vocabulary))
+    order = np.lexsort((rank[columns], rows))
+    rows, columns = rows[order], columns[order]
+    sizes = np.bincount(rows, minlength=len(keys))
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    position = np.arange(len(rows)) - starts[rows]
+    prefix_sizes = sizes - np.ceil(sizes * overlap).astype(np.int64) + 1
+    in_prefix = position < prefix_sizes[rows]
+    prefixes = sparse.csr_matrix((np.ones(in_prefix.sum(), dtype=np.int32), (rows[in_prefix], columns[in_prefix])),
+                                 shape=(len(keys), len(vocabulary)))
+
+    candidates = sparse.triu(prefixes @ prefixes.T, k=1).tocoo()
+    first, second = candidates.row.astype(np.int64), candidates.col.astype(np.int64)
+    # Keys whose sizes are too far apart can't share enough n-grams
+    sized = np.minimum(sizes[first], sizes[second]) >= overlap * np.maximum(sizes[first], sizes[second])
+    first, second = first[sized], second[sized]
+    shared = np.asarray(matrix[first].multiply(matrix[second]).sum(axis=1)).ravel()
+    close = shared >= overlap * np.maximum(sizes[first], sizes[second])
+    return first[close], second[close]
+
+
+# Groups the near-duplicate spellings of normalized application names (e.g. the new_name column of
+# normalized_apps.csv) and picks one canonical name for each group, like canonical_publishers does for publishers.
+# Names are first reduced to their name_key, which merges edition and punctuation variants. Keys that share at
+# least half of their n-grams (see candidate_pairs) are compared with fuzz.ratio, and those scoring `threshold`
+# or more, with the same numbers and words with + or # in them, are merged, which catches typos.
+# weights (e.g. installation counts) decide the canonical name of a group: its most installed spelling.
+# Returns a dict from every name to its cluster's canonical name.
+def cluster_names(names, weights=None, threshold=90):
+    names = pd.Series(list(names), dtype=object)
+    weights = pd.Series(1 if weights is None else list(weights), index=names.index, dtype=float)
+    known = names.notna()
+    totals = weights[known].groupby(names[known].astype(str), sort=True).sum()
+    names = list(totals.index)
+    if not names:
+        return {}
+
+    keys = [name_key(name) for name in names]
+    distinct_keys = list(dict.fromkeys(keys))
+    key_ids = {key: i for i, key in enumerate(distinct_keys)}
+    groups = UnionFind(len(distinct_keys))
+
+    numbers = [NUMBERS.findall(key) for key in distinct_keys]
+    symbols = [SYMBOL_WORDS.findall(key) for key in distinct_keys]
+    for i, j in zip(*candidate_pairs(distinct_keys)):
+        # Keys with different numbers in them ("office 365" and "office 2016") are different applications, and so are
+        # keys with different words with + or # ("visual c++" and "visual c#", "notepad++" and "notepad")
+        if numbers[i] == numbers[j] and symbols[i] == symbols[j] and fuzz.ratio(distinct_keys[i], distinct_keys[j]) >= threshold:
+            groups.union(i, j)
+
+    # The canonical name of each group is its spelling with the largest weight (ties go to the first name)
+    group_of = np.array([groups.find(key_ids[key]) for key in keys])
+    best = {}
+    for name, group, total in zip(names, group_of, totals.values):
+        if group not in best or total > best[group][1]:
+            best[group] = (name, total)
+    return {name: best[group][0] for name, group in zip(names, group_of)}
+
+
+# The cluster name of every row's application as a categorical with sorted categories, so the dashboards can
+# group by it like by the application. old_to_cluster maps application names to cluster names; applications it
+# doesn't list (e.g. utilities, which are not normalized) keep their own name.
+def cluster_column(series, old_to_cluster):
+    codes, values = column_codes(series)
+    clusters = [old_to_cluster.get(str(value), str(value)) for value in values]
+    categories, positions = np.unique(np.array(clusters, dtype=object), return_inverse=True)
+    positions = np.append(positions, -1)
+    return pd.Categorical.from_codes(positions[np.where(codes >= 0, codes, len(values))], categories=categories)
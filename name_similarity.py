@@ -0,0 +1,165 @@
+import re
+from collections import Counter
+
+import numpy as np
+from fuzzywuzzy import fuzz
+from scipy import sparse
+
+# Score a pair of names needs to be "roughly similar" with each method. The names are only scored when they share a
+# cleaned word, and on real inventory names (Office and Visual C++ components, drivers, agents...) partial_ratio >= 50
+# then passes about 97% of pairs; the ones it rejects are long names sharing one word, whose ngram cosine scores are
+# spread over 9 to 50 like those of the pairs it passes, so no ngram threshold picks them out. With 'ngram' the name
+# check is therefore in effect the shared-word check: 6 only rejects the few pairs whose shared word is lost among
+# their other trigrams, and the workstation check decides the bundles.
+THRESHOLDS = {'partial_ratio': 50, 'ngram': 6}
+
+# filter out commonly used words in application titles
+common_words = ['Tool', 'Module', 'Update', 'Software', '', 'App', 'Client',
+                'Tools', 'for', 'and', 'in', 'Client', 'Installer', 'Drive',
+                'Driver', 'Web', 'Helper', 'Support', 'Center', 'Manager',
+                'File', 'Reader', 'C', 'Launcher', 'Plugin', 'Service', 'Setup', 'Driver',
+               'x86', '(x86)', 'x64', '(x64)', 'X86']
+
+# filter out numbers and version numbers
+def is_number(string):
+    matching = re.match(r'^\d+(\.\d+)*$', string)
+    if matching:
+        return True
+    return False
+
+# cleaning the name of characters such as dash, underscore etc.
+def clean_name(name):
+    words = re.split(' |,|_|-', name)
+    words = list(filter(lambda w: w not in common_words, words))
+    words = list(filter(lambda w: not is_number(w), words))
+    return words
+
+
+# Name-matching engine shared by the bundling checks: every distinct application name is cleaned and
+# tokenized once, and scores are computed for whole blocks of names at a time and cached.
+#
+# method='partial_ratio' reproduces the original fuzz.partial_ratio(clean_name(a), clean_name(b)) score exactly,
+# so the >= 50 threshold keeps its meaning. method='ngram' scores names by the TF-IDF cosine similarity (0-100)
+# of their character trigrams, computed as one sparse matrix product per block; it is much faster on large blocks
+# but its scores are on another scale, so it has its own threshold (see THRESHOLDS), which leaves little more
+# than the shared-word check.
+# If a normalization.NameTable is given, the cleaned tokens are read from (and added to) that shared table.
+class NameSimilarity:
+    def __init__(self, names, method='partial_ratio', name_table=None):
+        if method not in ('partial_ratio', 'ngram'):
+            raise ValueError("method must be 'partial_ratio' or 'ngram', not " + repr(method))
+        self.method = method
+        self.threshold = THRESHOLDS[method]
+        self.name_table = name_table
+        self.names = list(dict.fromkeys(str(name) for name in names))
+        self.position = {name: i for i, name in enumerate(self.names)}
+        if name_table is not None:
+            name_table.update(self.names)
+        self.token_lists = [self.clean(name) for name in self.names]
+        self.token_sets = [set(tokens) for tokens in self.token_lists]
+        # fuzz.partial_ratio compares token lists through their string form; building it once saves a str() per pair
+        self.token_strings = [str(tokens) for tokens in self.token_lists]
+        self.cache = {}
+        # The trigram vectors are (re)built lazily, the first time ngram scores are needed after names change
+        self.vectors = None
+
+    # Adds a name that was not part of the initial list (e.g. when queried from another dashboard)
+    def add(self, name):
+        name = str(name)
+        if name not in self.position:
+            self.position[name] = len(self.names)
+            self.names.append(name)
+            tokens = self.clean(name)
+            self.token_lists.append(tokens)
+            self.token_sets.append(set(tokens))
+            self.token_strings.append(str(tokens))
+            self.vectors = None
+        return self.position[name]
+
+    def clean(self, name):
+        if self.name_table is not None:
+            return self.name_table.tokens(name)
+        return clean_name(name)
+
+    def tokens(self, name):
+        return self.token_lists[self.add(name)]
+
+    # Same rule as checkIfSubword: the cleaned names must share a word, unless either raw name is one character long
+    def shares_word(self, name, other):
+        if len(str(name)) == 1 or len(str(other)) == 1:
+            return True
+        return bool(self.token_sets[self.add(name)] & self.token_sets[self.add(other)])
+
+    def score(self, name, other):
+        i, j = self.add(name), self.add(other)
+        if (i, j) not in self.cache:
+            self.cache[(i, j)] = int(self.score_positions([i], [j])[0, 0])
+        return self.cache[(i, j)]
+
+    # Checks that two names are roughly similar, by default with the method's threshold (the original >= 50 for
+    # partial_ratio)
+    def similar(self, name, other, threshold=None):
+        return self.score(name, other) >= (self.threshold if threshold is None else threshold)
+
+    # Scores every name in `names` against every name in `others`, returning a len(names) x len(others) matrix.
+    # The scores are cached, so the checks of those pairs afterwards are lookups.
+    def score_matrix(self, names, others):
+        rows = [self.add(name) for name in names]
+        columns = [self.add(other) for other in others]
+        return self.score_positions(rows, columns)
+
+    def score_positions(self, rows, columns):
+        if self.method == 'ngram':
+            scores = self.ngram_scores(rows, columns)
+            for r, i in enumerate(rows):
+                for c, j in enumerate(columns):
+                    self.cache[(i, j)] = int(scores[r, c])
+            return scores
+        scores = np.zeros((len(rows), len(columns)), dtype=np.int16)
+        for r, i in enumerate(rows):
+            for c, j in enumerate(columns):
+                if (i, j) not in self.cache:
+                    self.cache[(i, j)] = self.partial_ratio(i, j)
+                scores[r, c] = self.cache[(i, j)]
+        return scores
+
+    # fuzz.partial_ratio on two token lists: identical lists score 100 and an empty list scores 0,
+    # everything else is compared on the lists' string form
+    def partial_ratio(self, i, j):
+        if self.token_lists[i] == self.token_lists[j]:
+            return 100
+        if not self.token_lists[i] or not self.token_lists[j]:
+            return 0
+        return fuzz.partial_ratio(self.token_strings[i], self.token_strings[j])
+
+    # Character trigrams of each cleaned name, weighted by inverse document frequency and L2-normalized, as the
+    # rows of a sparse names x trigrams matrix
+    def build_ngram_vectors(self):
+        grams = [Counter(trigrams(' '.join(tokens).lower())) for tokens in self.token_lists]
+        vocabulary = {}
+        rows, columns, counts = [], [], []
+        for i, name_grams in enumerate(grams):
+            for gram, count in name_grams.items():
+                rows.append(i)
+                columns.append(vocabulary.setdefault(gram, len(vocabulary)))
+                counts.append(count)
+        matrix = sparse.csr_matrix((np.array(counts, dtype=float), (rows, columns)), shape=(len(grams), len(vocabulary)))
+        document_frequency = np.bincount(columns, minlength=len(vocabulary))
+        idf = np.log((1 + len(grams)) / (1 + document_frequency)) + 1
+        matrix = matrix.multiply(idf[None, :]).tocsr()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        self.vocabulary = vocabulary
+        self.vectors = sparse.diags(1 / norms) @ matrix
+
+    def ngram_scores(self, rows, columns):
+        if self.vectors is None:
+            self.build_ngram_vectors()
+        cosine = (self.vectors[rows] @ self.vectors[columns].T).toarray()
+        return np.rint(cosine * 100).astype(np.int16)
+
+
+# Overlapping three-character pieces of a name, padded so short names still produce some
+def trigrams(text):
+    text = '  ' + text + ' '
+    return [text[i:i + 3] for i in range(len(text) - 2)]
@@ -0,0 +1,153 @@
+import re
+
+import pandas as pd
+
+from name_similarity import common_words
+
+# Filters out fully numerical words (targeting years and version numbers)
+def is_non_number(s):
+    if len(s) == 0:
+        return False
+    if s[0].lower() == "v":
+        for char in s[1:]:
+            if char.isalpha():
+                return True
+        return False
+    else:
+        for char in s:
+            if char.isalpha():
+                return True
+        return False
+
+# Removes commas at the ends of words
+def remove_comma(word):
+    if len(word) == 0:
+        return word
+    if word[-1] == ",":
+        return word[:-1]
+    return word
+
+# Removes 32-bit and 64-bit tags on app names
+tags = ["ARM64", "arm64", "amd64", "arm", "ARM",
+        "X64", "X86", "x64", "x86", "64-bit", "32-bit", "32bit", "64bit"]
+
+def remove_tag_word(word):
+    new_word = word
+    for tag in tags:
+        if "(" + tag + ")" in new_word:
+            new_word = new_word.replace("(" + tag + ")", "")
+        elif "_" + tag in new_word:
+            new_word = new_word.replace("_" + tag, "")
+        elif tag in new_word:
+            new_word = word.replace(tag, "")
+
+    return new_word
+
+# Removes starting and ending parentheses for words
+def remove_parentheses_word(word):
+    if len(word) == 0:
+        return word
+    if (word[0] == "(" and ")" not in word) or (word[-1] == ")" and "(" not in word):
+        return ""
+    return word
+
+# Removes the word "version"
+def remove_version_word(word):
+    if "version" in word.lower():
+        return False
+    return True
+
+# Removes words that are empty
+def remove_blank_words(word):
+    return word != ""
+
+def normalize_name(app_name):
+    words = str(app_name).split()
+
+    words = list(filter(is_non_number, words)) # Removing version and years
+    words = list(map(remove_comma, words)) # Removing ending commas
+    words = list(map(remove_tag_word, words)) # Removing 32 vs 64 bit
+    words = list(map(remove_parentheses_word, words)) # Removing parentheses
+    words = list(filter(remove_version_word, words)) # Removing the word "version"
+    words = list(filter(remove_blank_words, words)) # Removing blank words
+
+    return " ".join(words)
+
+### Compiled versions of the rules above, applied with pandas string ops to each distinct word only once
+
+# A word is kept if it has a letter, not counting a leading "v" (ASCII words; others fall back to is_non_number)
+NON_NUMBER = re.compile(r'^(?:[vV]|(?![vV])).*[A-Za-z]')
+NON_ASCII = re.compile(r'[^\x00-\x7f]')
+TRAILING_COMMA = re.compile(r',\Z')
+# Words that contain any tag go through remove_tag_word itself, since it treats overlapping tags in order
+ANY_TAG = re.compile('|'.join(re.escape(tag) for tag in tags))
+UNBALANCED_PARENTHESES = re.compile(r'\([^)]*\Z|[^(]*\)\Z')
+# clean_name splits on spaces, commas, underscores and dashes and drops numbers such as "2016" or "4.9.1"
+NAME_SEPARATORS = r'[ ,_-]'
+NUMBER = r'^\d+(\.\d+)*$'
+
+
+# Applies the normalize_name word rules to a Series of distinct words, returning the transformed
+# words and whether each one is kept
+def normalize_words(words):
+    keep = words.str.contains(NON_NUMBER)
+    non_ascii = words.str.contains(NON_ASCII)
+    keep[non_ascii] = words[non_ascii].map(is_non_number)
+
+    words = words.str.replace(TRAILING_COMMA, '', regex=True)
+    tagged = words.str.contains(ANY_TAG)
+    words[tagged] = words[tagged].map(remove_tag_word)
+    words[words.str.fullmatch(UNBALANCED_PARENTHESES)] = ''
+
+    keep &= ~words.str.lower().str.contains('version', regex=False) & (words != '')
+    return words, keep
+
+
+# Splits each name into words, runs the rules once per distinct word and joins the kept words back per name
+def normalize_unique_names(names):
+    split = names.str.split()
+    distinct = pd.Series(pd.unique(split.explode().dropna()), dtype=object)
+    new_words, keep = normalize_words(distinct.copy())
+    # Dropped words map to None
+    lookup = dict(zip(distinct, new_words.where(keep, None)))
+    return pd.Series([' '.join(filter(None, map(lookup.get, words))) for words in split], index=names.index, dtype=object)
+
+
+# clean_name (the bundling tokenizer) for a Series of distinct names, returning a list of tokens per name
+def clean_unique_names(names):
+    split = names.str.split(NAME_SEPARATORS)
+    distinct = pd.Series(pd.unique(split.explode()), dtype=object)
+    dropped = set(distinct[distinct.isin(common_words) | distinct.str.match(NUMBER)])
+    return pd.Series([[token for token in tokens if token not in dropped] for tokens in split], index=names.index, dtype=object)
+
+
+# Shared table of every distinct application name seen so far, with its normalized name (normalize_name)
+# and its cleaned bundling tokens (clean_name). Names are only processed the first time they are added,
+# so the normalization output and the bundling stage can both read from the same table.
+class NameTable:
+    def __init__(self, names=()):
+        self.table = pd.DataFrame({'new_name': pd.Series(dtype=object), 'tokens': pd.Series(dtype=object)})
+        self.update(names)
+
+    # Adds any names that are not in the table yet
+    def update(self, names):
+        names = pd.Series(pd.unique(pd.Series(list(names), dtype=object).astype(str)), dtype=object)
+        names = names[~names.isin(self.table.index)].reset_index(drop=True)
+        if len(names) == 0:
+            return
+        new_rows = pd.DataFrame({'new_name': normalize_unique_names(names).values,
+                                 'tokens': clean_unique_names(names).values}, index=names.values)
+        self.table = pd.concat([self.table, new_rows]) if len(self.table) else new_rows
+
+    # Normalized names for a list or Series of names, in the same order
+    def normalize(self, names):
+        names = pd.Series(list(names), dtype=object).astype(str)
+        self.update(names)
+        return self.table['new_name'].reindex(names.values).values
+
+    # Cleaned bundling tokens for one name
+    def tokens(self, name):
+        name = str(name)
+        if name not in self.table.index:
+            self.update([name])
+        return self.table.at[name, 'tokens']
@@ -0,0 +1,265 @@
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from score_cache import WORKSTATION_THRESHOLD, passes, passes_names
+
+# Rows of the dashboard handed to a worker at a time are sized to hold at most about this many candidate pairs
+PAIRS_PER_TASK = 200000
+
+# Read-only arrays of the worker process, memory-mapped from the files written by parallel_bundle_checks
+shared = {}
+
+
+# Runs checkIfBundle for every candidate pair the createBundle loop can ask about, in a pool of `workers` processes,
+# and returns, for each row of the sorted dashboard, the candidate rows that pass, in the order the loop visits them.
+# Every check only depends on the two rows, so the pairs can be checked in any order and the loop then replays
+# the greedy grouping on the results, which gives exactly the bundles of the serial run.
+# The price is that the candidates of every row with at least min_count installations are checked, including rows
+# the serial loop skips because an earlier bundle already grouped them: which rows those are is only known once the
+# pairs are checked. On dashboards where most rows end up grouped this is more checks than the serial loop makes,
+# spread over the workers.
+# The workstation index, the cleaned name tokens and the per-row codes are written once as .npy files and
+# memory-mapped by every worker, so they are shared through the page cache instead of copied into each process.
+# `neighbours` is None for the 'window' candidates (rows within 10% installations, computed from the counts)
+# or a dict row -> ordered candidate rows (e.g. from lshNeighbours).
+# name_threshold (None uses the NameSimilarity's) and workstation_threshold are the thresholds of checkIfBundle.
+def parallel_bundle_checks(dashboard, workstation_index, name_similarity, workers=None, neighbours=None, min_count=100,
+                           name_threshold=None, workstation_threshold=WORKSTATION_THRESHOLD):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    counts = dashboard['# of unique installations'].to_numpy(dtype=np.int64)
+    # Rows the loop starts bundles from: the loop stops at the first application with fewer than min_count installations
+    active = int(np.searchsorted(-counts, -min_count, side='right'))
+
+    arrays = shared_arrays(dashboard, workstation_index, name_similarity)
+    arrays['thresholds'] = np.array([name_similarity.threshold if name_threshold is None else name_threshold,
+                                     workstation_threshold], dtype=np.float64)
+    if neighbours is None:
+        arrays['window_start'], arrays['window_stop'] = window_bounds(counts)
+        sizes = (arrays['window_stop'] - arrays['window_start'] - 1)[:active]
+    else:
+        sizes = add_neighbours(arrays, [neighbours.get(index, []) for index in range(active)])
+
+    passed = defaultdict(list)
+    for pairs in run_tasks(check_rows, arrays, sizes, workers):
+        for index, other in pairs:
+            passed[index].append(other)
+    return passed
+
+
+# Like parallel_bundle_checks, but takes its candidate pairs from a PairScoreCache (see score_cache.py) where it
+# can: pairs already scored are checked from their cached scores, and only the pairs never scored before are
+# sent to the worker processes, which return their scores to be added to the cache. The cache must be bound to
+# the same sorted dashboard, and its thresholds are the ones applied. Like parallel_bundle_checks it checks the candidates of rows the loop may skip.
+def cached_bundle_checks(dashboard, workstation_index, name_similarity, score_cache, workers=None, neighbours=None, min_count=100):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    counts = dashboard['# of unique installations'].to_numpy(dtype=np.int64)
+    active = int(np.searchsorted(-counts, -min_count, side='right'))
+    version_codes, _ = pd.factorize(dashboard['Version'])
+    if neighbours is None:
+        window_start, window_stop = window_bounds(counts)
+
+    # Candidates of every row in the order the createBundle loop visits them, with the version check made here
+    ordered, missing, queued = [], [], set()
+    for index in range(active):
+        if neighbours is None:
+            others = np.r_[index - 1:window_start[index] - 1:-1, index + 1:window_stop[index]]
+        else:
+            others = np.asarray(neighbours.get(index, []), dtype=np.int64)
+        others = others[version_codes[others] == version_codes[index]] if version_codes[index] >= 0 else others[:0]
+        others = [int(other) for other in others]
+        ordered.append(others)
+        # A pair is scored once, even if it is a candidate from both of its rows
+        missing.append([other for other in others if (min(index, other), max(index, other)) not in queued
+                        and score_cache.lookup(index, other) is None])
+        queued.update((min(index, other), max(index, other)) for other in missing[-1])
+
+    # Only the pairs missing from the cache are scored in the worker processes; their scores are kept by
+    # (lower row, higher row) for the checks below
+    fresh = {}
+    sizes = np.array([len(others) for others in missing], dtype=np.int64)
+    if sizes.sum():
+        arrays = shared_arrays(dashboard, workstation_index, name_similarity)
+        arrays['thresholds'] = np.array([score_cache.name_threshold, score_cache.workstation_threshold], dtype=np.float64)
+        add_neighbours(arrays, missing)
+        for results in run_tasks(score_rows, arrays, sizes, workers):
+            for index, other, shares_word, score, jaccard in results:
+                score_cache.put(index, other, shares_word, score, jaccard)
+                fresh[min(index, other), max(index, other)] = (shares_word, score, jaccard)
+
+    passed = defaultdict(list)
+    for index, others in enumerate(ordered):
+        for other in others:
+            scores = fresh.get((min(index, other), max(index, other)))
+            if scores is None:
+                scores = score_cache.scores(index, other)
+            if passes(*scores, score_cache.name_threshold, score_cache.workstation_threshold):
+                passed[index].append(other)
+    return passed
+
+
+# Same windows as windowNeighbours: 10 * (other - count) <= count above, 10 * (count - other) <= count below
+def window_bounds(counts):
+    return (np.searchsorted(-10 * counts, -11 * counts, side='left'),
+            np.searchsorted(-10 * counts, -9 * counts, side='right'))
+
+
+# Adds each row's list of candidate rows to the shared arrays and returns the number of candidates of each row
+def add_neighbours(arrays, lists):
+    sizes = np.array([len(others) for others in lists], dtype=np.int64)
+    arrays['neighbour_offsets'] = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    arrays['neighbour_rows'] = np.array([i for others in lists for i in others], dtype=np.int64)
+    return sizes
+
+
+# Runs `function` on ranges of rows (sized from each row's number of candidates) in a pool of `workers` processes
+# that memory-map the shared arrays, and returns the results of every range in row order
+def run_tasks(function, arrays, sizes, workers):
+    # At least a few tasks per worker so the load stays balanced, but not so many that the overhead shows
+    tasks = row_ranges(sizes, min(PAIRS_PER_TASK, int(sizes.sum()) // (4 * workers) + 1))
+    print('Candidate pairs: ' + str(int(sizes.sum())) + ' in ' + str(len(tasks)) + ' tasks on ' + str(workers) + ' workers')
+
+    directory = tempfile.mkdtemp(prefix='bundling_')
+    try:
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, name + '.npy'), values)
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_shared, initargs=(directory,)) as pool:
+            # map returns the results in task order, so the merged pairs are the same on every run
+            return list(pool.map(function, tasks))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# The per-row and per-name arrays the checks need. Versions and names are reduced to integer codes (a missing
+# version gets -1, which never matches, like NaN == NaN in checkVersion) and each name's tokens to codes into a
+# shared vocabulary, with the string form fuzz.partial_ratio compares kept alongside.
+def shared_arrays(dashboard, workstation_index, name_similarity):
+    names = dashboard['Application'].astype(object).to_numpy()
+    row_names = np.array([name_similarity.add(name) for name in names], dtype=np.int64)
+    version_codes, _ = pd.factorize(dashboard['Version'])
+    vocabulary = {}
+    token_codes = [[vocabulary.setdefault(token, len(vocabulary)) for token in tokens] for tokens in name_similarity.token_lists]
+    return {
+        'row_app': np.array([workstation_index.lookup.get(name, -1) for name in names], dtype=np.int64),
+        'row_name': row_names,
+        'row_short': np.array([len(str(name)) == 1 for name in names], dtype=bool),
+        'row_version': version_codes.astype(np.int64),
+        'workstation_ids': workstation_index.workstation_ids,
+        'workstation_offsets': workstation_index.offsets.astype(np.int64),
+        'token_codes': np.array([code for codes in token_codes for code in codes], dtype=np.int64),
+        'token_offsets': np.concatenate([[0], np.cumsum([len(codes) for codes in token_codes])]).astype(np.int64),
+        'token_strings': np.array(name_similarity.token_strings + [''], dtype=str),
+    }
+
+
+# Splits rows 0..len(sizes) into consecutive (start, stop) ranges of roughly pairs_per_task candidate pairs each
+def row_ranges(sizes, pairs_per_task):
+    if len(sizes) == 0:
+        return []
+    totals = np.cumsum(sizes)
+    boundaries = np.searchsorted(totals, np.arange(pairs_per_task, totals[-1], pairs_per_task), side='right')
+    edges = np.unique(np.concatenate([[0], boundaries, [len(sizes)]]))
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def load_shared(directory):
+    for filename in os.listdir(directory):
+        shared[filename[:-len('.npy')]] = np.load(os.path.join(directory, filename), mmap_mode='r')
+    shared['scores'] = {}
+
+
+# Candidate rows of a row, in the order the createBundle loop visits them
+def candidates(index):
+    if 'neighbour_rows' in shared:
+        offsets = shared['neighbour_offsets']
+        return np.asarray(shared['neighbour_rows'][offsets[index]:offsets[index + 1]])
+    above = np.arange(index - 1, shared['window_start'][index] - 1, -1)
+    below = np.arange(index + 1, shared['window_stop'][index])
+    return np.concatenate([above, below])
+
+
+def check_rows(task):
+    passed = []
+    for index in range(*task):
+        others = candidates(index)
+        # The version check is done for all the candidates of a row at once
+        version = shared['row_version'][index]
+        if version < 0:
+            continue
+        others = others[np.asarray(shared['row_version'][others]) == version]
+        for other in others:
+            if check_names(index, other) and check_workstations(index, other):
+                passed.append((index, int(other)))
+    return passed
+
+
+# Scores of every candidate pair of a range of rows, for the PairScoreCache: whether the names share a word, the
+# name score and, only for names that match, the Jaccard similarity of the workstation sets
+def score_rows(task):
+    scores = []
+    for index in range(*task):
+        for other in candidates(index):
+            other = int(other)
+            shares_word, score = shares_words(index, other), name_score(index, other)
+            jaccard = workstation_jaccard(index, other) if shares_word and passes_names(score, shared['thresholds'][0]) else None
+            scores.append((index, other, shares_word, score, jaccard))
+    return scores
+
+
+def tokens(name):
+    offsets = shared['token_offsets']
+    return shared['token_codes'][offsets[name]:offsets[name + 1]]
+
+
+# Same as NameSimilarity.shares_word and NameSimilarity.similar with the partial_ratio method
+def check_names(index, other):
+    return shares_words(index, other) and name_score(index, other) >= shared['thresholds'][0]
+
+
+def shares_words(index, other):
+    if shared['row_short'][index] or shared['row_short'][other]:
+        return True
+    return bool(np.intersect1d(tokens(shared['row_name'][index]), tokens(shared['row_name'][other])).size)
+
+
+def name_score(index, other):
+    name, other_name = shared['row_name'][index], shared['row_name'][other]
+    key = (int(name), int(other_name))
+    if key not in shared['scores']:
+        name_tokens, other_tokens = tokens(name), tokens(other_name)
+        if np.array_equal(name_tokens, other_tokens):
+            score = 100
+        elif not len(name_tokens) or not len(other_tokens):
+            score = 0
+        else:
+            score = fuzz.partial_ratio(str(shared['token_strings'][name]), str(shared['token_strings'][other_name]))
+        shared['scores'][key] = score
+    return shared['scores'][key]
+
+
+# Same as checkIfSimilarWorkstations: at least the threshold (70%) of the two applications' workstations are shared
+def check_workstations(index, other):
+    return workstation_jaccard(index, other) * 100 >= shared['thresholds'][1]
+
+
+# Same as WorkstationIndex.jaccard (0 for an application missing from the index)
+def workstation_jaccard(index, other):
+    app, other_app = shared['row_app'][index], shared['row_app'][other]
+    if app < 0 or other_app < 0:
+        return 0.0
+    offsets, ids = shared['workstation_offsets'], shared['workstation_ids']
+    workstations = ids[offsets[app]:offsets[app + 1]]
+    other_workstations = ids[offsets[other_app]:offsets[other_app + 1]]
+    overlap = len(np.intersect1d(workstations, other_workstations, assume_unique=True))
+    union = len(workstations) + len(other_workstations) - overlap
+    if union == 0:
+        return 0.0
+    return overlap / float(union)
@@ -0,0 +1,219 @@
+import ast
+import glob
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import sys
+import time
+import types
+
+from instrumentation import Measurement, RunReport, count_rows
+
+DEFAULT_PIPELINE_DIR = '.pipeline_cache'
+# Folder of the repository's modules, whose code is part of the stage keys
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Source file of the module with the given name if it is one of the repository's own (a file under root that
+# isn't an installed package), otherwise None
+def local_source(module_name, root):
+    module = sys.modules.get(module_name)
+    path = getattr(module, '__file__', None)
+    if module is None:
+        try:
+            spec = importlib.util.find_spec(module_name)
+        except (ImportError, ValueError):
+            spec = None
+        path = spec.origin if spec is not None else None
+    if not path or not path.endswith('.py') or 'site-packages' in path:
+        return None
+    path = os.path.abspath(path)
+    return path if path.startswith(root + os.sep) else None
+
+
+# The modules a source file imports (anywhere in it, including inside functions), as {name bound: module name}
+def imported_names(path):
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                names[alias.asname or alias.name.split('.')[0]] = alias.name
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            for alias in node.names:
+                names[alias.asname or alias.name] = node.module
+    return names
+
+
+# Names a function's code refers to, including the code of the functions, lambdas and comprehensions nested in it
+def referenced_names(code):
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= referenced_names(constant)
+    return names
+
+
+# The code a stage function depends on: the source of the function and of the other functions of its own file
+# (e.g. the script) that it calls, and the source of every repository module (see local_source) that any of them
+# uses something from, directly or through the imports of those modules in turn. Installed packages end the walk.
+def code_dependencies(function, root=SOURCE_DIR):
+    home_imports = imported_names(inspect.getsourcefile(function))
+    functions, sources = [], {}
+    pending_functions, pending_modules = [function], []
+
+    # Queues a module to be read and walked if it is one of the repository's own and wasn't seen yet
+    def follow(module_name):
+        if module_name in sources:
+            return
+        source = local_source(module_name, root)
+        if source is not None:
+            sources[module_name] = source
+            pending_modules.append(source)
+
+    while pending_functions or pending_modules:
+        if pending_functions:
+            current = pending_functions.pop()
+            if current in functions:
+                continue
+            functions.append(current)
+            for name in referenced_names(current.__code__):
+                value = current.__globals__.get(name)
+                if isinstance(value, types.FunctionType) and value.__module__ == function.__module__:
+                    pending_functions.append(value)
+                elif name in home_imports:
+                    follow(home_imports[name])
+                elif value is not None:
+                    # e.g. an object created by the script from a class of a repository module
+                    follow(type(value).__module__)
+        else:
+            for module_name in imported_names(pending_modules.pop()).values():
+                follow(module_name)
+
+    code = [inspect.getsource(current) for current in functions]
+    for module_name in sorted(sources):
+        with open(sources[module_name]) as f:
+            code.append(f.read())
+    return code
+
+
+# One step of a pipeline. `function` is called with the outputs of the `inputs` stages (in that order) and
+# `params` as keyword arguments. `outputs` are the files the stage writes and `fingerprint` an optional function
+# returning extra data (e.g. the size and mtime of input files) that should also invalidate the checkpoint; the code
+# the stage depends on is found from its function (see code_dependencies). Stages that are cheaper to rerun
+# than to load (such as reading from the ingest cache) can be declared with checkpoint=False.
+# `options` are keyword arguments that don't change the result (e.g. where to save a profile): they are left out of
+# the key, and a run with options doesn't replace the stage's checkpoint, so the next ordinary run still finds it.
+class Stage:
+    def __init__(self, name, function, inputs=(), params=None, outputs=(), fingerprint=None, checkpoint=True, options=None):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.options = options or {}
+        self.outputs = list(outputs)
+        self.fingerprint = fingerprint
+        self.checkpoint = checkpoint
+
+
+# Runs stages in dependency order, checkpointing each stage's result to disk under a key that hashes the stage's
+# code, parameters and fingerprint together with the keys of the stages it reads from. A stage is only rerun when
+# that key changes (so anything upstream changed) or its checkpoint or output files are missing; otherwise its
+# result is loaded from the checkpoint, and stages upstream of it are not touched at all.
+# Every stage that runs or is loaded is measured (wall and CPU time, peak memory, rows in and out) into
+# self.report, which write_report saves as JSON. trace_memory=True adds tracemalloc peaks, at some cost in speed.
+class Pipeline:
+    def __init__(self, stages, cache_dir=DEFAULT_PIPELINE_DIR, trace_memory=False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.trace_memory = trace_memory
+        self.keys = {}
+        self.results = {}
+        self.report = RunReport()
+
+    def key(self, name):
+        if name not in self.keys:
+            stage = self.stages[name]
+            description = {'name': name, 'params': stage.params, 'code': code_dependencies(stage.function),
+                           'fingerprint': stage.fingerprint() if stage.fingerprint else None,
+                           'inputs': [self.key(input_name) for input_name in stage.inputs]}
+            encoded = json.dumps(description, sort_keys=True, default=repr).encode('utf-8')
+            self.keys[name] = hashlib.sha256(encoded).hexdigest()[:16]
+        return self.keys[name]
+
+    def checkpoint_path(self, name):
+        return os.path.join(self.cache_dir, name + '-' + self.key(name) + '.pkl')
+
+    # True when the stage's checkpoint matches its current key and all of its output files exist
+    def is_current(self, name):
+        stage = self.stages[name]
+        if not stage.checkpoint or not os.path.exists(self.checkpoint_path(name)):
+            return False
+        return all(os.path.exists(output) for output in stage.outputs)
+
+    # Returns the result of a stage, loading it from its checkpoint or running it (and whatever it needs) first
+    def result(self, name, force=False):
+        if name in self.results and not force:
+            return self.results[name]
+        stage = self.stages[name]
+        if not force and self.is_current(name):
+            with Measurement(self.trace_memory) as measurement:
+                with open(self.checkpoint_path(name), 'rb') as f:
+                    self.results[name] = pickle.load(f)
+            self.record(name, 'checkpoint', measurement, None)
+            print(name + ' (checkpoint ' + self.key(name) + ')')
+            return self.results[name]
+
+        args = [self.result(input_name) for input_name in stage.inputs]
+        with Measurement(self.trace_memory) as measurement:
+            self.results[name] = stage.function(*args, **stage.params, **stage.options)
+        start = time.perf_counter()
+        if stage.checkpoint and not stage.options:
+            self.save_checkpoint(name)
+        measurement.result['checkpoint_seconds'] = round(time.perf_counter() - start, 4)
+        self.record(name, 'ran', measurement, args[0] if args else None)
+        print(name + ' (ran, {:.2f}s)'.format(measurement.result['wall_seconds']))
+        return self.results[name]
+
+    # Adds a stage's measurements to the run report; rows in are counted on the stage's first input
+    def record(self, name, status, measurement, first_input):
+        entry = {'stage': name, 'status': status, 'key': self.key(name),
+                 'rows_in': count_rows(first_input), 'rows_out': count_rows(self.results[name])}
+        entry.update(measurement.result)
+        self.report.add(entry)
+
+    def write_report(self, path):
+        self.report.write(path)
+
+    # Writes the checkpoint to a temporary file first, then removes the stage's older checkpoints
+    def save_checkpoint(self, name):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.checkpoint_path(name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self.results[name], f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        for old_path in glob.glob(os.path.join(glob.escape(self.cache_dir), glob.escape(name) + '-*.pkl')):
+            if old_path != path:
+                os.remove(old_path)
+
+    # Runs the given stages (all of them by default, in declaration order); stages in `force` are rerun even if current
+    def run(self, targets=None, force=()):
+        for name in targets or list(self.stages):
+            if name not in self.stages:
+                raise ValueError('Unknown stage ' + repr(name) + ', expected one of: ' + ', '.join(self.stages))
+            self.result(name, force=name in force)
+
+    # Prints whether each stage's checkpoint is current or the stage would be rerun
+    def status(self):
+        for name, stage in self.stages.items():
+            if not stage.checkpoint:
+                state = 'not checkpointed'
+            elif self.is_current(name):
+                state = 'current (' + self.key(name) + ')'
+            else:
+                state = 'stale'
+            print(name + ': ' + state)
@@ -0,0 +1,260 @@
+import hashlib
+import math
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dashboards import MISSING_VERSION, VERSION_KEYS, version_labels
+from ingest import DEFAULT_CACHE_DIR, file_signature, iter_inventory_chunks
+from dedup import GOLDEN_GAMMA, mix
+from streaming import StreamingAggregator
+
+# Registers per sketch are 2**PRECISION; the estimates' relative standard error is 1.04 / sqrt(2**PRECISION),
+# 1.6% at 12
+PRECISION = 12
+# Number of standard errors on either side of an estimate covered by its low/high bounds (about 95%)
+BOUND_ERRORS = 1.96
+
+GROUP_COLUMNS = VERSION_KEYS + ['missing_version']
+
+
+# Number of leading zero bits of each 64-bit value (64 for 0), by halving the width six times
+def leading_zeros(values):
+    values = values.copy()
+    zeros = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        small = values < np.uint64(1 << (64 - shift))
+        zeros += small * shift
+        values = np.where(small, values << np.uint64(shift), values)
+    return zeros + (values == 0)
+
+
+# Keeps the largest rank of every key. Ranks are below 64, so each (key, rank) pair is packed into one integer
+# and a single sort brings every key's largest rank last.
+def max_per_key(keys, ranks):
+    packed = np.sort(keys.astype(np.int64) << 6 | ranks.astype(np.int64))
+    keys = packed >> 6
+    last = np.r_[keys[1:] != keys[:-1], True] if len(keys) else np.zeros(0, dtype=bool)
+    return keys[last], (packed[last] & 63).astype(np.uint8)
+
+
+# 64-bit hash of each value, computed once per distinct value. Dates are brought to one resolution first so a scan
+# date hashes the same whether it came from the Parquet cache or straight from a workbook, as in streaming.py.
+def value_hashes(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = series.astype('datetime64[ns]')
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return pd.util.hash_pandas_object(pd.Series(uniques), index=False).values[codes]
+
+
+# Hash of each installation (workstation and scan date). Within a (Publisher, Application[, Version]) group this
+# matches the duplicate check; unlike it, the same installation listed under two publisher names counts in both groups.
+def installation_hashes(chunk, workstation_column):
+    with np.errstate(over='ignore'):
+        return mix(value_hashes(chunk[workstation_column]) * GOLDEN_GAMMA + value_hashes(chunk['Last HW Scan']))
+
+
+# HyperLogLog sketches of the distinct installations (workstation and scan date) of every
+# (Publisher, Application, Version) group, with the exact number of entries of each group. The registers are kept
+# sparse, as (group * 2**precision + register, rank) pairs of the registers that are set, so a group with a few
+# installations costs a few entries rather than 2**precision registers.
+# Sketches of different files or chunks are combined with merge(), which takes the larger rank of every register:
+# the result is exactly the sketch of all their rows together, so files can be sketched separately (in parallel,
+# or once and kept for later runs) and merged. The dashboard without versions is estimated the same way, by merging
+# the registers of each application's versions.
+class DashboardSketch:
+    def __init__(self, precision=PRECISION):
+        self.precision = precision
+        self.groups = pd.DataFrame({column: pd.Series(dtype=object) for column in GROUP_COLUMNS})
+        self.entries = np.zeros(0, dtype=np.int64)
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.ranks = np.zeros(0, dtype=np.uint8)
+        self.rows = 0
+
+    # Sketch of one chunk of install records (already filtered). The groups are found from the integer codes of
+    # the three columns and only the distinct ones are turned back into strings.
+    @classmethod
+    def from_rows(cls, chunk, workstation_column, precision=PRECISION):
+        sketch = cls(precision)
+        publisher_codes, publishers = pd.factorize(chunk['Publisher'])
+        application_codes, applications = pd.factorize(chunk['Application'])
+        version, missing_version = version_labels(chunk['Version'])
+        version_codes = np.asarray(version.codes, dtype=np.int64)
+
+        # Rows without a publisher or application are left out, like the dashboards' groupby does
+        kept = (publisher_codes >= 0) & (application_codes >= 0)
+        combined = ((publisher_codes[kept].astype(np.int64) * len(applications) + application_codes[kept]) *
+                    len(version.categories) + version_codes[kept]) * 2 + missing_version[kept]
+        group, uniques = pd.factorize(combined)
+        uniques = np.asarray(uniques, dtype=np.int64)
+        sketch.groups = pd.DataFrame({
+            'Publisher': np.asarray(publishers, dtype=object)[uniques // 2 // len(version.categories) // len(applications)],
+            'Application': np.asarray(applications, dtype=object)[uniques // 2 // len(version.categories) % len(applications)],
+            'Version': np.asarray(version.categories, dtype=object)[uniques // 2 % len(version.categories)],
+            'missing_version': (uniques % 2).astype(bool)})
+        sketch.entries = np.bincount(group, minlength=len(uniques)).astype(np.int64)
+        sketch.rows = int(kept.sum())
+
+        # The top bits of each installation's hash pick its register, the position of the first set bit in the
+        # rest is its rank
+        hashes = installation_hashes(chunk[kept], workstation_column)
+        registers = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        ranks = np.minimum(leading_zeros(hashes << np.uint64(precision)), 64 - precision) + 1
+        sketch.keys, sketch.ranks = max_per_key(group.astype(np.int64) << precision | registers, ranks)
+        return sketch
+
+    # Combines other sketches (of the same precision) into this one, with one sort of all their registers
+    def merge(self, *others):
+        sketches = [self] + list(others)
+        for other in others:
+            if other.precision != self.precision:
+                raise ValueError('cannot merge sketches of precision %d and %d' % (self.precision, other.precision))
+        groups = pd.concat([sketch.groups for sketch in sketches], ignore_index=True)
+        codes = groups.groupby(GROUP_COLUMNS, sort=False).ngroup().to_numpy().astype(np.int64)
+        mask = (1 << self.precision) - 1
+        keys = []
+        offset = 0
+        for sketch in sketches:
+            keys.append(codes[offset + (sketch.keys >> self.precision)] << self.precision | (sketch.keys & mask))
+            offset += len(sketch.groups)
+        self.keys, self.ranks = max_per_key(np.concatenate(keys), np.concatenate([sketch.ranks for sketch in sketches]))
+        self.entries = np.bincount(codes, weights=np.concatenate([sketch.entries for sketch in sketches]),
+                                   minlength=codes.max() + 1 if len(codes) else 0).astype(np.int64)
+        self.groups = groups.drop_duplicates(GROUP_COLUMNS).reset_index(drop=True)
+        self.rows += sum(other.rows for other in others)
+        return self
+
+    # Estimated distinct installations of every group given by `codes` (one per sketch group, -1 to leave a group
+    # out): the groups with the same code are merged first. Returns the estimates and the standard error of each.
+    def estimate(self, codes, size):
+        m = 1 << self.precision
+        entry_codes = codes[self.keys >> self.precision]
+        kept = entry_codes >= 0
+        keys, ranks = max_per_key(entry_codes[kept].astype(np.int64) << self.precision | (self.keys[kept] & (m - 1)), self.ranks[kept])
+        group = keys >> self.precision
+        set_registers = np.bincount(group, minlength=size)
+        zeros = m - set_registers
+        inverse_sum = np.bincount(group, weights=np.exp2(-ranks.astype(np.float64)), minlength=size) + zeros
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimates = alpha * m * m / inverse_sum
+        # Small counts are estimated from the number of empty registers (linear counting), which is nearly exact
+        small = (estimates <= 2.5 * m) & (zeros > 0)
+        estimates[small] = m * np.log(m / zeros[small])
+        return estimates, estimates * 1.04 / math.sqrt(m)
+
+    # Preview of (dashboard, v_full): the exact # of all entries and the estimated # of unique installations of
+    # each group, with low and high bounds (BOUND_ERRORS standard errors, capped at 0 and the # of all entries)
+    # and the # of duplicate installations that leaves, sorted by estimated unique installations.
+    # The duplicate check of the dashboards counts an installation once per application (and version), for the
+    # publisher name of its first entry, which a sketch of each group can't reproduce: the groups of an application
+    # listed under several publisher names count every installation listed under their own name, so their estimate
+    # is above the dashboards' count by the installations the dashboards credit to another name. Those rows are
+    # flagged in the `Several Publishers` column and the bounds only hold for the other rows.
+    def dashboards(self):
+        groups = self.groups
+        app_codes = groups.groupby(['Publisher', 'Application'], sort=False).ngroup().to_numpy()
+        apps = groups.drop_duplicates(['Publisher', 'Application'])[['Publisher', 'Application']].reset_index(drop=True)
+        app_entries = np.bincount(app_codes, weights=self.entries, minlength=len(apps)).astype(np.int64)
+        dashboard = preview_table(apps, app_entries, *self.estimate(app_codes, len(apps)),
+                                  several_publishers(apps, ['Application']))
+
+        # Installations without a version are counted under MISSING_VERSION, like the full dashboards do
+        missing_version = groups['missing_version'].to_numpy(dtype=bool)
+        groups = groups.assign(Version=np.where(missing_version, MISSING_VERSION, groups['Version'].astype(object).to_numpy()))
+        version_codes = groups.groupby(VERSION_KEYS, sort=False).ngroup().to_numpy()
+        versions = groups.drop_duplicates(VERSION_KEYS)[VERSION_KEYS].reset_index(drop=True)
+        version_entries = np.bincount(version_codes, weights=self.entries, minlength=len(versions)).astype(np.int64)
+        v_full = preview_table(versions, version_entries, *self.estimate(version_codes, len(versions)),
+                               several_publishers(versions, ['Application', 'Version']))
+        return dashboard, v_full
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+# Whether each group's application (and version, by `columns`) is also listed under another publisher name
+def several_publishers(groups, columns):
+    return (groups.groupby(columns, sort=False)['Publisher'].transform('size') > 1).to_numpy()
+
+
+def preview_table(groups, entries, estimates, errors, shared):
+    table = groups.copy()
+    unique = np.minimum(np.round(estimates), entries).astype(np.int64)
+    table['# of all entries'] = entries
+    table['# of unique installations (est.)'] = unique
+    table['# of unique installations (low)'] = np.clip(np.floor(estimates - BOUND_ERRORS * errors), 0, entries).astype(np.int64)
+    table['# of unique installations (high)'] = np.minimum(np.ceil(estimates + BOUND_ERRORS * errors), entries).astype(np.int64)
+    table['# of duplicate installations (est.)'] = entries - unique
+    table['Several Publishers'] = shared
+    return table.sort_values(by=['# of unique installations (est.)', '# of all entries'], ascending=False).reset_index(drop=True)
+
+
+# Sketches one export, chunk by chunk, with the same server (and GOTS) filter as the streaming dashboards.
+# The file's signature is kept on the sketch so a saved sketch can be reused while the file is unchanged.
+def sketch_file(filepath, workstation_column, precision=PRECISION, chunk_size=500000, cache_dir=DEFAULT_CACHE_DIR,
+                remove_servers=True, remove_gots=False):
+    rows = StreamingAggregator(workstation_column, remove_servers=remove_servers, remove_gots=remove_gots, track_workstations=False)
+    chunks = []
+    for chunk in iter_inventory_chunks([filepath], rows.columns(), chunk_size=chunk_size, cache_dir=cache_dir):
+        chunk = rows.filter(chunk)
+        if len(chunk):
+            chunks.append(DashboardSketch.from_rows(chunk, workstation_column, precision))
+    sketch = DashboardSketch(precision).merge(*chunks)
+    sketch.signature = file_signature(filepath)
+    sketch.options = {'workstation_column': workstation_column, 'remove_servers': remove_servers, 'remove_gots': remove_gots}
+    return sketch
+
+
+def sketch_path(sketch_dir, filepath, precision):
+    name = hashlib.sha256(os.path.abspath(filepath).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(sketch_dir, '%s-p%d.pkl' % (name, precision))
+
+
+# Builds the merged sketch of every export. Files are sketched in a pool of `workers` processes (None uses every
+# core); with a sketch_dir, each file's sketch is saved there and reused by later previews until the file
+# changes, so a preview after adding an export only reads the new file.
+def preview_inventory(file_paths, workstation_column, precision=PRECISION, workers=1, sketch_dir=None,
+                      chunk_size=500000, cache_dir=DEFAULT_CACHE_DIR, remove_servers=True, remove_gots=False):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    options = {'workstation_column': workstation_column, 'remove_servers': remove_servers, 'remove_gots': remove_gots}
+    if sketch_dir:
+        os.makedirs(sketch_dir, exist_ok=True)
+
+    sketches = {}
+    stale = []
+    for filepath in file_paths:
+        path = sketch_path(sketch_dir, filepath, precision) if sketch_dir else None
+        if path and os.path.exists(path):
+            saved = DashboardSketch.load(path)
+            if saved.signature == file_signature(filepath) and saved.options == options:
+                sketches[filepath] = saved
+                print(filepath + ' (sketch reused)')
+                continue
+        stale.append(filepath)
+
+    arguments = (workstation_column, precision, chunk_size, cache_dir, remove_servers, remove_gots)
+    if workers > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(stale))) as pool:
+            results = pool.map(sketch_file, stale, *[[argument] * len(stale) for argument in arguments])
+            sketches.update(zip(stale, results))
+    else:
+        for filepath in stale:
+            sketches[filepath] = sketch_file(filepath, *arguments)
+    if sketch_dir:
+        for filepath in stale:
+            sketches[filepath].save(sketch_path(sketch_dir, filepath, precision))
+
+    merged = DashboardSketch(precision).merge(*[sketches[filepath] for filepath in file_paths])
+    print('Rows sketched: ' + str(merged.rows))
+    return merged
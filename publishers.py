@@ -0,0 +1,130 @@
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from name_similarity import trigrams
+
+# Legal-form suffixes (and "the"), dropped before publisher names are compared. Words that describe the business
+# ("systems", "software", "technologies", ...) are kept: without them "Applied Systems" and "Applied Software" would
+# both become "applied".
+LEGAL_WORDS = {'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'llc', 'ltd', 'limited', 'plc',
+               'gmbh', 'ag', 'sa', 'srl', 'bv', 'nv', 'pty', 'lp', 'llp', 'the'}
+TRADEMARKS = re.compile(r'\((?:r|tm|c)\)|[®™©]', re.IGNORECASE)
+PUNCTUATION = re.compile(r'[^\w\s]+')
+NUMBERS = re.compile(r'\d+')
+
+
+# Comparison key of a publisher name: lowercase, without trademark signs, punctuation and legal words, so that
+# "Intel", "Intel Corporation" and "Intel(R) Corporation" all become "intel". Names made only of those words are
+# kept as they are.
+def publisher_key(name):
+    text = PUNCTUATION.sub(' ', TRADEMARKS.sub(' ', str(name).lower()))
+    words = text.split()
+    kept = [word for word in words if word not in LEGAL_WORDS]
+    return ' '.join(kept or words)
+
+
+# First letters of a multi-word key ("advanced micro devices" -> "amd", "international business machines" -> "ibm"),
+# for publishers also known by their initials. Only legal forms are dropped from keys, so the initials are those of
+# the full name ("OSI Systems" has no acronym and stays apart from "Open Source Initiative").
+def acronym(key):
+    words = key.split()
+    return ''.join(word[0] for word in words) if len(words) >= 3 else None
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+# Groups spelling variants of the same publisher and picks one canonical name for each group.
+# Names are first reduced to their publisher_key, which already merges most variants. The keys are then blocked
+# by their character trigrams (an inverted index from trigram to keys, leaving out trigrams so common they would
+# make huge blocks), and only keys that share at least half their trigrams are compared with fuzz.ratio, so the
+# fuzzy comparisons stay close to linear in the number of publishers. Keys scoring `threshold` or more (with the
+# same numbers in them), and keys that are the initials of another key, are merged.
+# weights (e.g. installation counts) decide the canonical name of a group: its most used spelling.
+def canonical_publishers(publishers, weights=None, threshold=90, max_block=500):
+    publishers = pd.Series(list(publishers), dtype=object)
+    weights = pd.Series(1 if weights is None else list(weights), index=publishers.index, dtype=float)
+    known = publishers.notna()
+    totals = weights[known].groupby(publishers[known].astype(str), sort=True).sum()
+    names = list(totals.index)
+    if not names:
+        return {}
+
+    keys = [publisher_key(name) for name in names]
+    distinct_keys = list(dict.fromkeys(keys))
+    key_ids = {key: i for i, key in enumerate(distinct_keys)}
+    groups = UnionFind(len(distinct_keys))
+
+    grams = [set(trigrams(key)) for key in distinct_keys]
+    numbers = [NUMBERS.findall(key) for key in distinct_keys]
+    index = defaultdict(list)
+    for i, key_grams in enumerate(grams):
+        for gram in key_grams:
+            index[gram].append(i)
+    for i, key_grams in enumerate(grams):
+        shared = Counter()
+        for gram in key_grams:
+            block = index[gram]
+            if len(block) <= max_block:
+                shared.update(j for j in block if j > i)
+        for j, count in shared.items():
+            # Keys with different numbers in them ("foo 1" and "foo 12") are different publishers however close they look
+            if count * 2 >= min(len(key_grams), len(grams[j])) and numbers[i] == numbers[j] and \
+                    fuzz.ratio(distinct_keys[i], distinct_keys[j]) >= threshold:
+                groups.union(i, j)
+
+    for key in distinct_keys:
+        short = acronym(key)
+        if short is not None and short in key_ids:
+            groups.union(key_ids[key], key_ids[short])
+
+    # The canonical name of each group is its spelling with the largest weight (ties go to the first name)
+    group_of = np.array([groups.find(key_ids[key]) for key in keys])
+    best = {}
+    for name, group, total in zip(names, group_of, totals.values):
+        if group not in best or total > best[group][1]:
+            best[group] = (name, total)
+    return {name: best[group][0] for name, group in zip(names, group_of)}
+
+
+# Applications that show up under more than one publisher name in the dashboard (among the rows with more than
+# min_installations unique installations), found with one groupby instead of a scan of the dashboard per application.
+# Publishers lists the names in dashboard order as before; Canonical Publishers lists the groups they belong to
+# (see canonical_publishers) and # of Canonical Publishers how many there are. Applications under two or more
+# canonical publishers, the actual problems, come first; Same Publisher marks the others, whose names are all
+# spellings of one publisher, and spelling_variants=False leaves them out.
+def find_problematic_apps(dashboard, canonical, min_installations=100, spelling_variants=True):
+    rows = dashboard[dashboard['# of unique installations'] > min_installations]
+    rows = pd.DataFrame({'Application': rows['Application'].values,
+                         'Publisher': rows['Publisher'].astype(object).values})
+    rows['Canonical'] = rows['Publisher'].map(canonical).fillna(rows['Publisher'])
+
+    grouped = rows.groupby('Application', sort=False, observed=True, dropna=False)
+    problems = grouped.agg(count=('Publisher', 'size'),
+                           Publishers=('Publisher', lambda names: str(list(names))[1:-1].replace("'", '')),
+                           canonical=('Canonical', lambda names: list(dict.fromkeys(names))))
+    problems = problems[problems['count'] > 1].reset_index()
+    problems['Canonical Publishers'] = problems['canonical'].map(lambda names: ', '.join(map(str, names)))
+    problems['# of Canonical Publishers'] = problems['canonical'].map(len).astype(np.int64)
+    problems['Same Publisher'] = problems['# of Canonical Publishers'] == 1
+    if not spelling_variants:
+        problems = problems[~problems['Same Publisher']]
+    problems = problems.sort_values(by='Same Publisher', kind='stable').reset_index(drop=True)
+    return problems[['Application', 'Publishers', 'Canonical Publishers', '# of Canonical Publishers', 'Same Publisher']]
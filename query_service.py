@@ -0,0 +1,353 @@
+import argparse
+import bisect
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_INDEX_DIR = 'query_index'
+# Name of the file that points at the generation readers should use; it is replaced in one step after a
+# generation is completely written, which is what readers watch to hot-reload
+CURRENT_NAME = 'CURRENT'
+# Bumped whenever the layout of a generation changes, so a server never misreads an index from another version
+INDEX_VERSION = 1
+DEFAULT_PORT = 8765
+
+# Dashboard columns kept in the index, and the counts among them
+DASHBOARD_COLUMNS = ['Publisher', 'Application', 'Version', '# of all entries', '# of duplicate installations',
+                     '# of unique installations']
+COUNT_COLUMNS = DASHBOARD_COLUMNS[3:]
+
+
+### Writing the index at the end of a pipeline run
+
+# Strings are stored as one UTF-8 byte array with the offset of each string, plus the order that sorts them,
+# so they can be memory-mapped and looked up by binary search without being loaded
+def save_strings(directory, name, values):
+    encoded = [str(value).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    np.save(os.path.join(directory, name + '.bytes.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(directory, name + '.offsets.npy'), offsets)
+    np.save(os.path.join(directory, name + '.order.npy'), np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int64))
+
+
+# Rows grouped by a code (0..size-1): the row numbers in code order and where each code's rows start
+def group_rows(codes, size):
+    codes = np.asarray(codes, dtype=np.int64)
+    known = np.flatnonzero(codes >= 0)
+    order = known[np.argsort(codes[known], kind='stable')]
+    return order, np.searchsorted(codes[order], np.arange(size + 1))
+
+
+# One row per bundle member (bundle number, Publisher, Application, Version) from either bundling engine:
+# the bundle table of bundle_graph, or createBundle's rows of "name || publisher || version" strings
+# (the first one being the application the bundle was found from, followed by its count)
+def bundle_members(bundles):
+    if bundles is None or len(bundles) == 0:
+        return pd.DataFrame(columns=['bundle', 'Publisher', 'Application', 'Version'])
+    if 'bundle' in bundles.columns:
+        return bundles[['bundle', 'Publisher', 'Application', 'Version']].astype({'bundle': np.int64})
+    members = []
+    number = 0
+    for row in bundles.itertuples(index=False, name=None):
+        others = [value for value in row[2:] if isinstance(value, str)]
+        if not others:
+            continue
+        number += 1
+        for value in [row[0]] + others:
+            application, publisher, version = value.rsplit(' || ', 2)
+            members.append((number, publisher, application, version))
+    return pd.DataFrame(members, columns=['bundle', 'Publisher', 'Application', 'Version'])
+
+
+# Writes a new generation of the query index into directory and points CURRENT at it: the application ->
+# workstations lists of a WorkstationIndex and their transpose (workstation -> applications), the dashboard with
+# versions and the bundles, all as .npy files a QueryIndex memory-maps. Generations older than the previous one
+# are removed; the previous one is kept for readers that still have it open.
+def write_query_index(directory, workstation_index, dashboard, bundles=None):
+    os.makedirs(directory, exist_ok=True)
+    generation = time.strftime('%Y%m%d-%H%M%S') + '-%06d' % (time.time() % 1 * 1000000)
+    path = os.path.join(directory, generation)
+    os.makedirs(path)
+
+    applications = [str(key) for key in workstation_index.keys]
+    lookup = {name: code for code, name in enumerate(applications)}
+    save_strings(path, 'applications', applications)
+    save_strings(path, 'workstations', workstation_index.workstation_names)
+    np.save(os.path.join(path, 'app_offsets.npy'), np.asarray(workstation_index.offsets, dtype=np.int64))
+    np.save(os.path.join(path, 'app_workstations.npy'), np.asarray(workstation_index.workstation_ids, dtype=np.int32))
+
+    # The same pairs ordered by workstation
+    app_of_pair = np.repeat(np.arange(len(applications), dtype=np.int32), workstation_index.sizes)
+    order, ws_offsets = group_rows(workstation_index.workstation_ids, len(workstation_index.workstation_names))
+    np.save(os.path.join(path, 'workstation_offsets.npy'), ws_offsets)
+    np.save(os.path.join(path, 'workstation_apps.npy'), app_of_pair[order])
+
+    dashboard = dashboard[DASHBOARD_COLUMNS]
+    for column in ['Publisher', 'Application', 'Version']:
+        save_strings(path, 'dashboard_' + column.lower(), dashboard[column].astype(object).values)
+    np.save(os.path.join(path, 'dashboard_counts.npy'), dashboard[COUNT_COLUMNS].to_numpy(dtype=np.int64))
+    dashboard_codes = [lookup.get(str(name), -1) for name in dashboard['Application'].astype(object)]
+    rows, offsets = group_rows(dashboard_codes, len(applications))
+    np.save(os.path.join(path, 'dashboard_rows.npy'), rows)
+    np.save(os.path.join(path, 'dashboard_offsets.npy'), offsets)
+
+    members = bundle_members(bundles).sort_values('bundle', kind='stable')
+    for column in ['Publisher', 'Application', 'Version']:
+        save_strings(path, 'bundle_' + column.lower(), members[column].astype(object).values)
+    numbers = members['bundle'].to_numpy(dtype=np.int64)
+    np.save(os.path.join(path, 'bundle_numbers.npy'), numbers)
+    np.save(os.path.join(path, 'bundle_offsets.npy'), np.searchsorted(numbers, np.arange(numbers.max() + 2 if len(numbers) else 1)))
+    member_codes = [lookup.get(str(name), -1) for name in members['Application'].astype(object)]
+    rows, offsets = group_rows(member_codes, len(applications))
+    np.save(os.path.join(path, 'bundle_rows.npy'), rows)
+    np.save(os.path.join(path, 'bundle_app_offsets.npy'), offsets)
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'generation': generation, 'written': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'applications': len(applications), 'workstations': len(workstation_index.workstation_names),
+                   'dashboard_rows': len(dashboard), 'bundles': int(len(np.unique(numbers)))}, f, indent=2)
+
+    previous = read_current(directory)
+    current_path = os.path.join(directory, CURRENT_NAME)
+    with open(current_path + '.tmp', 'w') as f:
+        f.write(generation)
+    os.replace(current_path + '.tmp', current_path)
+    for name in os.listdir(directory):
+        if name not in (generation, previous, CURRENT_NAME) and os.path.isdir(os.path.join(directory, name)):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    print('Query index written to ' + path)
+    return path
+
+
+def read_current(directory):
+    try:
+        with open(os.path.join(directory, CURRENT_NAME)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+### Reading it
+
+# Memory-mapped strings written by save_strings
+class StringTable:
+    def __init__(self, path, name):
+        self.data = np.load(os.path.join(path, name + '.bytes.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, name + '.offsets.npy'), mmap_mode='r')
+        self.order = np.load(os.path.join(path, name + '.order.npy'), mmap_mode='r')
+        self.values = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    # Position of a string, or -1, by binary search over the sorted order
+    def find(self, value):
+        encoded = str(value).encode('utf-8')
+        sorted_values = SortedView(self)
+        i = bisect.bisect_left(sorted_values, encoded)
+        if i < len(self) and sorted_values[i] == encoded:
+            return int(self.order[i])
+        return -1
+
+    # Every string, decoded once and kept (used by substring searches)
+    def all(self):
+        if self.values is None:
+            self.values = [self[i] for i in range(len(self))]
+        return self.values
+
+
+# The strings of a StringTable in sorted order, as bytes, for bisect
+class SortedView:
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, i):
+        j = self.table.order[i]
+        return self.table.data[self.table.offsets[j]:self.table.offsets[j + 1]].tobytes()
+
+
+# Read-only lookups over one generation of the query index. Every array is memory-mapped, so opening an index
+# takes milliseconds and only the pages a lookup touches are read.
+class QueryIndex:
+    def __init__(self, directory=DEFAULT_INDEX_DIR, generation=None):
+        self.directory = directory
+        self.generation = generation or read_current(directory)
+        if self.generation is None:
+            raise FileNotFoundError('No query index in ' + directory + ' (run the pipeline first)')
+        path = os.path.join(directory, self.generation)
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != INDEX_VERSION:
+            raise ValueError('The query index in ' + path + ' was written by another version, rerun the pipeline')
+
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        self.application_names = StringTable(path, 'applications')
+        self.workstation_names = StringTable(path, 'workstations')
+        self.app_offsets, self.app_workstations = load('app_offsets'), load('app_workstations')
+        self.workstation_offsets, self.workstation_apps = load('workstation_offsets'), load('workstation_apps')
+        self.dashboard_columns = {column: StringTable(path, 'dashboard_' + column.lower())
+                                  for column in ['Publisher', 'Application', 'Version']}
+        self.dashboard_counts = load('dashboard_counts')
+        self.dashboard_rows, self.dashboard_offsets = load('dashboard_rows'), load('dashboard_offsets')
+        self.bundle_columns = {column: StringTable(path, 'bundle_' + column.lower())
+                               for column in ['Publisher', 'Application', 'Version']}
+        self.bundle_numbers, self.bundle_offsets = load('bundle_numbers'), load('bundle_offsets')
+        self.bundle_rows, self.bundle_app_offsets = load('bundle_rows'), load('bundle_app_offsets')
+
+    # True when a newer generation has been written since this one was opened
+    def is_stale(self):
+        return read_current(self.directory) != self.generation
+
+    # Names of the workstations an application is installed on (empty if the application is unknown)
+    def workstations(self, application):
+        code = self.application_names.find(application)
+        if code < 0:
+            return []
+        ids = self.app_workstations[self.app_offsets[code]:self.app_offsets[code + 1]]
+        return [self.workstation_names[i] for i in ids]
+
+    # Names of the applications installed on a workstation
+    def applications(self, workstation):
+        code = self.workstation_names.find(workstation)
+        if code < 0:
+            return []
+        ids = self.workstation_apps[self.workstation_offsets[code]:self.workstation_offsets[code + 1]]
+        return [self.application_names[i] for i in ids]
+
+    # The application's rows of the dashboard with versions (one per publisher and version)
+    def dashboard(self, application):
+        code = self.application_names.find(application)
+        if code < 0:
+            return []
+        rows = self.dashboard_rows[self.dashboard_offsets[code]:self.dashboard_offsets[code + 1]]
+        return [self.dashboard_row(row) for row in rows]
+
+    def dashboard_row(self, row):
+        entry = {column: table[row] for column, table in self.dashboard_columns.items()}
+        entry.update(zip(COUNT_COLUMNS, (int(count) for count in self.dashboard_counts[row])))
+        return entry
+
+    # The bundles an application is part of, each as {'bundle': number, 'members': [...]}
+    def bundles(self, application):
+        code = self.application_names.find(application)
+        if code < 0:
+            return []
+        rows = self.bundle_rows[self.bundle_app_offsets[code]:self.bundle_app_offsets[code + 1]]
+        return [self.bundle(int(self.bundle_numbers[row])) for row in sorted(set(int(row) for row in rows))]
+
+    def bundle(self, number):
+        start, stop = self.bundle_offsets[number], self.bundle_offsets[number + 1]
+        members = [{column: table[row] for column, table in self.bundle_columns.items()} for row in range(start, stop)]
+        return {'bundle': number, 'members': members}
+
+    # Applications whose name contains the text (ignoring case), at most `limit` of them
+    def search(self, text, limit=50):
+        text = str(text).lower()
+        return [name for name in self.application_names.all() if text in name.lower()][:limit]
+
+    def status(self):
+        return dict(self.meta, directory=self.directory)
+
+
+# Hands out the current QueryIndex, reopening it when a pipeline run has written a new generation.
+# The CURRENT file is checked at most every `interval` seconds, so lookups don't pay for it.
+class IndexWatcher:
+    def __init__(self, directory=DEFAULT_INDEX_DIR, interval=1.0):
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.index = QueryIndex(directory)
+        self.checked = time.monotonic()
+
+    def current(self):
+        with self.lock:
+            if time.monotonic() - self.checked >= self.interval:
+                self.checked = time.monotonic()
+                if self.index.is_stale():
+                    self.index = QueryIndex(self.directory)
+                    print('Reloaded query index ' + self.index.generation)
+            return self.index
+
+
+### HTTP server
+
+# GET-only JSON endpoints:
+#   /applications/<name>/workstations   /applications/<name>/bundles   /applications/<name>  (dashboard rows)
+#   /workstations/<name>/applications   /search?q=<text>   /status
+def make_handler(watcher):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            start = time.perf_counter()
+            url = urlparse(self.path)
+            parts = [unquote(part) for part in url.path.strip('/').split('/')]
+            index = watcher.current()
+            if parts == ['status']:
+                result = index.status()
+            elif parts == ['search']:
+                result = index.search(parse_qs(url.query).get('q', [''])[0])
+            elif len(parts) == 3 and parts[0] == 'applications' and parts[2] == 'workstations':
+                result = index.workstations(parts[1])
+            elif len(parts) == 3 and parts[0] == 'applications' and parts[2] == 'bundles':
+                result = index.bundles(parts[1])
+            elif len(parts) == 2 and parts[0] == 'applications':
+                result = index.dashboard(parts[1])
+            elif len(parts) == 3 and parts[0] == 'workstations' and parts[2] == 'applications':
+                result = index.applications(parts[1])
+            else:
+                self.send_error(404, 'Unknown query')
+                return
+            body = json.dumps({'result': result, 'generation': index.generation,
+                               'milliseconds': round((time.perf_counter() - start) * 1000, 3)}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return QueryHandler
+
+
+# Serves the index on localhost only; the data never leaves the machine
+def serve(directory=DEFAULT_INDEX_DIR, port=DEFAULT_PORT, host='127.0.0.1'):
+    watcher = IndexWatcher(directory)
+    server = ThreadingHTTPServer((host, port), make_handler(watcher))
+    print('Serving query index ' + watcher.index.generation + ' on http://' + host + ':' + str(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Answers workstation, application and bundle lookups from the query index written by the pipeline.')
+    parser.add_argument('--dir', default=DEFAULT_INDEX_DIR, help='query index folder (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='run the local HTTP server')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    for command, argument in [('workstations', 'application'), ('applications', 'workstation'),
+                              ('bundles', 'application'), ('dashboard', 'application'), ('search', 'text')]:
+        commands.add_parser(command).add_argument('name', metavar=argument)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.dir, args.port)
+    else:
+        print(json.dumps(getattr(QueryIndex(args.dir), args.command)(args.name), indent=2))
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+# Columns whose values repeat across millions of install records. They are stored as pandas categoricals:
+# one integer code per row plus a lookup table of the distinct values, so comparisons, duplicated() and
+# groupbys work on the codes and the strings are only materialized when a report is written.
+CODED_COLUMNS = ['Publisher', 'Application', 'Version', 'System Name', 'Encrypted Workstation Name',
+                 'C054', 'OS', 'OS Version', 'Install Date', 'Last HW Scan']
+
+
+# True for dictionary-encoded (categorical) columns
+def is_coded(series):
+    return isinstance(series.dtype, pd.CategoricalDtype)
+
+
+# Keeps a categorical's lookup table in sorted order, so that sorted groupbys on the codes return the groups
+# in the same order as on the original strings. Columns whose values can't be compared are left as they are.
+def sort_categories(series):
+    try:
+        categories = sorted(series.cat.categories)
+    except TypeError:
+        return series
+    return series.cat.reorder_categories(categories)
+
+
+# Dictionary-encodes the coded columns present in df (in place of their string values)
+def encode_records(df, columns=CODED_COLUMNS):
+    df = df.copy()
+    for column in columns:
+        if column in df.columns and not is_coded(df[column]):
+            df[column] = sort_categories(df[column].astype('category'))
+    return df
+
+
+# Concatenates encoded frames, first merging the lookup tables of each coded column so the result stays encoded
+# (a plain pd.concat falls back to strings as soon as two frames have different categories)
+def combine_records(frames):
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+    shared = {}
+    for column in frames[0].columns:
+        if all(column in frame.columns and is_coded(frame[column]) for frame in frames):
+            categories = frames[0][column].cat.categories
+            for frame in frames[1:]:
+                categories = categories.union(frame[column].cat.categories)
+            shared[column] = categories
+    frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)
+                              for column, categories in shared.items()}) for frame in frames]
+    return pd.concat(frames)
+
+
+# fillna for coded or plain columns: the fill value is added to the lookup table first if it is missing
+def fill_missing(series, value):
+    if is_coded(series) and value not in series.cat.categories:
+        series = sort_categories(series.cat.add_categories([value]))
+    return series.fillna(value)
+
+
+# Drops lookup-table entries no row uses any more (e.g. after servers and GOTS applications are removed)
+def compact_records(df):
+    df = df.copy()
+    for column in df.columns:
+        if is_coded(df[column]):
+            df[column] = df[column].cat.remove_unused_categories()
+    return df
+
+
+# Turns coded columns back into plain values, e.g. before handing a frame to code that expects strings
+def decode_records(df):
+    df = df.copy()
+    for column in df.columns:
+        if is_coded(df[column]):
+            df[column] = df[column].astype(df[column].cat.categories.dtype)
+    return df
+
+
+# Integer codes of a column (-1 for missing values) and the distinct values they stand for
+def column_codes(series):
+    if is_coded(series):
+        return series.cat.codes.values, np.asarray(series.cat.categories, dtype=object)
+    codes, uniques = pd.factorize(series)
+    return codes, np.asarray(uniques, dtype=object)
+
+
+# Values at the given codes, None where the code is -1
+def value_at(values, codes):
+    result = np.full(len(codes), None, dtype=object)
+    result[codes >= 0] = values[codes[codes >= 0]]
+    return result
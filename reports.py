@@ -0,0 +1,132 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest import CACHE_FORMAT
+
+# xlsxwriter streams each row to a temporary file as it is written (constant_memory); without it the summary
+# workbook is written with openpyxl's write-only mode, which also keeps memory flat but is slower
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# Formats of the full-detail outputs: Parquet (needs pyarrow, like the ingest cache), gzip-compressed CSV or plain CSV
+DETAIL_FORMATS = ('parquet', 'csv.gz', 'csv')
+
+# Rows per worksheet allowed by Excel; longer tables continue on sheets named "<name> (2)", "<name> (3)", ...
+EXCEL_MAX_ROWS = 1048576
+
+
+# Today's month and day as used in the report file names (e.g. "07_06")
+def date_stamp():
+    return time.strftime('%m_%d')
+
+
+# Writes the report files of a run on background threads, so a stage can hand its tables over and return while
+# the next stages compute. Every file is written under a temporary name and renamed once complete, so a file that
+# exists is never half written. wait() blocks until everything is written and re-raises the first failed write;
+# the scripts call it before they exit. The tables handed over must not be modified afterwards.
+class ReportWriter:
+    def __init__(self, date=None, detail_format='parquet', threads=2):
+        if detail_format not in DETAIL_FORMATS:
+            raise ValueError('detail_format must be one of ' + ', '.join(DETAIL_FORMATS) + ', not ' + repr(detail_format))
+        if detail_format == 'parquet' and CACHE_FORMAT != 'parquet':
+            print('pyarrow is not installed, full-detail outputs are written as csv.gz instead of parquet')
+            detail_format = 'csv.gz'
+        self.date = date or date_stamp()
+        self.detail_format = detail_format
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='reports')
+        self.pending = []
+
+    # File name with the run's date stamp, e.g. dated('summary', '.xlsx') -> "summary_07_06.xlsx"
+    def dated(self, name, extension):
+        return name + '_' + self.date + extension
+
+    # File name of a full-detail output in the configured format
+    def detail_path(self, name):
+        return name + '.' + self.detail_format
+
+    def submit(self, function, *args, **kwargs):
+        future = self.pool.submit(function, *args, **kwargs)
+        self.pending.append(future)
+        return future
+
+    def write_csv(self, df, path, **kwargs):
+        return self.submit(write_csv_file, df, path, **kwargs)
+
+    # Writes a full-detail table (e.g. every row of the inventory) and returns its file name
+    def write_detail(self, df, name):
+        path = self.detail_path(name)
+        if self.detail_format == 'parquet':
+            self.submit(write_parquet_file, df, path)
+        else:
+            self.submit(write_csv_file, df, path)
+        return path
+
+    # Writes one workbook with a sheet per table; sheets is a list of (sheet name, DataFrame)
+    def write_workbook(self, sheets, path):
+        return self.submit(write_workbook_file, sheets, path)
+
+    def wait(self):
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+
+# Temporary name next to the final file; the extension is kept so pandas still infers the compression from it
+def temporary_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, '.tmp_' + filename)
+
+
+def write_csv_file(df, path, **kwargs):
+    start = time.perf_counter()
+    df.to_csv(temporary_path(path), **kwargs)
+    os.replace(temporary_path(path), path)
+    print('%s written (%.2fs)\n' % (path, time.perf_counter() - start), end='')
+
+
+def write_parquet_file(df, path):
+    start = time.perf_counter()
+    df.to_parquet(temporary_path(path))
+    os.replace(temporary_path(path), path)
+    print('%s written (%.2fs)\n' % (path, time.perf_counter() - start), end='')
+
+
+# Excel can't store NaN; missing values are left blank like to_excel does
+def excel_rows(df):
+    for row in df.itertuples(index=False, name=None):
+        yield [None if value is None or value != value else value for value in row]
+
+
+# Streams the tables into one workbook, row by row, so memory stays flat however many rows there are
+def write_workbook_file(sheets, path):
+    start = time.perf_counter()
+    tables = []
+    rows_per_sheet = EXCEL_MAX_ROWS - 1
+    for name, df in sheets:
+        for part, first in enumerate(range(0, max(len(df), 1), rows_per_sheet)):
+            # Excel sheet names are limited to 31 characters; continuation sheets keep their number visible
+            suffix = ' (%d)' % (part + 1) if part else ''
+            tables.append((name[:31 - len(suffix)] + suffix, df.iloc[first:first + rows_per_sheet]))
+
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(temporary_path(path), {'constant_memory': True})
+        for name, df in tables:
+            worksheet = workbook.add_worksheet(name)
+            worksheet.write_row(0, 0, [str(column) for column in df.columns])
+            for number, row in enumerate(excel_rows(df), 1):
+                worksheet.write_row(number, 0, row)
+        workbook.close()
+    else:
+        import openpyxl
+        workbook = openpyxl.Workbook(write_only=True)
+        for name, df in tables:
+            worksheet = workbook.create_sheet(name)
+            worksheet.append([str(column) for column in df.columns])
+            for row in excel_rows(df):
+                worksheet.append(row)
+        workbook.save(temporary_path(path))
+    os.replace(temporary_path(path), path)
+    print('%s written (%.2fs)\n' % (path, time.perf_counter() - start), end='')
@@ -0,0 +1,162 @@
+import hashlib
+import inspect
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import normalization
+import name_similarity
+from dedup import GOLDEN_GAMMA, mix
+
+DEFAULT_SCORE_CACHE_DIR = '.bundle_scores'
+CACHE_NAME = 'scores.pkl'
+# Bumped whenever the layout of the saved cache changes, so an older cache is started over instead of misread
+CACHE_VERSION = 1
+# Most pairs kept between runs; the pairs least recently used are dropped first
+MAX_PAIRS = 1000000
+# Percentage of shared workstations (Jaccard similarity) two applications need to be bundled
+WORKSTATION_THRESHOLD = 70
+
+
+# Fingerprint of the rules the cached name checks come from: how names are cleaned into tokens (clean_name and the
+# NameTable's version of it, with their word lists) and how the tokens are compared, so that scores made with other
+# rules are never reused
+def name_rules_fingerprint():
+    parts = [repr(name_similarity.common_words), repr(normalization.NUMBER)]
+    for function in (name_similarity.clean_name, name_similarity.is_number, normalization.clean_unique_names,
+                     name_similarity.NameSimilarity.shares_word, name_similarity.NameSimilarity.partial_ratio,
+                     name_similarity.NameSimilarity.build_ngram_vectors, name_similarity.trigrams):
+        parts.append(inspect.getsource(function))
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+# Order-independent 64-bit fingerprint of the workstation set of every application of a WorkstationIndex.
+# Workstations are hashed by name rather than by their ID in the index, which changes from run to run, so an
+# application keeps its fingerprint as long as it is installed on exactly the same workstations.
+def workstation_fingerprints(workstation_index):
+    names = np.asarray(workstation_index.workstation_names, dtype=object)
+    hashes = mix(pd.util.hash_array(names)) if len(names) else np.zeros(0, dtype=np.uint64)
+    totals = np.concatenate([[np.uint64(0)], np.cumsum(hashes[workstation_index.workstation_ids], dtype=np.uint64)])
+    offsets = np.asarray(workstation_index.offsets, dtype=np.int64)
+    with np.errstate(over='ignore'):
+        sums = totals[offsets[1:]] - totals[offsets[:-1]]
+        return mix(sums + np.asarray(workstation_index.sizes, dtype=np.uint64) * GOLDEN_GAMMA)
+
+
+# On-disk cache of the bundling scores of pairs of dashboard rows, so a rerun only scores the pairs that changed.
+# A pair is keyed by the (Application, Publisher, Version) of its two rows, and holds whether their cleaned names
+# share a word, their name score and the Jaccard similarity (0 to 1) of their applications' workstation sets,
+# with the fingerprints of those sets (see workstation_fingerprints). The raw scores are kept rather than whether
+# the pair passed, so the thresholds can change without rescoring. Names never change for a key, so when a
+# fingerprint differs only the Jaccard similarity is computed again; it is not computed at all (None) for pairs
+# whose names don't match, since those can't be bundled whatever their workstations.
+# The cache holds at most max_pairs pairs, dropping the least recently used ones when it is saved, and is started
+# over when the name scoring method or the name cleaning rules (see name_rules_fingerprint) change.
+class PairScoreCache:
+    def __init__(self, directory=DEFAULT_SCORE_CACHE_DIR, max_pairs=MAX_PAIRS, method='partial_ratio'):
+        self.directory = directory
+        self.max_pairs = max_pairs
+        self.method = method
+        self.rules = name_rules_fingerprint()
+        self.entries = OrderedDict()
+        self.reused = self.rescored = self.added = 0
+        self.name_threshold, self.workstation_threshold = name_similarity.THRESHOLDS[method], WORKSTATION_THRESHOLD
+        path = os.path.join(directory, CACHE_NAME)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved.get('version') == CACHE_VERSION and saved.get('method') == method and saved.get('rules') == self.rules:
+                self.entries = saved['entries']
+
+    # Attaches the cache to the rows of a (sorted) dashboard, the WorkstationIndex the Jaccard similarities are
+    # computed from and the NameSimilarity the name checks are made with; pairs are then looked up by row number.
+    # The thresholds are the ones check() applies (None uses the NameSimilarity's threshold for names).
+    def bind(self, dashboard, workstation_index, name_similarity, name_threshold=None, workstation_threshold=WORKSTATION_THRESHOLD):
+        self.workstation_index = workstation_index
+        self.name_similarity = name_similarity
+        self.name_threshold = name_similarity.threshold if name_threshold is None else name_threshold
+        self.workstation_threshold = workstation_threshold
+        self.names = dashboard['Application'].astype(object).to_numpy()
+        self.identities = list(zip(self.names.astype(str), dashboard['Publisher'].astype(str), dashboard['Version'].astype(str)))
+        fingerprints = workstation_fingerprints(workstation_index)
+        self.fingerprints = [int(fingerprints[code]) if code is not None else 0
+                             for code in (workstation_index.lookup.get(name) for name in self.names)]
+
+    # Cache key of a pair of rows and the fingerprints of its two rows, both in the order of the key
+    def key(self, index, other):
+        if self.identities[index] <= self.identities[other]:
+            return (self.identities[index], self.identities[other]), (self.fingerprints[index], self.fingerprints[other])
+        return (self.identities[other], self.identities[index]), (self.fingerprints[other], self.fingerprints[index])
+
+    # The cached (shares word, name score, Jaccard) of a pair of rows and whether they are current, or None if the
+    # pair was never scored. They are not current when the names match but the Jaccard similarity is missing (the
+    # name threshold was higher when they were scored) or a workstation set changed since.
+    def lookup(self, index, other):
+        key, fingerprints = self.key(index, other)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        shares_word, score, jaccard, saved_fingerprints = entry
+        if not (shares_word and passes_names(score, self.name_threshold)):
+            return shares_word, score, jaccard, True
+        return shares_word, score, jaccard, jaccard is not None and saved_fingerprints == fingerprints
+
+    # Stores the scores of a pair of rows (jaccard is None if the names were not a match)
+    def put(self, index, other, shares_word, score, jaccard):
+        key, fingerprints = self.key(index, other)
+        if key not in self.entries:
+            self.added += 1
+        self.entries[key] = (bool(shares_word), int(score), None if jaccard is None else float(jaccard), fingerprints)
+        self.entries.move_to_end(key)
+
+    # Scores of a pair of rows from the cache, computing (and caching) whatever is missing or out of date.
+    # Matches checkIfBundle, except for the version check, which the caller makes first.
+    def scores(self, index, other):
+        name, other_name = self.names[index], self.names[other]
+        cached = self.lookup(index, other)
+        if cached is None:
+            shares_word = self.name_similarity.shares_word(name, other_name)
+            score = self.name_similarity.score(name, other_name)
+            jaccard = None
+            if shares_word and passes_names(score, self.name_threshold):
+                jaccard = self.workstation_index.jaccard(name, other_name)
+        else:
+            shares_word, score, jaccard, current = cached
+            if current:
+                self.reused += 1
+            else:
+                jaccard = self.workstation_index.jaccard(name, other_name)
+                self.rescored += 1
+        self.put(index, other, shares_word, score, jaccard)
+        return shares_word, score, jaccard
+
+    # Checks a pair of rows with the same version like checkIfBundle
+    def check(self, index, other):
+        return passes(*self.scores(index, other), self.name_threshold, self.workstation_threshold)
+
+    # Drops the least recently used pairs beyond max_pairs and writes the cache to a temporary file first,
+    # so an interrupted run never leaves it half-written
+    def save(self):
+        while len(self.entries) > self.max_pairs:
+            self.entries.popitem(last=False)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, CACHE_NAME)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'version': CACHE_VERSION, 'method': self.method, 'rules': self.rules, 'entries': self.entries}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        print('Bundle score cache: ' + str(self.reused) + ' checks from cached scores, ' + str(self.rescored) + ' rescored, '
+              + str(self.added) + ' new, ' + str(len(self.entries)) + ' kept')
+
+
+# The checks of checkIfBundle on a pair's scores: names share a word and are roughly similar (name_threshold, 50 for
+# partial_ratio) and at least workstation_threshold % of the workstations are shared
+def passes_names(score, threshold=50):
+    return score >= threshold
+
+
+def passes(shares_word, score, jaccard, name_threshold=50, workstation_threshold=WORKSTATION_THRESHOLD):
+    return bool(shares_word) and passes_names(score, name_threshold) and jaccard is not None and jaccard * 100 >= workstation_threshold
@@ -0,0 +1,264 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from dashboards import version_labels
+from dedup import composite_keys
+from query_service import StringTable, bundle_members, save_strings
+from records import column_codes
+from versions import parser as version_parser
+
+DEFAULT_SNAPSHOT_DIR = 'snapshots'
+# Bumped whenever the layout of a snapshot changes, so a diff never misreads a snapshot from another version
+SNAPSHOT_VERSION = 1
+# Number of snapshots kept; older ones are removed when a new one is written (None keeps them all)
+KEEP_SNAPSHOTS = 12
+
+CHANGES = ['installed', 'removed', 'upgraded', 'downgraded', 'version changed']
+
+
+### Writing a snapshot at the end of a pipeline run
+
+# Codes of a column into its distinct string values in sorted order, so the codes of two snapshots can be
+# matched by merging their (sorted) string tables
+def sorted_codes(series):
+    codes, values = column_codes(series)
+    strings, positions = np.unique(np.array([str(value) for value in values], dtype=object), return_inverse=True)
+    positions = np.append(positions.astype(np.int32), -1)
+    return positions[np.where(codes >= 0, codes, len(values))], strings
+
+
+# Writes the distinct (application, workstation, version) installs of the inventory and the bundles of a run into
+# a new folder of `directory` named after the time, and returns its path. Each column is stored as a sorted string
+# table and the installs as three int32 arrays of codes, sorted by application, workstation and version, so a
+# snapshot of a few million installs takes a few tens of MB and loads in a fraction of a second.
+# Rows without an application or workstation are left out; a missing version is stored as ''.
+def write_snapshot(directory, data, workstation_column, bundles=None, keep=KEEP_SNAPSHOTS):
+    name = time.strftime('%Y%m%d-%H%M%S') + '-%06d' % (time.time() % 1 * 1000000)
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+
+    application, applications = sorted_codes(data['Application'])
+    workstation, workstations = sorted_codes(data[workstation_column])
+    version_categories, _ = version_labels(data['Version'])
+    version = np.asarray(version_categories.codes, dtype=np.int32)
+    versions = np.asarray(version_categories.categories, dtype=object)
+
+    kept = (application >= 0) & (workstation >= 0)
+    application, workstation, version = application[kept], workstation[kept], version[kept]
+    keys, packed = composite_keys([(application, len(applications)), (workstation, len(workstations)), (version, len(versions))])
+    first = np.unique(keys, return_index=True)[1]
+    if not packed:
+        # Hashed keys don't sort like the codes, so the distinct installs are put in order separately
+        first = first[np.lexsort((version[first], workstation[first], application[first]))]
+
+    for table, values in [('applications', applications), ('workstations', workstations), ('versions', versions)]:
+        save_strings(path, table, values)
+    for array, values in [('application', application), ('workstation', workstation), ('version', version)]:
+        np.save(os.path.join(path, array + '.npy'), values[first])
+
+    members = bundle_members(bundles)
+    for column in ['Publisher', 'Application']:
+        save_strings(path, 'bundle_' + column.lower(), members[column].astype(object).values)
+    np.save(os.path.join(path, 'bundle_numbers.npy'), members['bundle'].to_numpy(dtype=np.int64))
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'version': SNAPSHOT_VERSION, 'name': name, 'written': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'workstation_column': workstation_column, 'installs': len(first), 'applications': len(applications),
+                   'workstations': len(workstations), 'bundles': int(members['bundle'].nunique())}, f, indent=2)
+
+    if keep:
+        for old in list_snapshots(directory)[:-keep]:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    print('Snapshot written to ' + path)
+    return path
+
+
+# Names of the complete snapshots in a folder, oldest first
+def list_snapshots(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if os.path.exists(os.path.join(directory, name, 'meta.json')))
+
+
+### Reading snapshots back
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('The snapshot in ' + path + ' was written by another version')
+        self.strings = {table: np.array(StringTable(path, table).all(), dtype=object)
+                        for table in ['applications', 'workstations', 'versions']}
+        self.codes = {array: np.load(os.path.join(path, array + '.npy')) for array in ['application', 'workstation', 'version']}
+
+    # Bundles as sets of their (Publisher, Application) members
+    def bundles(self):
+        publishers = StringTable(self.path, 'bundle_publisher').all()
+        applications = StringTable(self.path, 'bundle_application').all()
+        numbers = np.load(os.path.join(self.path, 'bundle_numbers.npy'))
+        bundles = {}
+        for number, publisher, application in zip(numbers, publishers, applications):
+            bundles.setdefault(int(number), set()).add((publisher, application))
+        return {frozenset(members) for members in bundles.values()}
+
+
+### Comparing two snapshots
+
+# Positions of both snapshots' sorted strings in the sorted union of the two, as code maps
+def merge_strings(old, new):
+    union = np.unique(np.concatenate([old, new]))
+    return union, np.searchsorted(union, old), np.searchsorted(union, new)
+
+
+# Rank of each version by its numbers (see versions.py), so versions that only differ in spelling get the same
+# rank; versions without digits rank below every parsed one
+def version_ranks(versions):
+    components = version_parser.parse_unique(versions)
+    order = np.lexsort(components.T[::-1])
+    ordered = components[order]
+    new_rank = np.r_[True, (ordered[1:] != ordered[:-1]).any(axis=1)] if len(order) else np.zeros(0, dtype=bool)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.cumsum(new_rank) - 1
+    return ranks
+
+
+# The installs of a snapshot in union codes (maps: the code map of each column), as sorted (application,
+# workstation) pair keys with the highest version of each pair
+def pair_versions(snapshot, maps, version_rank, sizes):
+    application = maps['applications'][snapshot.codes['application']]
+    workstation = maps['workstations'][snapshot.codes['workstation']]
+    version = maps['versions'][snapshot.codes['version']]
+    keys = composite_keys([(application, sizes['applications']), (workstation, sizes['workstations'])])[0]
+    # The highest version of each pair is the last one after sorting by pair and version rank
+    order = np.lexsort((version_rank[version], keys))
+    keys = keys[order]
+    last = np.r_[keys[1:] != keys[:-1], True] if len(keys) else np.zeros(0, dtype=bool)
+    rows = order[last]
+    return keys[last], application[rows], workstation[rows], version[rows]
+
+
+# What changed between two snapshots: one row per (application, workstation) that was installed, removed or
+# changed version (upgraded, downgraded, or another spelling of the same version numbers), with the old and new
+# version; one row per changed application with the counts of each change and its workstations before and after;
+# and the bundles that appeared or dissolved. Bundles are compared as sets of (publisher, application), so a
+# bundle whose members were all upgraded is still the same bundle.
+# Installs are compared as sorted 64-bit keys of their integer codes in the merged string tables, with a
+# searchsorted merge instead of joins on strings, so it takes seconds on multi-million-install snapshots.
+# When an application has several versions on one workstation, its highest version is compared.
+def diff_snapshots(old, new):
+    strings, old_maps, new_maps = {}, {}, {}
+    for table in ['applications', 'workstations', 'versions']:
+        strings[table], old_maps[table], new_maps[table] = merge_strings(old.strings[table], new.strings[table])
+    sizes = {table: len(values) for table, values in strings.items()}
+    version_rank = version_ranks(strings['versions'])
+
+    old_keys, old_app, old_ws, old_version = pair_versions(old, old_maps, version_rank, sizes)
+    new_keys, new_app, new_ws, new_version = pair_versions(new, new_maps, version_rank, sizes)
+
+    # Sorted-key merge: where each new pair would go among the old ones, and whether it is there
+    positions = np.minimum(np.searchsorted(old_keys, new_keys), max(len(old_keys) - 1, 0))
+    kept = old_keys[positions] == new_keys if len(old_keys) else np.zeros(len(new_keys), dtype=bool)
+    removed = np.ones(len(old_keys), dtype=bool)
+    removed[positions[kept]] = False
+
+    before, after = old_version[positions[kept]], new_version[kept]
+    changed = before != after
+    step = version_rank[after[changed]] - version_rank[before[changed]]
+    installed = ~kept
+
+    application = np.concatenate([new_app[installed], old_app[removed], new_app[kept][changed]])
+    workstation = np.concatenate([new_ws[installed], old_ws[removed], new_ws[kept][changed]])
+    old_version_codes = np.concatenate([np.full(installed.sum(), -1), old_version[removed], before[changed]])
+    new_version_codes = np.concatenate([new_version[installed], np.full(removed.sum(), -1), after[changed]])
+    kinds = np.concatenate([np.full(installed.sum(), 'installed', dtype=object), np.full(removed.sum(), 'removed', dtype=object),
+                            np.where(step > 0, 'upgraded', np.where(step < 0, 'downgraded', 'version changed')).astype(object)])
+
+    versions = np.append(strings['versions'], None)
+    changes = pd.DataFrame({'Application': strings['applications'][application],
+                            'Workstation': strings['workstations'][workstation],
+                            'Change': pd.Categorical(kinds, categories=CHANGES),
+                            'Old Version': versions[old_version_codes], 'New Version': versions[new_version_codes]})
+    changes = changes.sort_values(by=['Application', 'Change', 'Workstation'], kind='stable').reset_index(drop=True)
+
+    # Per application, from the same codes
+    summary = pd.DataFrame({'Application': strings['applications'],
+                            'Workstations before': np.bincount(old_app, minlength=sizes['applications']),
+                            'Workstations after': np.bincount(new_app, minlength=sizes['applications'])})
+    summary['Change in workstations'] = summary['Workstations after'] - summary['Workstations before']
+    for kind in CHANGES:
+        summary['# ' + kind] = np.bincount(application[kinds == kind], minlength=sizes['applications'])
+    summary = summary[np.bincount(application, minlength=sizes['applications']) > 0]
+    summary = summary.assign(size=summary['Change in workstations'].abs()).sort_values(
+        by=['size', 'Application'], ascending=[False, True]).drop(columns='size').reset_index(drop=True)
+
+    old_bundles, new_bundles = old.bundles(), new.bundles()
+    bundle_rows = []
+    for change, bundles in [('appeared', new_bundles - old_bundles), ('dissolved', old_bundles - new_bundles)]:
+        for members in bundles:
+            names = sorted(application + ' (' + publisher + ')' for publisher, application in members)
+            bundle_rows.append((change, len(members), ', '.join(names)))
+    bundle_changes = pd.DataFrame(bundle_rows, columns=['Change', 'Size', 'Members'])
+    bundle_changes = bundle_changes.sort_values(by=['Change', 'Size', 'Members'], ascending=[True, False, True]).reset_index(drop=True)
+    return changes, summary, bundle_changes
+
+
+# Counts of each kind of change, for the first sheet of the change report
+def change_overview(old, new, changes, bundle_changes):
+    rows = [('Old snapshot', old.meta['name']), ('New snapshot', new.meta['name']),
+            ('Installs before', old.meta['installs']), ('Installs after', new.meta['installs'])]
+    counts = changes['Change'].value_counts()
+    rows += [('Workstation/application pairs ' + kind, int(counts.get(kind, 0))) for kind in CHANGES]
+    counts = bundle_changes['Change'].value_counts()
+    rows += [('Bundles ' + kind, int(counts.get(kind, 0))) for kind in ['appeared', 'dissolved']]
+    return pd.DataFrame(rows, columns=['Item', 'Value'])
+
+
+# Diffs two snapshots and writes the change report through a ReportWriter: the workbook of the overview, the
+# per-application counts and the bundle changes, and every changed install as a full-detail output.
+# Returns the three tables.
+def report_changes(old, new, writer):
+    start = time.perf_counter()
+    changes, summary, bundle_changes = diff_snapshots(old, new)
+    print('Compared snapshots %s and %s in %.2fs: %d changed installs in %d applications, %d bundle changes' %
+          (old.meta['name'], new.meta['name'], time.perf_counter() - start, len(changes), len(summary), len(bundle_changes)))
+    writer.write_workbook([('Overview', change_overview(old, new, changes, bundle_changes)), ('Applications', summary),
+                           ('Bundles', bundle_changes)], writer.dated('changes', '.xlsx'))
+    writer.write_detail(changes, 'install_changes')
+    return changes, summary, bundle_changes
+
+
+if __name__ == '__main__':
+    from reports import ReportWriter
+
+    parser = argparse.ArgumentParser(description='Lists the saved inventory snapshots or reports what changed between two of them.')
+    parser.add_argument('--dir', default=DEFAULT_SNAPSHOT_DIR, help='snapshot folder (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='list the snapshots, oldest first')
+    diff_parser = commands.add_parser('diff', help='write the change report between two snapshots (default: the last two)')
+    diff_parser.add_argument('old', nargs='?')
+    diff_parser.add_argument('new', nargs='?')
+    args = parser.parse_args()
+
+    names = list_snapshots(args.dir)
+    if args.command == 'list':
+        for name in names:
+            with open(os.path.join(args.dir, name, 'meta.json')) as f:
+                meta = json.load(f)
+            print('%s  %d installs, %d applications, %d workstations, %d bundles' %
+                  (name, meta['installs'], meta['applications'], meta['workstations'], meta['bundles']))
+    else:
+        old_name = args.old or (names[-2] if len(names) >= 2 else None)
+        new_name = args.new or (names[-1] if names else None)
+        if old_name is None or new_name is None:
+            parser.error('need two snapshots in ' + args.dir)
+        report_writer = ReportWriter()
+        report_changes(Snapshot(os.path.join(args.dir, old_name)), Snapshot(os.path.join(args.dir, new_name)), report_writer)
+        report_writer.wait()
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+from dashboards import add_counts, count_groups, dashboards_from_counts
+from ingest import DEFAULT_CACHE_DIR, iter_inventory_chunks
+from workstation_index import WorkstationIndex
+
+
+# Set of 64-bit row keys kept as a few sorted arrays, which are merged once there are too many of them.
+# Membership checks are binary searches, so remembering every key seen so far costs 8 bytes per distinct key.
+class KeySet:
+    def __init__(self, max_runs=8):
+        self.runs = []
+        self.max_runs = max_runs
+
+    def contains(self, keys):
+        found = np.zeros(len(keys), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, keys), len(run) - 1)
+            found |= run[positions] == keys
+        return found
+
+    def add(self, keys):
+        keys = np.unique(keys)
+        if len(keys):
+            self.runs.append(keys)
+        if len(self.runs) > self.max_runs:
+            self.runs = [np.unique(np.concatenate(self.runs))]
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+
+# Hashes the given columns of every row into one 64-bit key. Dates are brought to one resolution first so a
+# scan date hashes the same whether it came from the Parquet cache or straight from a workbook.
+def row_keys(chunk, columns):
+    parts = {}
+    for column in columns:
+        values = chunk[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.astype('datetime64[ns]')
+        parts[column] = values
+    return pd.util.hash_pandas_object(pd.DataFrame(parts), index=False).values
+
+
+# Marks the keys that were seen earlier in this chunk or in any previous chunk, then remembers the new ones
+def flag_repeats(keys, seen):
+    repeats = pd.Series(keys).duplicated().values | seen.contains(keys)
+    seen.add(keys[~repeats])
+    return repeats
+
+
+# Folds the inventory into the dashboard counts chunk by chunk, for inventories too large to load at once.
+# Servers (and optionally GOTS applications) are removed from each chunk as it is read, duplicates are found by
+# remembering a 64-bit key per distinct (application[, version], workstation, scan date), and only the running
+# per-(Publisher, Application, Version) counts and the distinct application/workstation pairs are kept.
+# Peak memory is one chunk plus those aggregates, so it is capped by chunk_size.
+class StreamingAggregator:
+    def __init__(self, workstation_column, remove_servers=True, remove_gots=False, track_workstations=True):
+        self.workstation_column = workstation_column
+        self.options = {'remove_servers': remove_servers, 'remove_gots': remove_gots, 'track_workstations': track_workstations}
+        self.remove_servers = remove_servers
+        self.remove_gots = remove_gots
+        self.track_workstations = track_workstations
+        self.seen = KeySet()
+        self.v_seen = KeySet()
+        self.counts = []
+        self.installs = []
+        self.rows_read = 0
+        self.rows_kept = 0
+
+    # Columns each chunk needs (column projection for the readers)
+    def columns(self):
+        return ['Publisher', 'Application', 'Version', self.workstation_column, 'Last HW Scan', 'C054']
+
+    def filter(self, chunk):
+        if self.remove_servers:
+            chunk = chunk[~chunk['C054'].fillna('').astype(str).str.lower().str.contains('server')]
+        if self.remove_gots:
+            # Like the scripts' filter, rows without a publisher are dropped along with the GOTS ones
+            chunk = chunk[chunk['Publisher'].str.lower().str.contains('usda') == False]
+        return chunk
+
+    def add(self, chunk):
+        self.rows_read += len(chunk)
+        chunk = self.filter(chunk)
+        self.rows_kept += len(chunk)
+        if len(chunk) == 0:
+            return
+
+        ws = self.workstation_column
+        version = chunk['Version'].astype(str)
+        duplicate = flag_repeats(row_keys(chunk, ['Application', ws, 'Last HW Scan']), self.seen)
+        v_duplicate = flag_repeats(row_keys(chunk.assign(Version=version), ['Application', 'Version', ws, 'Last HW Scan']), self.v_seen)
+        self.counts.append(count_groups(chunk, duplicate, v_duplicate))
+        if self.track_workstations:
+            self.installs.append(chunk[['Application', ws]].drop_duplicates())
+
+        # Folding the partial results together now and then keeps the aggregates as small as the distinct groups
+        if len(self.counts) >= 16:
+            self.consolidate()
+
+    # Folds the partial counts, installs and seen keys into one table each
+    def consolidate(self):
+        if self.counts:
+            self.counts = [add_counts(self.counts)]
+        if self.installs:
+            self.installs = [pd.concat(self.installs).drop_duplicates()]
+        for seen in (self.seen, self.v_seen):
+            if len(seen.runs) > 1:
+                seen.runs = [np.unique(np.concatenate(seen.runs))]
+
+    # (dashboard, duplicates, v_full, v_duplicates), the same tables as dashboards.build_dashboards
+    def dashboards(self):
+        return dashboards_from_counts(add_counts(self.counts))
+
+    # WorkstationIndex built from the distinct application/workstation pairs seen, for bundling
+    def workstation_index(self):
+        installs = pd.concat(self.installs) if self.installs else pd.DataFrame(columns=['Application', self.workstation_column])
+        return WorkstationIndex(installs, self.workstation_column)
+
+
+# Streams every file through a StreamingAggregator and returns it
+def stream_inventory(file_paths, workstation_column, chunk_size=500000, cache_dir=DEFAULT_CACHE_DIR, **options):
+    aggregator = StreamingAggregator(workstation_column, **options)
+    for chunk in iter_inventory_chunks(file_paths, aggregator.columns(), chunk_size=chunk_size, cache_dir=cache_dir):
+        aggregator.add(chunk)
+    print('Rows read: ' + str(aggregator.rows_read) + ', rows kept: ' + str(aggregator.rows_kept))
+    return aggregator
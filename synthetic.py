@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from records import sort_categories
+
+# Fake but realistic software inventories with the same columns as the agency exports, for measuring
+# performance without the real data. Everything is drawn from a seeded generator, so the same settings
+# always produce the same inventory.
+
+BRANDS = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Vandelay', 'Stark', 'Wayne', 'Wonka', 'Cyberdyne',
+          'Soylent', 'Tyrell', 'Aperture', 'Gringotts', 'Monarch', 'Oscorp', 'Massive', 'Dunder', 'Pied', 'Bluth',
+          'Nakatomi', 'Virtucon', 'Zorg', 'Sirius', 'Duff', 'Krusty', 'Spacely', 'Cogswell', 'Rekall', 'Omni']
+PUBLISHER_SUFFIXES = ['Inc.', 'Corporation', 'LLC', 'Ltd.', 'Software', 'Systems', 'Technologies']
+PRODUCTS = ['Office', 'Reader', 'Studio', 'Viewer', 'Connect', 'Desktop', 'Analytics', 'Browser', 'Mail', 'Runtime',
+            'Security', 'Backup', 'Sync', 'Designer', 'Workspace', 'Explorer', 'Player', 'Editor', 'Console', 'Agent',
+            'Toolkit', 'Monitor', 'Scanner', 'Publisher', 'Forms', 'Maps', 'Notes', 'Cloud', 'VPN', 'Meeting']
+EDITIONS = ['', '', '', 'Professional', 'Enterprise', 'Standard', 'Plus', 'Lite', 'Pro']
+# Suffixes the normalization rules remove (years, versions, 32/64-bit tags)
+NAME_SUFFIXES = ['', '', '', '', '2016', '2019', '(x64)', '(x86)', '64-bit', 'version 7', 'v2', '(64-bit)', 'x64 en-US']
+# Keywords and publishers the utility flagging picks up
+UTILITY_WORDS = ['Driver', 'Update', 'Installer', 'Utility', 'Plugin', 'Tool']
+UTILITY_PUBLISHERS = ['Intel Corporation', 'Dell Inc.', 'Advanced Micro Devices, Inc.']
+BUNDLE_MEMBERS = ['Core', 'Components', 'Shared Library', 'Add-in', 'Language Pack', 'Services', 'Help', 'Common Files']
+WORKSTATION_OS = ['Microsoft Windows 10 Enterprise', 'Microsoft Windows 10 Pro', 'Microsoft Windows 11 Enterprise']
+SERVER_OS = ['Microsoft Windows Server 2016 Standard', 'Microsoft Windows Server 2019 Datacenter']
+
+
+# Publisher names: the brands with a company suffix, some utility publishers and (gots_rate of the publishers) USDA ones
+def make_publishers(rng, count, gots_rate):
+    names = []
+    for i in range(count):
+        brand = BRANDS[i % len(BRANDS)] + (' ' + str(i // len(BRANDS)) if i >= len(BRANDS) else '')
+        names.append(brand + ' ' + PUBLISHER_SUFFIXES[rng.integers(len(PUBLISHER_SUFFIXES))])
+    names[:len(UTILITY_PUBLISHERS)] = UTILITY_PUBLISHERS[:count]
+    gots = max(1, int(round(count * gots_rate))) if gots_rate > 0 else 0
+    for i in range(gots):
+        names[-1 - i] = 'USDA ' + ['Forest Service', 'NRCS', 'APHIS', 'FSA', 'OCIO'][i % 5] + (' ' + str(i // 5) if i >= 5 else '')
+    return names
+
+
+# A publisher name as it is sometimes misspelled in the exports (the problematic applications)
+def publisher_variant(publisher):
+    if ', ' in publisher:
+        return publisher.replace(', ', ' ', 1)
+    if publisher.endswith('.'):
+        return publisher[:-1]
+    return publisher + ', Inc.'
+
+
+# Version strings of an application, newest first; a few applications have no version at all
+def make_versions(rng, count):
+    major = int(rng.integers(1, 30))
+    minor = int(rng.integers(0, 10))
+    versions = []
+    for i in range(count):
+        build = int(rng.integers(1000, 9999))
+        versions.append(str(major) + '.' + str(max(minor - i, 0)) + '.' + str(build))
+    return versions
+
+
+# The application catalog: one row per (Publisher, Application) with its versions and popularity weight.
+# Popularity follows a Zipf-like curve, as a few applications are on nearly every workstation and most on few.
+def make_catalog(rng, apps, publishers, versions_per_app, gots_rate, utility_rate, publisher_variant_rate, missing_version_rate):
+    publisher_names = make_publishers(rng, publishers, gots_rate)
+    publisher_ids = rng.integers(len(publisher_names), size=apps)
+    entries = []
+    seen = set()
+    for i in range(apps):
+        publisher = publisher_names[publisher_ids[i]]
+        brand = publisher.split()[0]
+        words = [brand, PRODUCTS[rng.integers(len(PRODUCTS))]]
+        if rng.random() < utility_rate:
+            words.append(UTILITY_WORDS[rng.integers(len(UTILITY_WORDS))])
+        words.append(EDITIONS[rng.integers(len(EDITIONS))])
+        words.append(NAME_SUFFIXES[rng.integers(len(NAME_SUFFIXES))])
+        name = ' '.join(word for word in words if word)
+        if (publisher, name) in seen:
+            name = name + ' ' + str(i)
+        seen.add((publisher, name))
+        versions = make_versions(rng, int(rng.integers(1, versions_per_app + 1)))
+        if rng.random() < missing_version_rate:
+            versions = [None]
+        entries.append((publisher, name, versions))
+
+    weights = 1.0 / (rng.permutation(apps) + 1) ** 1.1
+
+    # Some applications also show up under a misspelled publisher name, on a third as many workstations
+    variants = np.flatnonzero(rng.random(apps) < publisher_variant_rate)
+    for i in variants:
+        publisher, name, versions = entries[i]
+        entries.append((publisher_variant(publisher), name, versions))
+
+    catalog = pd.DataFrame(entries, columns=['Publisher', 'Application', 'versions'])
+    catalog['weight'] = np.concatenate([weights, weights[variants] / 3])
+    return catalog
+
+
+# Bundles: groups of applications from one publisher, with a shared name and version, that are installed together
+def make_bundles(rng, bundles, bundle_size, catalog):
+    entries = []
+    publishers = catalog['Publisher'][~catalog['Publisher'].str.startswith('USDA')].unique()
+    for b in range(bundles):
+        publisher = publishers[rng.integers(len(publishers))]
+        stem = publisher.split()[0] + ' ' + PRODUCTS[rng.integers(len(PRODUCTS))] + ' Suite ' + str(b)
+        version = make_versions(rng, 1)[0]
+        members = rng.choice(len(BUNDLE_MEMBERS), size=min(bundle_size, len(BUNDLE_MEMBERS)), replace=False)
+        for m in members:
+            entries.append((b, publisher, stem + ' ' + BUNDLE_MEMBERS[m], version))
+    return pd.DataFrame(entries, columns=['bundle', 'Publisher', 'Application', 'Version'])
+
+
+# Workstation names (plain and encrypted), operating systems and one scan date per workstation
+def make_workstations(rng, workstations, server_rate):
+    ids = np.arange(workstations)
+    system_names = np.array(['WS' + str(i).zfill(7) for i in ids], dtype=object)
+    encrypted = np.array([hashlib.sha1(name.encode('ascii')).hexdigest()[:20].upper() for name in system_names], dtype=object)
+    server = rng.random(workstations) < server_rate
+    os_names = np.where(server, np.array(SERVER_OS, dtype=object)[rng.integers(len(SERVER_OS), size=workstations)],
+                        np.array(WORKSTATION_OS, dtype=object)[rng.integers(len(WORKSTATION_OS), size=workstations)])
+    scans = pd.Timestamp('2021-07-06') - pd.to_timedelta(rng.integers(0, 30, size=workstations), unit='D')
+    return system_names, encrypted, os_names, scans
+
+
+# Share of the workstations each application is installed on: proportional to its popularity weight (at most 95%)
+# and scaled by bisection so that a workstation has installs_per_workstation applications on average
+def install_shares(weights, installs_per_workstation, max_share=0.95):
+    target = min(installs_per_workstation, max_share * len(weights))
+    low, high = 0.0, 1.0
+    while np.minimum(max_share, high * weights).sum() < target:
+        high *= 2
+    for _ in range(60):
+        middle = (low + high) / 2
+        if np.minimum(max_share, middle * weights).sum() < target:
+            low = middle
+        else:
+            high = middle
+    return np.minimum(max_share, high * weights)
+
+
+# Draws the (application, workstation) installs for the given shares, each pair at most once.
+# Common applications get a coin flip per workstation; rare ones draw their workstations at random, where
+# repeats are few and simply dropped.
+def sample_installs(rng, shares, workstations):
+    apps, machines = [], []
+    for app in np.flatnonzero(shares >= 0.02):
+        installed = np.flatnonzero(rng.random(workstations) < shares[app])
+        apps.append(np.full(len(installed), app))
+        machines.append(installed)
+    rare = np.flatnonzero(shares < 0.02)
+    rare_apps = np.repeat(rare, rng.binomial(workstations, shares[rare]))
+    pairs = np.unique(rare_apps.astype(np.int64) * workstations + rng.integers(workstations, size=len(rare_apps)))
+    apps.append(pairs // workstations)
+    machines.append(pairs % workstations)
+    return np.concatenate(apps), np.concatenate(machines)
+
+
+# Builds a column from integer codes into a list of values, as a categorical with sorted categories
+# (the same form load_inventory(..., encode=True) returns)
+def coded_column(codes, values):
+    values = pd.Index(values)
+    return sort_categories(pd.Series(pd.Categorical.from_codes(codes, categories=values)))
+
+
+# Generates an inventory of about `rows` install records over `apps` applications and `workstations` workstations.
+# duplicate_rate of the rows repeat another row exactly (same application, version, workstation and scan date);
+# `bundles` groups of `bundle_size` applications are installed together on about bundle_coverage of the
+# workstations each; server_rate of the workstations are servers and gots_rate of the publishers are USDA ones.
+# Returns a DataFrame with the export columns, its repeated text columns dictionary-encoded.
+def generate_inventory(rows=100000, apps=2000, workstations=2000, publishers=None, versions_per_app=3,
+                       duplicate_rate=0.05, bundles=20, bundle_size=3, bundle_coverage=0.1, server_rate=0.03,
+                       gots_rate=0.02, utility_rate=0.1, publisher_variant_rate=0.03, missing_version_rate=0.01, seed=0):
+    rng = np.random.default_rng(seed)
+    publishers = publishers or max(10, apps // 20)
+    catalog = make_catalog(rng, apps, publishers, versions_per_app, gots_rate, utility_rate, publisher_variant_rate, missing_version_rate)
+    bundle_catalog = make_bundles(rng, bundles, bundle_size, catalog)
+    system_names, encrypted, os_names, scans = make_workstations(rng, workstations, server_rate)
+
+    duplicates = int(rows * duplicate_rate)
+    unique_rows = rows - duplicates
+
+    # Bundle installs: every member of a bundle on the same workstations (each member missing now and then);
+    # bundles take at most a third of the rows so small inventories still have room for everything else
+    bundle_ws, bundle_rows = [], []
+    coverage = bundle_coverage * rng.uniform(0.5, 1.5, size=bundles)
+    total = (coverage * workstations * bundle_catalog.groupby('bundle').size().reindex(range(bundles), fill_value=0)).sum()
+    if total > unique_rows / 3:
+        coverage *= unique_rows / 3 / total
+    for b, members in bundle_catalog.groupby('bundle').groups.items():
+        machines = rng.choice(workstations, size=max(1, int(coverage[b] * workstations)), replace=False)
+        for member in members:
+            installed = machines[rng.random(len(machines)) < 0.97]
+            bundle_ws.append(installed)
+            bundle_rows.append(np.full(len(installed), member))
+    bundle_ws = np.concatenate(bundle_ws) if bundle_ws else np.zeros(0, dtype=np.int64)
+    bundle_rows = np.concatenate(bundle_rows) if bundle_rows else np.zeros(0, dtype=np.int64)
+
+    # Everything else: each application is on a share of the workstations that follows its popularity, at most once
+    # per workstation, and mostly on its newest versions
+    others = max(unique_rows - len(bundle_ws), 0)
+    shares = install_shares(catalog['weight'].values, others / float(workstations))
+    app_rows, other_ws = sample_installs(rng, shares, workstations)
+    version_counts = catalog['versions'].map(len).values
+    version_rows = (rng.random(len(app_rows)) ** 2 * version_counts[app_rows]).astype(np.int64)
+
+    # Application and version lookup tables shared by the catalog and the bundles
+    applications = list(catalog['Application']) + list(bundle_catalog['Application'])
+    publisher_values = list(catalog['Publisher']) + list(bundle_catalog['Publisher'])
+    version_values = [version for versions in catalog['versions'] for version in versions] + list(bundle_catalog['Version'])
+    version_offsets = np.concatenate([[0], np.cumsum(version_counts)])
+    app_codes = np.concatenate([app_rows, len(catalog) + bundle_rows])
+    version_codes = np.concatenate([version_offsets[app_rows] + version_rows, version_offsets[-1] + bundle_rows])
+    ws_codes = np.concatenate([other_ws, bundle_ws])
+
+    # Duplicates repeat rows that are already there
+    repeated = rng.integers(len(app_codes), size=duplicates) if len(app_codes) else np.zeros(0, dtype=np.int64)
+    app_codes = np.concatenate([app_codes, app_codes[repeated]])
+    version_codes = np.concatenate([version_codes, version_codes[repeated]])
+    ws_codes = np.concatenate([ws_codes, ws_codes[repeated]])
+
+    # Exports list the software workstation by workstation
+    order = np.lexsort((app_codes, ws_codes))
+    app_codes, version_codes, ws_codes = app_codes[order], version_codes[order], ws_codes[order]
+
+    # The same application name can belong to two publishers (the misspelled ones), so names are factorized too
+    application_names, application_codes = np.unique(np.array(applications, dtype=object), return_inverse=True)
+    publisher_names, publisher_codes = np.unique(np.array(publisher_values, dtype=object), return_inverse=True)
+    version_names = pd.Index(version_values)
+    known_versions = pd.notna(np.array(version_values, dtype=object))
+    distinct_versions, version_lookup = np.unique(version_names[known_versions].astype(str), return_inverse=True)
+    version_map = np.full(len(version_values), -1)
+    version_map[known_versions] = version_lookup
+    os_names_unique, os_codes = np.unique(os_names.astype(str), return_inverse=True)
+    scan_dates, scan_codes = np.unique(scans.values, return_inverse=True)
+
+    data = pd.DataFrame({
+        'Publisher': coded_column(publisher_codes[app_codes], publisher_names),
+        'Application': coded_column(application_codes[app_codes], application_names),
+        'Version': coded_column(version_map[version_codes], distinct_versions),
+        'Install Date': coded_column(np.zeros(len(app_codes), dtype=np.int64), ['2021-01-04']),
+        'Last HW Scan': coded_column(scan_codes[ws_codes], scan_dates),
+        'OS': coded_column(np.zeros(len(app_codes), dtype=np.int64), ['Windows']),
+        'OS Version': coded_column(np.zeros(len(app_codes), dtype=np.int64), ['10.0']),
+        'Encrypted Workstation Name': coded_column(ws_codes, encrypted),
+        'System Name': coded_column(ws_codes, system_names),
+        'C054': coded_column(os_codes[ws_codes], os_names_unique),
+    })
+    data['AD_Site_Name0'] = 'SITE'
+    data['User'] = 'user'
+    data['Agency'] = 'agency'
+    return data
+
+
+# Writes an inventory as Excel exports of at most rows_per_file rows each (Excel's limit is 1,048,576 rows a sheet)
+def write_inventory(data, directory, rows_per_file=500000, prefix='synthetic_export'):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for part, start in enumerate(range(0, len(data), rows_per_file)):
+        path = os.path.join(directory, prefix + '_' + str(part) + '.xlsx')
+        data.iloc[start:start + rows_per_file].to_excel(path, index=False)
+        print(path)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a fake software inventory with the same columns as the agency exports.')
+    parser.add_argument('directory', help='folder to write the Excel files to')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--apps', type=int, default=2000)
+    parser.add_argument('--workstations', type=int, default=2000)
+    parser.add_argument('--duplicate-rate', type=float, default=0.05)
+    parser.add_argument('--bundles', type=int, default=20)
+    parser.add_argument('--bundle-size', type=int, default=3)
+    parser.add_argument('--rows-per-file', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = generate_inventory(rows=args.rows, apps=args.apps, workstations=args.workstations, duplicate_rate=args.duplicate_rate,
+                              bundles=args.bundles, bundle_size=args.bundle_size, seed=args.seed)
+    write_inventory(data, args.directory, rows_per_file=args.rows_per_file)
@@ -0,0 +1,52 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from records import column_codes, value_at
+
+# The utility rules shipped with the scripts: keywords matched anywhere in the application name (ignoring case)
+# and publishers matched exactly
+DEFAULT_RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utility_rules.json')
+
+
+def load_utility_rules(path=DEFAULT_RULES):
+    with open(path) as f:
+        rules = json.load(f)
+    return {'keywords': list(rules.get('keywords', [])), 'publishers': list(rules.get('publishers', []))}
+
+
+# Flags utility applications. All the keyword rules are compiled into one regular expression and the publisher
+# rules into one set, and they are evaluated once per distinct (Publisher, Application) pair rather than once per
+# install record; the flags are then broadcast back to the rows through the pairs' codes. Adding rules makes the
+# expression longer but never adds another pass over the data.
+class UtilityClassifier:
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = load_utility_rules()
+        self.keywords = [keyword.lower() for keyword in rules['keywords']]
+        self.publishers = set(rules['publishers'])
+        # Names are lowercased first, like the old str.lower().str.contains(keyword)
+        self.pattern = re.compile('|'.join(re.escape(keyword) for keyword in self.keywords)) if self.keywords else None
+
+    # 1 for each (publisher, application) pair that is a utility, 0 otherwise
+    def classify(self, publishers, applications):
+        flags = pd.Series(publishers, dtype=object).isin(self.publishers).values
+        if self.pattern is not None:
+            names = pd.Series(applications, dtype=object).str.lower()
+            flags = flags | names.str.contains(self.pattern, na=False).values
+        return flags.astype(np.int64)
+
+    # Utility flag of every row of data (a 0/1 array in row order)
+    def flag(self, data):
+        publisher_codes, publishers = column_codes(data['Publisher'])
+        application_codes, applications = column_codes(data['Application'])
+        # One code per (publisher, application) pair; missing values get their own code
+        pair_codes = (publisher_codes + 1).astype(np.int64) * (len(applications) + 1) + (application_codes + 1)
+        pairs, rows = np.unique(pair_codes, return_inverse=True)
+        pair_publishers = value_at(publishers, pairs // (len(applications) + 1) - 1)
+        pair_applications = value_at(applications, pairs % (len(applications) + 1) - 1)
+        return self.classify(pair_publishers, pair_applications)[rows.reshape(-1)]
+
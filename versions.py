@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from records import column_codes
+
+# Number of numeric components kept per version ("91.0.4472.124" has four); later ones are ignored
+MAX_COMPONENTS = 4
+# The first dotted run of digits in a version string, e.g. "8.0.2910.10" in "v8.0.2910.10 (x64)". Components are
+# cut at 18 digits so they always fit in an int64.
+VERSION_PATTERN = r'(\d{1,18}(?:\.\d{1,18})*)'
+
+# Installs this many or more versions behind the latest are counted together in the drift report
+MAX_BEHIND = 3
+
+
+# Turns version strings into rows of MAX_COMPONENTS integers, so versions can be compared and sorted as numbers:
+# "1.2", "1.2.0" and "v1.2" all become [1, 2, 0, 0], and "10.0" sorts after "9.1". Strings without any digits
+# ("nan", "", "latest") get a row of -1. Each distinct string is parsed only once, with pandas string ops over all
+# the new strings at a time, and kept in a cache that later calls reuse.
+class VersionParser:
+    def __init__(self, max_components=MAX_COMPONENTS):
+        self.max_components = max_components
+        self.position = {}
+        self.components = np.zeros((0, max_components), dtype=np.int64)
+
+    # Components of each distinct string, parsing the ones not seen before
+    def parse_unique(self, strings):
+        strings = [str(value) for value in strings]
+        new = list(dict.fromkeys(value for value in strings if value not in self.position))
+        if new:
+            numbers = pd.Series(new, dtype=object).str.extract(VERSION_PATTERN, expand=False)
+            parts = numbers.str.split('.', n=self.max_components, expand=True).reindex(columns=range(self.max_components))
+            components = np.zeros((len(new), self.max_components), dtype=np.int64)
+            for i in range(self.max_components):
+                components[:, i] = pd.to_numeric(parts[i], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+            components[numbers.isna().to_numpy()] = -1
+            for value in new:
+                self.position[value] = len(self.position)
+            self.components = np.concatenate([self.components, components])
+        return self.components[[self.position[value] for value in strings]]
+
+    # Components of every value of a column (missing values get -1), parsing each distinct value once
+    def parse(self, series):
+        codes, values = column_codes(pd.Series(series))
+        components = np.vstack([self.parse_unique(values), np.full((1, self.max_components), -1, dtype=np.int64)])
+        return components[np.where(codes >= 0, codes, len(values))]
+
+
+# Shared parser, so a version string is only parsed once per process
+parser = VersionParser()
+
+
+# True where two arrays of components are the same version
+def same_version(components, other):
+    return (components == other).all(axis=1)
+
+
+# Per-application version drift from a dashboard with versions (e.g. v_full): the latest version installed, how many
+# of the # of unique installations run it or are 1, 2 or MAX_BEHIND+ distinct versions behind it, and how spread
+# out the installed versions are (# of distinct versions and major versions, and the oldest one). Versions are
+# compared by their numeric components, so "1.2" and "1.2.0" count as one version; installations whose version
+# has no digits are counted as unparsed.
+# Everything is computed with sorts and array ops over the dashboard rows, not per application.
+def version_drift(dashboard, version_parser=parser):
+    applications = dashboard['Application'].astype(object).to_numpy()
+    app_codes, app_names = pd.factorize(applications)
+    installs = dashboard['# of unique installations'].to_numpy(dtype=np.int64)
+    components = version_parser.parse(dashboard['Version'])
+    parsed = components[:, 0] >= 0
+
+    # Parsed rows sorted by application, then newest version first (and most installed first within a version)
+    rows = np.flatnonzero(parsed)
+    keys = [installs[rows] * -1] + [-components[rows, i] for i in reversed(range(components.shape[1]))] + [app_codes[rows]]
+    rows = rows[np.lexsort(keys)]
+    apps = app_codes[rows]
+    ordered = components[rows]
+    new_app = np.r_[True, apps[1:] != apps[:-1]]
+    new_version = new_app | np.r_[True, ~same_version(ordered[1:], ordered[:-1])]
+    new_major = new_app | np.r_[True, ordered[1:, 0] != ordered[:-1, 0]]
+
+    # Rank of each row's version within its application: 0 for the latest, 1 for the one before...
+    version_number = np.cumsum(new_version)
+    app_start = np.maximum.accumulate(np.where(new_app, version_number, 0))
+    behind = version_number - app_start
+    last_row = np.r_[np.flatnonzero(new_app)[1:], len(rows)] - 1
+
+    report = pd.DataFrame({'Application': app_names})
+    report['Latest Version'] = None
+    report['Oldest Version'] = None
+    first_rows = rows[new_app]
+    versions = dashboard['Version'].astype(object).to_numpy()
+    report.loc[apps[new_app], 'Latest Version'] = versions[first_rows]
+    # The oldest version's most installed spelling is the first row of the application's last version
+    oldest_start = np.maximum.accumulate(np.where(new_version, np.arange(len(rows)), 0))[last_row]
+    report.loc[apps[new_app], 'Oldest Version'] = versions[rows[oldest_start]]
+
+    report['# of versions'] = np.bincount(apps, weights=new_version, minlength=len(app_names)).astype(np.int64)
+    report['# of major versions'] = np.bincount(apps, weights=new_major, minlength=len(app_names)).astype(np.int64)
+    report['# of unique installations'] = np.bincount(app_codes, weights=installs, minlength=len(app_names)).astype(np.int64)
+    capped = np.minimum(behind, MAX_BEHIND)
+    for n in range(MAX_BEHIND + 1):
+        column = 'on latest' if n == 0 else (str(n) + ' behind' if n < MAX_BEHIND else str(n) + '+ behind')
+        report['# ' + column] = np.bincount(apps, weights=installs[rows] * (capped == n), minlength=len(app_names)).astype(np.int64)
+    report['# unparsed'] = np.bincount(app_codes, weights=installs * ~parsed, minlength=len(app_names)).astype(np.int64)
+    report['% on latest'] = (100 * report['# on latest'] / report['# of unique installations'].where(report['# of unique installations'] > 0)).round(1)
+
+    return report.sort_values(by=['# of unique installations', 'Application'], ascending=[False, True]).reset_index(drop=True)
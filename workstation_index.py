@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+
+# One-time index from each application (or application + version) to the sorted integer IDs of the
+# workstations it is installed on, so co-installation numbers never have to scan the install data again.
+# The IDs for every application are stored back to back in one array (`offsets` marks where each one starts).
+class WorkstationIndex:
+    def __init__(self, data, workstation_column, by_version=False):
+        self.workstation_column = workstation_column
+        self.by_version = by_version
+
+        ws_codes, self.workstation_names = pd.factorize(data[workstation_column])
+        app_codes, self.keys = factorize_keys(data, ['Application', 'Version'] if by_version else ['Application'])
+        self.lookup = {key: code for code, key in enumerate(self.keys)}
+
+        # Rows without an application or workstation can't be matched to anything
+        valid = (app_codes >= 0) & (ws_codes >= 0)
+        n_workstations = max(len(self.workstation_names), 1)
+        pairs = np.unique(app_codes[valid].astype(np.int64) * n_workstations + ws_codes[valid])
+
+        self.workstation_ids = (pairs % n_workstations).astype(np.int32)
+        self.offsets = np.searchsorted(pairs // n_workstations, np.arange(len(self.keys) + 1))
+        self.sizes = np.diff(self.offsets)
+
+    # Sorted workstation IDs for an application name (or (name, version) tuple when built by_version)
+    def workstations(self, key):
+        code = self.lookup.get(key)
+        if code is None:
+            return self.workstation_ids[:0]
+        return self.workstation_ids[self.offsets[code]:self.offsets[code + 1]]
+
+    # Names of the workstations an application is installed on
+    def workstation_names_for(self, key):
+        return self.workstation_names[self.workstations(key)]
+
+    # Number of distinct workstations an application is installed on
+    def count(self, key):
+        return len(self.workstations(key))
+
+    # Number of workstations both applications are installed on
+    def overlap(self, key, other):
+        return len(np.intersect1d(self.workstations(key), self.workstations(other), assume_unique=True))
+
+    # Jaccard similarity (0 to 1) of the two applications' workstation sets
+    def jaccard(self, key, other):
+        shared = self.overlap(key, other)
+        union = self.count(key) + self.count(other) - shared
+        if union == 0:
+            return 0.0
+        return shared / float(union)
+
+
+# Factorizes one or more key columns together, returning an integer code per row (-1 when any part is missing)
+# and the list of distinct keys (plain values for one column, tuples for several)
+def factorize_keys(data, columns):
+    if len(columns) == 1:
+        codes, uniques = pd.factorize(data[columns[0]])
+        return codes, list(uniques)
+
+    combined = np.zeros(len(data), dtype=np.int64)
+    missing = np.zeros(len(data), dtype=bool)
+    parts = []
+    for column in columns:
+        codes, uniques = pd.factorize(data[column])
+        combined = combined * (len(uniques) + 1) + codes + 1
+        missing |= codes < 0
+        parts.append(uniques)
+
+    codes, unique_combined = pd.factorize(combined)
+    keys = []
+    for value in unique_combined:
+        key = []
+        for uniques in reversed(parts):
+            value, code = divmod(value, len(uniques) + 1)
+            key.append(uniques[code - 1] if code > 0 else None)
+        keys.append(tuple(reversed(key)))
+
+    codes = np.where(missing, -1, codes)
+    return codes, keys